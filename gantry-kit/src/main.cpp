@@ -104,6 +104,12 @@ const float motorDir[4] = {1, 1, -1, -1};
 // Maximum time in Loop before idle mode (s)
 const unsigned long HomeTime = 90;
 
+// Polling interval whilst waiting for commands (ms)
+const unsigned long LOOP_DELAY = 10;
+
+// Maximum number of waypoints accepted by a single path command
+const int MAX_WAYPOINTS = 8;
+
 // Define variables to change during Loop
 float x = 0;
 float y = 0;
@@ -111,6 +117,8 @@ float z = 0;
 
 float vol = 0;
 int count = 0;
+int waypoints = 0;
+float path[MAX_WAYPOINTS][3];
 float displacement = 0;
 float mixAccel = MAX_ACCEL;
 
@@ -122,8 +130,26 @@ unsigned long ElapsedTime;
 long steps;
 String action;
 
+// Command received from PC, and position of next field to parse
+String command;
+int cursor = 0;
+
 bool homed = false;
 
+String nextField(char terminator) {
+    // Same as Serial.readStringUntil(), but from the command already received
+    int end = command.indexOf(terminator, cursor);
+
+    if (end < 0) {
+        end = command.length();
+    }
+
+    String field = command.substring(cursor, end);
+    cursor = end + 1;
+
+    return field;
+};
+
 void relayOn() {
     digitalWrite(RELAY_PIN, HIGH);
     delay(500);
@@ -257,7 +283,7 @@ void gantrySoftHome() {
     homed = true;
 };
 
-void gantryMove(float x, float y, float z) {
+void gantryMove(float x, float y, float z, bool report = true) {
     StartTime = ceil( millis() / 1000 );
 
     // check if requested angle is with in hardcoded limits
@@ -292,11 +318,28 @@ void gantryMove(float x, float y, float z) {
     motorsRun();
     homed = false;
 
+    if (report == true) {
+        CurrentTime = ceil( millis() / 1000 );
+        ElapsedTime = CurrentTime - StartTime;
+        
+        // Report back to PC
+        Serial.println("Move complete in " + String(ElapsedTime) + "s");
+    }
+};
+
+void gantryPath(int points) {
+    unsigned long PathStartTime = ceil( millis() / 1000 );
+
+    // Run queued waypoints back to back, only reporting once the whole path is complete
+    for (int i=0; i<points; i++) {
+        gantryMove(path[i][0], path[i][1], path[i][2], false);
+    }
+
     CurrentTime = ceil( millis() / 1000 );
-    ElapsedTime = CurrentTime - StartTime;
-    
+    ElapsedTime = CurrentTime - PathStartTime;
+
     // Report back to PC
-    Serial.println("Move complete in " + String(ElapsedTime) + "s");
+    Serial.println("Path complete in " + String(ElapsedTime) + "s");
 };
 
 void gantryZero() {
@@ -403,65 +446,100 @@ void setup() {
 
 void loop() {
     // Main code here, to run repeatedly on a loop 
-    delay(500);
+    delay(LOOP_DELAY);
 
     // Wait until data received from PC, via Serial (USB)
     if (Serial.available() > 0) {
+        // data structure to receive = action(var1, var2..)
+        // Read whole command before turning on motor power, otherwise only the 64 byte serial buffer
+        // holds the rest of a long path command during the relay delay
+        command = Serial.readStringUntil(')');
+        cursor = 0;
+
         // Turn on motor power when command received
         relayOn();
 
-        // data structure to receive = action(var1, var2..)
         // Read until open bracket to extract action, continue based on which action was requested
-        action = Serial.readStringUntil('(');
+        action = nextField('(');
 
         if (action == "move") {
             // Extract variables spaced by commas, then last variable up to closed bracket
-            x = Serial.readStringUntil(',').toFloat() - x_shift;
-            y = Serial.readStringUntil(',').toFloat();
-            z = Serial.readStringUntil(')').toFloat();
+            x = nextField(',').toFloat() - x_shift;
+            y = nextField(',').toFloat();
+            z = nextField(')').toFloat();
             
             // Call action using received variables
             gantryMove(x, y, z);
         }
+        else if (action == "path") {
+            // data structure to receive = path(n, x1, y1, z1, .. xn, yn, zn)
+            waypoints = nextField(',').toInt();
+
+            // Queue all waypoints before moving, reading every value even if too many were sent
+            for (int i=0; i<waypoints; i++) {
+                x = nextField(',').toFloat() - x_shift;
+                y = nextField(',').toFloat();
+
+                if (i == waypoints - 1) {
+                    z = nextField(')').toFloat();
+                }
+                else {
+                    z = nextField(',').toFloat();
+                }
+
+                if (i < MAX_WAYPOINTS) {
+                    path[i][0] = x;
+                    path[i][1] = y;
+                    path[i][2] = z;
+                }
+            }
+
+            if ((waypoints < 1) || (waypoints > MAX_WAYPOINTS)) {
+                Serial.println("Unknown command");
+            }
+            else {
+                gantryPath(waypoints);
+            }
+        }
         else if (action == "softHome") {
-            x = Serial.readStringUntil(')').toFloat();
+            x = nextField(')').toFloat();
             
             gantrySoftHome();
         }
         else if (action == "hardHome") {
-            x = Serial.readStringUntil(')').toFloat();
+            x = nextField(')').toFloat();
             
             gantryHardHome();
         }
         else if (action == "zQuickHome") {
-            x = Serial.readStringUntil(')').toFloat();
+            x = nextField(')').toFloat();
             
             zQuickHome();
         }
         else if (action == "gantryZero") {
-            x = Serial.readStringUntil(')').toFloat();
+            x = nextField(')').toFloat();
             
             gantryZero();
         }
         else if (action == "mix") {
-            count = Serial.readStringUntil(',').toInt();
-            displacement = Serial.readStringUntil(',').toFloat();
-            mixAccel = Serial.readStringUntil(')').toFloat();
+            count = nextField(',').toInt();
+            displacement = nextField(',').toFloat();
+            mixAccel = nextField(')').toFloat();
 
             gantryMix(count, displacement, mixAccel);
         }
         else if (action == "pinch") {
-            x = Serial.readStringUntil(')').toFloat();
+            x = nextField(')').toFloat();
 
             pinchPipettes();
         }
         else if (action == "release") {
-            x = Serial.readStringUntil(')').toFloat();
+            x = nextField(')').toFloat();
 
             releasePipettes();
         }
         else if (action == "returnState") {
-            x = Serial.readStringUntil(')').toFloat();
+            x = nextField(')').toFloat();
 
             Serial.println("Gantry Kit Ready");
         }
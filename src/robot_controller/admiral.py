@@ -1,8 +1,8 @@
 import logging
+import math
 import os
 import sys
 
-import pandas as pd
 import serial
 import serial.tools
 import serial.tools.list_ports
@@ -25,6 +25,8 @@ from SquidstatPyLibrary import (
     AisSquareWaveVoltammetryElement,
 )
 
+from robot_controller import clock, column_buffer, spectrum_store, tracing
+
 # Suppress FutureWarning messages from Pandas
 logging.basicConfig(level = logging.INFO)
 
@@ -40,6 +42,12 @@ class squidstat:
 
         self.mode = 0 # Default to EIS
 
+        # Length of built experiment, used to time simulated measurements
+        self.expected_duration = 0.0 # s
+        self.default_duration = 60 # s, if length cannot be estimated
+        self.eis_periods = 3 # cycles measured per frequency
+        self.eis_point_time = 0.5 # s, minimum per frequency
+
         self.results_path = "data/results/"
 
         # Create results folder if first time running code on PC
@@ -73,6 +81,10 @@ class squidstat:
                 "Step Number", 
                 "Substep Number",
             ]
+
+        # AC and DC data kept in binary store (keyed by identifier), set true to also write CSV files
+        self.store = spectrum_store.spectrum_store(os.path.join(self.results_path, "spectra"), {"AC": self.ac_columns, "DC": self.dc_columns})
+        self.write_csv = False
         
         self.modes = {
             "0. EIS_Potentiostatic": self.build_EIS_potentiostatic_experiment,
@@ -123,6 +135,7 @@ class squidstat:
             logging.error("Provided Squidstat COM port not found.")
             sys.exit()
 
+    @tracing.traced("squidstat")
     def take_measurements(self, identifier: str) -> None:
         logging.info("Attempting to begin Squidstat experiment (Dataset: " + identifier + ")..")
 
@@ -144,32 +157,38 @@ class squidstat:
     def save_data(self, identifier: str) -> None:
         logging.info("Checking if Squidstat data is available..")
 
-        dc_path = self.get_dc_path(identifier)
-        ac_path = self.get_ac_path(identifier)
-
         if (self.ac_data.empty is True) and (self.dc_data.empty is True):
             logging.error("No data available!")
             
         elif self.ac_data.empty is True:  
-            logging.info("Only DC data found.")
-            self.dc_data.to_csv(dc_path)
+            logging.info(f"Only DC data found ({len(self.dc_data)} points).")
+            self.store_data("DC", identifier, self.dc_data)
         
         elif self.dc_data.empty is True:
-            logging.info("Only AC data found.")
-            self.ac_data.to_csv(ac_path)
+            logging.info(f"Only AC data found ({len(self.ac_data)} points).")
+            self.store_data("AC", identifier, self.ac_data)
         
         else:
-            logging.info("AC and DC data found.")
-            self.ac_data.to_csv(ac_path)
-            self.dc_data.to_csv(dc_path)
+            logging.info(f"AC and DC data found ({len(self.ac_data)} and {len(self.dc_data)} points).")
+            self.store_data("AC", identifier, self.ac_data)
+            self.store_data("DC", identifier, self.dc_data)
+
+    def store_data(self, kind: str, identifier: str, data: column_buffer.column_buffer) -> None:
+        self.store.append(kind, identifier, data.to_array())
+
+        if self.write_csv is True:
+            if kind == "AC":
+                data.to_dataframe().to_csv(self.get_ac_path(identifier))
+            else:
+                data.to_dataframe().to_csv(self.get_dc_path(identifier))
 
     def reset_dataframes(self) -> None:
         logging.info("Resetting AC and DC dataframes..")
 
-        # Clear AC and DC data dataframes
-        self.ac_data = pd.DataFrame(columns=self.ac_columns)
-        self.dc_data = pd.DataFrame(columns=self.dc_columns)
-        self.elements = pd.DataFrame(columns=self.step_colums)
+        # Clear AC and DC data buffers (converted to dataframes when saved)
+        self.ac_data = column_buffer.column_buffer(self.ac_columns)
+        self.dc_data = column_buffer.column_buffer(self.dc_columns)
+        self.elements = column_buffer.column_buffer(self.step_colums, capacity=16, dtypes={"Step Name": object, "Step Number": object, "Substep Number": object})
 
     def upload_experiment(self) -> None:
         # Internal function, to be run after the element (measurement) has been appended to the experiment
@@ -200,37 +219,32 @@ class squidstat:
             if self.sim is False:
                 self.upload_experiment()
                 self.trigger_experiment()
+            else:
+                clock.simulate(self.expected_duration)
         else:
             logging.error("No experiment has been built.")
 
     def increment_dc_data(self, channel: int, data: any) -> None:
-        # Append incoming data to dataframe
+        # Append incoming data to buffer
         # channel variable expected in connected function (see https://admiral-instruments.github.io/AdmiralSquidstatAPI/md_intro_and_examples_9__python_example.html)
 
-        logging.info(f"Extracting DC data from channel {channel}..")
+        # Called for every data point, so only every 50th is logged
+        logging.info(f"Extracting DC data from channel {channel}..", extra={"sample": 50})
 
         if data.timestamp is not None:
-            values = [
+            self.dc_data.append([
                 data.timestamp,
                 data.workingElectrodeVoltage, 
                 data.current, 
                 data.temperature
-            ]
-            
-            next = pd.DataFrame([dict(zip(self.dc_columns, values))])
-
-            if self.dc_data.empty:
-                self.dc_data = next
-            else:
-                # Append new data to dataframe
-                self.dc_data = pd.concat([self.dc_data, next], ignore_index=True)
+            ])
 
     def increment_ac_data(self, channel: int, data: any) -> None:
-        # Append incoming data to dataframe
-        logging.info(f"Extracting AC data from channel {channel}..")
+        # Append incoming data to buffer
+        logging.info(f"Extracting AC data from channel {channel}..", extra={"sample": 50})
 
         if data.timestamp is not None:
-            values = [
+            self.ac_data.append([
                 data.timestamp,
                 data.frequency,
                 data.absoluteImpedance,
@@ -243,33 +257,17 @@ class squidstat:
                 data.DCCurrent,
                 data.currentAmplitude,
                 data.voltageAmplitude
-            ]
-
-            next = pd.DataFrame([dict(zip(self.ac_columns, values))])
-
-            if self.ac_data.empty:
-                self.ac_data = next
-            else:
-                # Append new data to dataframe
-                self.ac_data = pd.concat([self.ac_data, next], ignore_index=True)
+            ])
 
     def increment_elements(self, channel: int, data: any) -> None:
-        # Append incoming data to dataframe
+        # Append incoming data to buffer
         logging.info(f"Extracting element data from channel {channel}..")
 
-        values = [
+        self.elements.append([
             data.stepName,
             data.stepNumber,
             data.substepNumber
-        ]
-
-        next = pd.DataFrame([dict(zip(self.step_colums, values))])
-
-        if self.elements.empty:
-            self.elements = next
-        else:
-            # Append new data to dataframe
-            self.elements = pd.concat([self.elements, next], ignore_index=True)
+        ])
 
     def handle_device_connected(self, device_name: str) -> None:
         logging.info("Connected device is: " + device_name + ".")
@@ -278,9 +276,17 @@ class squidstat:
         logging.info(f"Experiment completed on channel {channel}.")
         self.app.quit()
     
-    def append_element(self, experiment: any, element: any, cycles: int = 1) -> None:
+    def eis_duration(self, start_frequency: float, end_frequency: float, points_per_decade: int) -> float:
+        # Low frequencies dominate, each point needs several periods
+        points = math.ceil(abs(math.log10(start_frequency / end_frequency)) * points_per_decade) + 1
+        frequencies = [start_frequency * (end_frequency / start_frequency) ** (i / max(points - 1, 1)) for i in range(points)]
+
+        return sum(max(self.eis_periods / frequency, self.eis_point_time) for frequency in frequencies)
+
+    def append_element(self, experiment: any, element: any, cycles: int = 1, duration: float | None = None) -> None:
         if experiment.appendElement(element, cycles) is True:
             self.experiment = experiment
+            self.expected_duration = cycles * (self.default_duration if duration is None else duration)
         else:
             logging.error("Failed to build experiment!")
             sys.exit()
@@ -318,7 +324,7 @@ class squidstat:
             voltage_amplitude,
         )
 
-        self.append_element(experiment, element, cycles)
+        self.append_element(experiment, element, cycles, self.eis_duration(start_frequency, end_frequency, points_per_decade))
         
     def build_cyclic_voltammetry_experiment(
         self,
@@ -365,7 +371,7 @@ class squidstat:
             duration,
         )
 
-        self.append_element(experiment, element)
+        self.append_element(experiment, element, duration=duration)
 
     def build_constant_potential_experiment(
         self,
@@ -385,7 +391,7 @@ class squidstat:
             duration,
         )
         
-        self.append_element(experiment, element)
+        self.append_element(experiment, element, duration=duration)
 
     def build_constant_power_experiment(
         self,
@@ -412,7 +418,7 @@ class squidstat:
             sampling_interval,
         )
 
-        self.append_element(experiment, element)
+        self.append_element(experiment, element, duration=duration)
 
     def build_constant_resistance_experiment(
         self,
@@ -432,7 +438,7 @@ class squidstat:
             sampling_interval,
         )
 
-        self.append_element(experiment, element)
+        self.append_element(experiment, element, duration=duration)
 
     def build_DC_current_sweep_experiment(
         self,
@@ -578,7 +584,7 @@ class squidstat:
             current_amplitude,
         )
 
-        self.append_element(experiment, element, cycles)
+        self.append_element(experiment, element, cycles, self.eis_duration(start_frequency, end_frequency, points_per_decade))
 
     def build_OCP_experiment(
             self, 
@@ -596,4 +602,4 @@ class squidstat:
             sampling_interval,
         )
 
-        self.append_element(experiment, element)
\ No newline at end of file
+        self.append_element(experiment, element, duration=duration)
\ No newline at end of file
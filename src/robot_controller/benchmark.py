@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, TypeVar
+
+import numpy as np
+
+from robot_controller import device_emulators, hardware_scheduler
+
+logging.basicConfig(level = logging.INFO)
+
+R = TypeVar("R")
+
+class phase_recorder:
+    def __init__(self, emulators: dict[str, device_emulators.serial_emulator]) -> None:
+        # Cost of each phase of an iteration: latency, serial traffic for each device, CPU time of the controllers
+        # (emulator threads excluded) and peak Python memory allocated during the phase
+        self.emulators = emulators
+        self.phases: dict[str, dict] = {}
+
+    def counters(self) -> dict[str, tuple[int, int, int]]:
+        return {name: (emulator.commands, emulator.bytes_received, emulator.bytes_sent) for name, emulator in self.emulators.items()}
+
+    def emulator_cpu(self) -> float:
+        return sum(emulator.cpu_time() for emulator in self.emulators.values())
+
+    def measure(self, phase: str, function: Callable[..., R], *args: object, **kwargs: object) -> R:
+        before = self.counters()
+        emulator_cpu = self.emulator_cpu()
+
+        tracemalloc.reset_peak()
+        memory = tracemalloc.get_traced_memory()[0]
+
+        cpu = time.process_time()
+        start = time.perf_counter()
+
+        result = function(*args, **kwargs)
+
+        latency = time.perf_counter() - start
+        cpu = time.process_time() - cpu - (self.emulator_cpu() - emulator_cpu)
+        peak = tracemalloc.get_traced_memory()[1] - memory
+
+        # Commands are round trips, except gantryZero which has no response
+        devices = {}
+
+        for name, (commands, received, sent) in self.counters().items():
+            if commands != before[name][0]:
+                devices[name] = {"round_trips": commands - before[name][0], "bytes_out": received - before[name][1], "bytes_in": sent - before[name][2]}
+
+        self.phases[phase] = {"latency": latency, # s
+                              "cpu_time": max(cpu, 0.0), # s
+                              "peak_memory": max(peak, 0), # bytes
+                              "round_trips": sum(device["round_trips"] for device in devices.values()),
+                              "bytes": sum(device["bytes_out"] + device["bytes_in"] for device in devices.values()),
+                              "devices": devices,
+            }
+
+        return result
+
+    def total(self) -> dict:
+        return {"latency": sum(phase["latency"] for phase in self.phases.values()),
+                "cpu_time": sum(phase["cpu_time"] for phase in self.phases.values()),
+                "peak_memory": max([phase["peak_memory"] for phase in self.phases.values()], default=0),
+                "round_trips": sum(phase["round_trips"] for phase in self.phases.values()),
+                "bytes": sum(phase["bytes"] for phase in self.phases.values()),
+            }
+
+class station_benchmark:
+    def __init__(self, recipe_file: str = "data/benchmarks/recipes.json", results_file: str = "data/benchmarks/results.jsonl", time_scale: float = 10.0) -> None:
+        # One campaign iteration (update_dose_volumes -> synthesise -> analyse -> clean) for each representative
+        # recipe, run by the scheduler against emulated devices. Each iteration is appended to results_file,
+        # and compared with earlier runs at the same time scale to catch regressions.
+        self.recipe_file = recipe_file
+        self.results_file = os.path.abspath(results_file) # scheduler runs in its own working directory
+        self.time_scale = time_scale # device time speed up, wall clock waits in the controllers are unchanged
+
+        self.device_name = "emulated"
+        self.metrics = ["latency", "cpu_time", "peak_memory", "round_trips", "bytes"]
+
+        # Serial traffic is deterministic for a recipe, so compared against the tolerance. Timings and memory vary
+        # from run to run, so are only a regression if also above the noise band of the baseline runs.
+        self.exact_metrics = ["round_trips", "bytes"]
+        self.noise_limit = 3 # robust standard deviations (scaled median absolute deviation) above baseline
+
+        with open(recipe_file) as file:
+            self.recipes = json.load(file)["Recipes"]
+
+    def commit(self) -> str | None:
+        try:
+            return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def run(self, iterations: int = 1, names: list[str] | None = None) -> list[dict]:
+        recipes = [recipe for recipe in self.recipes if names is None or recipe["name"] in names]
+
+        emulators = device_emulators.emulate_station(time_scale=self.time_scale)
+        recorder = phase_recorder(emulators)
+
+        tracemalloc.start()
+
+        header = {"run": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "commit": self.commit(),
+                  "python": platform.python_version(),
+                  "time_scale": self.time_scale,
+            }
+
+        # Scheduler keeps its journal, saved recipe and results under data/, so it runs in a scratch copy to leave
+        # the campaign's resume state and experiment database untouched
+        workspace = tempfile.TemporaryDirectory(prefix="station_benchmark_")
+        previous = os.getcwd()
+
+        for folder in ["data/devices", "data/recipes"]:
+            shutil.copytree(folder, os.path.join(workspace.name, folder))
+
+        os.chdir(workspace.name)
+
+        try:
+            device = recorder.measure("connect", hardware_scheduler.scheduler, device_name=self.device_name)
+            startup = recorder.phases.pop("connect")
+
+            records = []
+
+            for recipe in recipes:
+                temp = recipe.get("temperature", 25)
+
+                for iteration in range(iterations):
+                    logging.info(f"Benchmarking {recipe['name']} recipe, iteration {iteration+1} of {iterations}..")
+                    recorder.phases = {}
+
+                    recorder.measure("update_dose_volumes", device.update_dose_volumes, recipe["values"])
+                    recorder.measure("set_temperature", device.test_cell.peltier.set_temperature, temp)
+                    recorder.measure("synthesise", device.synthesise)
+                    recorder.measure("analyse", device.analyse, temp)
+                    recorder.measure("clean", device.clean)
+
+                    records.append({**header, "recipe": recipe["name"], "iteration": iteration, "startup": startup, "phases": recorder.phases, "total": recorder.total()})
+
+            device.close_all_ports()
+
+        finally:
+            tracemalloc.stop()
+
+            os.chdir(previous)
+            workspace.cleanup()
+
+            for emulator in emulators.values():
+                emulator.stop()
+
+        self.save(records)
+        return records
+
+    def save(self, records: list[dict]) -> None:
+        folder = os.path.dirname(self.results_file)
+        if folder != "" and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with open(self.results_file, 'a') as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+
+    def history(self) -> list[dict]:
+        if not os.path.exists(self.results_file):
+            return []
+
+        with open(self.results_file) as file:
+            return [json.loads(line) for line in file if line.strip() != ""]
+
+    def compare(self, records: list[dict], tolerance: float = 0.1, window: int = 5) -> list[str]:
+        # Median of the last window runs of each recipe at this time scale is the baseline, anything more
+        # than tolerance above it (and for noisy metrics, outside the spread of those runs) is a regression
+        current = {record["run"] for record in records}
+        history = self.history()
+        regressions = []
+
+        for record in records:
+            previous = [old for old in history if old["run"] not in current and old["recipe"] == record["recipe"] and old["time_scale"] == record["time_scale"]]
+            runs = sorted({old["run"] for old in previous})[-window:]
+            previous = [old for old in previous if old["run"] in runs]
+
+            if len(previous) == 0:
+                continue
+
+            for phase, values in record["phases"].items():
+                for metric in self.metrics:
+                    baseline = [old["phases"][phase][metric] for old in previous if phase in old["phases"]]
+
+                    if len(baseline) == 0:
+                        continue
+
+                    median = float(np.median(baseline))
+                    limit = tolerance * median
+
+                    if metric not in self.exact_metrics:
+                        spread = 1.4826 * float(np.median(np.abs(np.array(baseline) - median)))
+                        limit = max(limit, self.noise_limit * spread)
+
+                    if median > 0 and values[metric] > median + limit:
+                        regressions.append(f"{record['recipe']} {phase} {metric}: {round(values[metric], 3)} against baseline of {round(median, 3)} (+{round(100 * (values[metric] / median - 1), 1)}%).")
+
+        return regressions
+
+    def report(self, records: list[dict]) -> None:
+        for record in records:
+            logging.info(f"{record['recipe']} (iteration {record['iteration']+1}): phase, latency (s), CPU (s), round trips, bytes, peak memory (kB)")
+
+            for phase, values in {**record["phases"], "total": record["total"]}.items():
+                logging.info(f"    {phase:<20} {values['latency']:>9.2f} {values['cpu_time']:>8.3f} {values['round_trips']:>11} {values['bytes']:>8} {values['peak_memory'] / 1024:>10.1f}")
@@ -0,0 +1,69 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class wall_clock:
+    # Real time, used whenever hardware is connected
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def simulate(self, seconds: float) -> None:
+        # Duration a simulated device would have taken on the station, not waited for in real time
+        pass
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+class virtual_clock:
+    def __init__(self, start: datetime | None = None) -> None:
+        # Simulated time: sleeps and simulated device durations advance the clock instantly, so a campaign
+        # runs in seconds whilst elapsed keeps the time the real station would have taken
+        self.start = datetime.now() if start is None else start
+        self.elapsed = 0.0 # s
+
+        self.lock = threading.Lock()
+
+    def monotonic(self) -> float:
+        return self.elapsed
+
+    def sleep(self, seconds: float) -> None:
+        with self.lock:
+            self.elapsed += max(seconds, 0)
+
+    def simulate(self, seconds: float) -> None:
+        self.sleep(seconds)
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=self.elapsed)
+
+# Clock used by all controllers, replaced with a virtual clock to simulate a campaign
+current = wall_clock()
+
+def get_clock() -> wall_clock | virtual_clock:
+    return current
+
+def set_clock(new_clock: wall_clock | virtual_clock) -> wall_clock | virtual_clock:
+    # Returns previous clock, so it can be restored
+    global current
+
+    previous = current
+    current = new_clock
+
+    return previous
+
+def monotonic() -> float:
+    return current.monotonic()
+
+def sleep(seconds: float) -> None:
+    current.sleep(seconds)
+
+def simulate(seconds: float) -> None:
+    current.simulate(seconds)
+
+def now() -> datetime:
+    return current.now()
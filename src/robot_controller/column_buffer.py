@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+
+class column_buffer:
+    def __init__(self, columns: list[str], capacity: int = 1024, dtypes: dict | None = None) -> None:
+        # Growable columnar store for streamed samples: one NumPy array per column, appended in place
+        # and doubled when full, so each sample costs O(1). Converted to a DataFrame once at the end.
+        self.columns = columns
+        self.dtypes = {column: float for column in columns}
+
+        if dtypes is not None:
+            self.dtypes.update(dtypes)
+
+        self.capacity = max(capacity, 1)
+        self.clear()
+
+    def clear(self) -> None:
+        self.length = 0
+        self.arrays = {column: np.empty(self.capacity, dtype=self.dtypes[column]) for column in self.columns}
+
+    def __len__(self) -> int:
+        return self.length
+
+    @property
+    def empty(self) -> bool:
+        return self.length == 0
+
+    def grow(self) -> None:
+        self.capacity *= 2
+
+        for column in self.columns:
+            array = np.empty(self.capacity, dtype=self.dtypes[column])
+            array[:self.length] = self.arrays[column][:self.length]
+            self.arrays[column] = array
+
+    def append(self, values: list) -> None:
+        # Values in the same order as columns, missing values (None) stored as NaN in float columns
+        if self.length == self.capacity:
+            self.grow()
+
+        for column, value in zip(self.columns, values):
+            if value is None and self.dtypes[column] is float:
+                value = np.nan
+
+            self.arrays[column][self.length] = value
+
+        self.length += 1
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame({column: self.arrays[column][:self.length] for column in self.columns}, columns=self.columns)
+
+    def to_array(self, dtype: type = np.float64) -> np.ndarray:
+        # One row per sample, e.g. for binary storage (all columns must be numeric)
+        return np.column_stack([self.arrays[column][:self.length].astype(dtype) for column in self.columns])
@@ -0,0 +1,60 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+logging.basicConfig(level = logging.INFO)
+
+R = TypeVar("R")
+
+# Guards creation of each device's command queue, which may first be submitted to from several threads
+queue_lock = threading.Lock()
+
+class command_queue:
+    def __init__(self, name: str) -> None:
+        # One worker thread per device: commands to the same serial port stay in order,
+        # whilst commands to different ports run at the same time
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    def submit(self, command: Callable[..., R], *args: object, **kwargs: object) -> Future[R]:
+        return self.executor.submit(command, *args, **kwargs)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+class queued_device:
+    # Mixin giving every hardware controller a non-blocking version of each command, e.g.
+    # gantry.submit("move", x, y, z) returns a future that completes when the gantry kit responds.
+    # Wait for a device's futures before calling it directly again, as they share the same serial port.
+    commands: command_queue | None = None # created on first submit
+
+    def submit(self, command: str, *args: object, **kwargs: object) -> Future:
+        with queue_lock:
+            if self.commands is None:
+                self.commands = command_queue(type(self).__name__)
+
+            commands = self.commands
+
+        return commands.submit(getattr(self, command), *args, **kwargs)
+
+    def close_commands(self) -> None:
+        with queue_lock:
+            commands = self.commands
+            self.commands = None
+
+        # Outside the lock, as queued commands may still be submitting to other devices
+        if commands is not None:
+            commands.close()
+
+def wait_all(futures: list[Future], timeout: float | None = None) -> list[Any]:
+    # Wait for all commands to complete, re-raising the first failure
+    deadline = None if timeout is None else time.monotonic() + timeout
+    results = []
+
+    for future in futures:
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        results.append(future.result(timeout=remaining))
+
+    return results
@@ -0,0 +1,997 @@
+import logging
+import math
+import os
+import random
+import re
+import select
+import threading
+import time
+import tty
+from collections import deque
+from typing import Callable
+
+logging.basicConfig(level = logging.INFO)
+
+class device_reset(Exception):
+    # Raised inside emulated firmware to abandon what it was doing, e.g. an Arduino rebooting when its port is opened
+    pass
+
+def to_float(text: str) -> float:
+    # Arduino String.toFloat(): leading number only, 0 if there is none
+    match = re.match(r"\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?", text)
+    return float(match.group(0)) if match is not None else 0.0
+
+def to_int(text: str) -> int:
+    # Arduino String.toInt()
+    match = re.match(r"\s*[-+]?\d+", text)
+    return int(match.group(0)) if match is not None else 0
+
+def format_value(value: float) -> str:
+    # Registers written as integers are read back as integers
+    return str(int(value)) if float(value).is_integer() else str(round(value, 4))
+
+class serial_emulator:
+    def __init__(self, name: str, baudrate: int, time_scale: float = 1.0, link: str | None = None, resets: bool = False, buffer_size: int | None = None) -> None:
+        # Pseudo-terminal standing in for a USB serial device, opened by the controllers exactly as real hardware
+        # (use port, or link if given). Bytes sent by the controller reach the firmware at the baud rate, and device
+        # time (delays, motion, millis) runs time_scale times faster than real time.
+        self.name = name
+        self.baudrate = baudrate
+        self.time_scale = time_scale
+        self.link = link
+        self.resets = resets # Arduino boards reboot whenever the port is opened (DTR)
+        self.buffer_size = buffer_size # bytes, anything received beyond this whilst the firmware is busy is lost
+
+        self.boot_time = 1.0 # s, bootloader after a reset
+
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+
+        # Slave is left closed so a controller opening or closing the port shows up as the hang up clearing or returning
+        os.close(slave)
+
+        if link is not None:
+            folder = os.path.dirname(link)
+            if folder != "" and not os.path.exists(folder):
+                os.makedirs(folder)
+
+            if os.path.lexists(link):
+                os.remove(link)
+
+            os.symlink(self.port, link)
+
+        self.incoming = deque() # (arrival time, byte) still on the wire
+        self.received = bytearray() # serial buffer readable by firmware
+        self.last_arrival = 0.0
+        self.condition = threading.Condition()
+
+        self.running = False
+        self.connected = False
+        self.reset_pending = False
+        self.booted = time.monotonic()
+
+        # Traffic counters, e.g. for benchmarks
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.bytes_dropped = 0
+        self.commands = 0
+
+        self.threads = []
+
+    def start(self) -> "serial_emulator":
+        self.running = True
+
+        self.threads = [threading.Thread(target=self.watch_port, name=f"{self.name} port", daemon=True),
+                        threading.Thread(target=self.run, name=f"{self.name} firmware", daemon=True),
+            ]
+
+        for thread in self.threads:
+            thread.start()
+
+        logging.info(f"Emulated {self.name} available at {self.port if self.link is None else self.link}.")
+        return self
+
+    def stop(self) -> None:
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        for thread in self.threads:
+            thread.join()
+
+        os.close(self.master)
+
+        if self.link is not None and os.path.lexists(self.link):
+            os.remove(self.link)
+
+    def watch_port(self) -> None:
+        # Sole reader of the pseudo-terminal: tracks the controller connecting and queues what it sends
+        poller = select.poll()
+        poller.register(self.master, select.POLLIN)
+
+        while self.running is True:
+            events = poller.poll(20)
+            hang_up = any(event & select.POLLHUP for _, event in events)
+
+            if hang_up is True:
+                if self.connected is True:
+                    with self.condition:
+                        self.connected = False
+                        self.condition.notify_all()
+
+                time.sleep(0.02)
+                continue
+
+            if self.connected is False:
+                with self.condition:
+                    self.connected = True
+                    self.reset_pending = self.resets
+                    self.condition.notify_all()
+
+            if any(event & select.POLLIN for _, event in events):
+                try:
+                    data = os.read(self.master, 4096)
+                except OSError:
+                    continue
+
+                self.receive(data)
+
+    def receive(self, data: bytes) -> None:
+        # Each byte takes 10 bits (8N1) to arrive
+        byte_time = 10 / (self.baudrate * self.time_scale)
+
+        with self.condition:
+            now = time.monotonic()
+
+            for byte in data:
+                self.last_arrival = max(now, self.last_arrival) + byte_time
+                self.incoming.append((self.last_arrival, byte))
+
+            self.bytes_received += len(data)
+            self.condition.notify_all()
+
+    def release(self) -> None:
+        # Move bytes that have arrived into the serial buffer, dropping any that do not fit (call with condition held)
+        now = time.monotonic()
+
+        while len(self.incoming) > 0 and self.incoming[0][0] <= now:
+            _, byte = self.incoming.popleft()
+
+            if self.buffer_size is not None and len(self.received) >= self.buffer_size:
+                self.bytes_dropped += 1
+            else:
+                self.received.append(byte)
+
+    def check_reset(self) -> None:
+        if self.running is False or self.reset_pending is True:
+            raise device_reset()
+
+    def run(self) -> None:
+        # Firmware thread: setup once, then loop until reset (rebooting) or stopped
+        while self.running is True:
+            try:
+                with self.condition:
+                    self.reset_pending = False
+                    self.incoming.clear()
+                    self.received.clear()
+
+                self.booted = time.monotonic()
+
+                if self.resets is True:
+                    # Also lets pyserial flush its input whilst opening before anything is sent
+                    time.sleep(0.05)
+                    self.sleep(self.boot_time)
+
+                self.setup()
+
+                while True:
+                    self.loop()
+
+            except device_reset:
+                continue
+
+    def cpu_time(self) -> float:
+        # s of CPU used by emulator threads, so benchmarks can leave it out of the controllers' CPU time
+        total = 0.0
+
+        for thread in self.threads:
+            if thread.is_alive():
+                total += time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+
+        return total
+
+    def setup(self) -> None:
+        pass
+
+    def loop(self) -> None:
+        self.sleep(1.0)
+
+    def device_time(self) -> float:
+        # s since boot, in device time
+        return (time.monotonic() - self.booted) * self.time_scale
+
+    def millis(self) -> int:
+        return int(1000 * self.device_time())
+
+    def sleep(self, seconds: float) -> None:
+        # Device seconds, interrupted by a reset
+        deadline = time.monotonic() + max(seconds, 0) / self.time_scale
+
+        with self.condition:
+            while True:
+                self.check_reset()
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+
+                self.condition.wait(remaining)
+
+    def available(self) -> int:
+        with self.condition:
+            self.check_reset()
+            self.release()
+
+            return len(self.received)
+
+    def read_byte(self, timeout: float | None = None) -> int | None:
+        # Next byte from the serial buffer, waiting up to timeout (device s, None for ever)
+        deadline = None if timeout is None else time.monotonic() + timeout / self.time_scale
+
+        with self.condition:
+            while True:
+                self.check_reset()
+                self.release()
+
+                if len(self.received) > 0:
+                    byte = self.received[0]
+                    del self.received[0]
+
+                    return byte
+
+                # Wake when the next byte arrives, more data is received or the timeout ends
+                waits = [self.incoming[0][0] - time.monotonic()] if len(self.incoming) > 0 else []
+
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+
+                    waits.append(remaining)
+
+                self.condition.wait(max(min(waits), 0) if len(waits) > 0 else None)
+
+    def read_until(self, terminator: str, timeout: float = 1.0) -> str:
+        # Arduino Stream.readStringUntil(): terminator is consumed but not returned, gives up after timeout (s) without data
+        text = ""
+
+        while True:
+            byte = self.read_byte(timeout)
+
+            if byte is None or chr(byte) == terminator:
+                return text
+
+            text += chr(byte)
+
+    def read_line(self, terminator: str = "\n") -> str:
+        # Blocks until a full line (including terminator) is received
+        text = ""
+
+        while not text.endswith(terminator):
+            text += chr(self.read_byte())
+
+        return text
+
+    def send(self, text: str) -> None:
+        data = text.encode("ascii")
+
+        # Time on the wire
+        self.sleep(10 * len(data) / self.baudrate)
+
+        try:
+            os.write(self.master, data)
+        except OSError:
+            # Port closed, nobody listening
+            return
+
+        self.bytes_sent += len(data)
+
+    def println(self, text: str) -> None:
+        self.send(text + "\r\n")
+
+class stepper:
+    def __init__(self, max_speed: float, acceleration: float) -> None:
+        # AccelStepper motor: positions in microsteps, speeds in microsteps/s
+        self.position = 0
+        self.target = 0
+        self.max_speed = max_speed
+        self.acceleration = acceleration
+
+    def move_to(self, steps: int) -> None:
+        self.target = steps
+
+    def move(self, steps: int) -> None:
+        self.target = self.position + steps
+
+    def set_current_position(self, steps: int) -> None:
+        self.position = self.target = steps
+
+    def run_time(self) -> float:
+        # Seconds to reach target from rest, trapezoidal (or triangular if too short to reach full speed)
+        distance = abs(self.target - self.position)
+        self.position = self.target
+
+        if distance < self.max_speed ** 2 / self.acceleration:
+            return 2 * math.sqrt(distance / self.acceleration)
+        else:
+            return distance / self.max_speed + self.max_speed / self.acceleration
+
+class gantry_kit_emulator(serial_emulator):
+    def __init__(self, time_scale: float = 1.0, link: str | None = None) -> None:
+        # gantry-kit/src/main.cpp, from serial protocol down to motion timing and Arduino serial buffer
+        super().__init__("gantry kit", 9600, time_scale, link, resets=True, buffer_size=64)
+
+        self.microsteps = 4.0
+        self.steps_rev = 200.0
+
+        self.stage_speed = 1000.0 * self.microsteps
+        self.homing_speed = 50.0 * self.microsteps
+        self.max_accel = 300.0 * self.microsteps
+        self.z_stage_speed = 1200.0 * self.microsteps
+        self.z_homing_speed = 150 * self.microsteps
+        self.z_accel = 500.0 * self.microsteps
+        self.max_mix_speed = 500.0 * self.microsteps
+
+        self.pulley_radius = 6.34 # mm
+        self.rod_pitch = 2.0 # mm
+
+        self.stepper_offset = 0.05 # revs
+        self.stepper_find_home = -0.25 # revs
+
+        self.x_shift = 154.9 # mm
+        self.home = (-167.9 + 1.0 + self.x_shift, 1.5 - 1.0, 0)
+        self.joint_limit = ((14 - self.x_shift, 0, 0), (165.0 - self.x_shift, 141.0, -49.5))
+        self.drift = 4 # mm
+        self.z_drift = 1 # mm
+        self.motor_dir = (1, 1, -1, -1)
+
+        self.home_time = 90 # s, idle before returning to zero
+        self.loop_delay = 0.01 # s (LOOP_DELAY)
+        self.relay_delay = 0.5 # s, motor power switched on for every command
+
+        self.command = "" # received up to closing bracket
+        self.cursor = 0 # position of next field in command
+        self.max_waypoints = 8
+
+        self.motors = {}
+        self.pinched = False
+        self.relay = False
+        self.homed = False
+        self.last_call = 0
+
+    def mm_to_steps(self, milli: float, horizontal: bool, motor: int) -> int:
+        if horizontal is True:
+            return math.floor(self.motor_dir[motor] * self.microsteps * self.steps_rev * milli / (2 * math.pi * self.pulley_radius))
+        else:
+            return math.floor(self.motor_dir[motor] * self.microsteps * self.steps_rev * milli / self.rod_pitch)
+
+    def revs_to_steps(self, rotations: float) -> int:
+        # Truncated, as for conversion to long
+        return int(self.motor_dir[3] * self.microsteps * self.steps_rev * rotations)
+
+    def seconds(self) -> int:
+        # ceil(millis() / 1000) in firmware, integer division so whole seconds since boot
+        return self.millis() // 1000
+
+    def relay_on(self) -> None:
+        self.relay = True
+        self.sleep(self.relay_delay)
+
+    def motors_run(self) -> None:
+        # Z moves first, then X and Y together
+        z_time = self.motors["z"].run_time()
+        self.sleep(z_time + max(self.motors["x"].run_time(), self.motors["y"].run_time()))
+
+    def run_motor(self, name: str) -> None:
+        self.sleep(self.motors[name].run_time())
+
+    def setup(self) -> None:
+        self.motors = {"x": stepper(self.stage_speed, self.max_accel),
+                       "y": stepper(self.stage_speed, self.max_accel),
+                       "z": stepper(self.z_stage_speed, self.z_accel),
+                       "m": stepper(self.max_mix_speed, self.max_accel),
+            }
+
+        self.homed = False
+        self.last_call = 0
+
+        # Home mixing motor
+        self.relay_on()
+        self.motors["m"].move(self.revs_to_steps(self.stepper_find_home))
+        self.run_motor("m")
+        self.motors["m"].set_current_position(0)
+        self.relay = False
+
+        self.pinched = False
+        self.println("Gantry Kit Ready")
+
+    def loop(self) -> None:
+        self.sleep(self.loop_delay)
+
+        if self.available() > 0:
+            # Whole command is read before the relay delay, so a long path command can't overflow the buffer
+            self.command = self.read_until(")")
+            self.cursor = 0
+
+            self.relay_on()
+
+            action = self.next_field("(")
+            self.commands += 1
+
+            if action == "move":
+                x = to_float(self.next_field(",")) - self.x_shift
+                y = to_float(self.next_field(","))
+                z = to_float(self.next_field(")"))
+
+                self.gantry_move(x, y, z)
+
+            elif action == "path":
+                waypoints = to_int(self.next_field(","))
+                path = []
+
+                # Every value is read, even if too many waypoints were sent
+                for i in range(waypoints):
+                    x = to_float(self.next_field(",")) - self.x_shift
+                    y = to_float(self.next_field(","))
+                    z = to_float(self.next_field(")" if i == waypoints - 1 else ","))
+
+                    if i < self.max_waypoints:
+                        path.append((x, y, z))
+
+                if waypoints < 1 or waypoints > self.max_waypoints:
+                    self.println("Unknown command")
+                else:
+                    self.gantry_path(path)
+
+            elif action in ["softHome", "hardHome", "zQuickHome", "gantryZero", "pinch", "release", "returnState"]:
+                self.next_field(")")
+
+                if action == "softHome":
+                    self.soft_home()
+                elif action == "hardHome":
+                    self.hard_home()
+                elif action == "zQuickHome":
+                    self.z_quick_home()
+                elif action == "gantryZero":
+                    self.gantry_zero()
+                elif action == "pinch":
+                    self.pinched = True
+                    self.println("Pipette rack pinched")
+                elif action == "release":
+                    self.pinched = False
+                    self.println("Pipette rack released")
+                else:
+                    self.println("Gantry Kit Ready")
+
+            elif action == "mix":
+                count = to_int(self.next_field(","))
+                displacement = to_float(self.next_field(","))
+                accel = to_float(self.next_field(")"))
+
+                self.mix(count, displacement, accel)
+
+            else:
+                self.println("Unknown command")
+
+            self.last_call = self.seconds()
+
+        elif self.seconds() - self.last_call > self.home_time:
+            # Idle, return to zero and switch off motors
+            if self.homed is False:
+                self.gantry_zero()
+
+            self.relay = False
+            self.last_call = self.seconds()
+
+    def next_field(self, terminator: str) -> str:
+        # nextField() in firmware, readStringUntil() from the command already received
+        end = self.command.find(terminator, self.cursor)
+
+        if end < 0:
+            end = len(self.command)
+
+        field = self.command[self.cursor:end]
+        self.cursor = end + 1
+
+        return field
+
+    def clamp(self, value: float, low: float, high: float) -> float:
+        return min(max(value, low), high)
+
+    def gantry_move(self, x: float, y: float, z: float, report: bool = True) -> None:
+        start = self.seconds()
+
+        x = self.clamp(x, self.joint_limit[0][0], self.joint_limit[1][0])
+        y = self.clamp(y, self.joint_limit[0][1], self.joint_limit[1][1])
+        z = self.clamp(z, self.joint_limit[1][2], self.joint_limit[0][2]) # Z is negative downwards
+
+        self.motors["x"].move_to(self.mm_to_steps(x, True, 0))
+        self.motors["y"].move_to(self.mm_to_steps(y, True, 1))
+        self.motors["z"].move_to(self.mm_to_steps(z, False, 2))
+
+        self.motors_run()
+        self.homed = False
+
+        if report is True:
+            self.println(f"Move complete in {self.seconds() - start}s")
+
+    def gantry_path(self, path: list[tuple[float, float, float]]) -> None:
+        start = self.seconds()
+
+        for x, y, z in path:
+            self.gantry_move(x, y, z, report=False)
+
+        self.println(f"Path complete in {self.seconds() - start}s")
+
+    def set_speeds(self, xy: float, z: float) -> None:
+        self.motors["x"].max_speed = xy
+        self.motors["y"].max_speed = xy
+        self.motors["z"].max_speed = z
+
+    def zero_positions(self) -> None:
+        for name in ["x", "y", "z"]:
+            self.motors[name].set_current_position(0)
+
+    def move_home(self) -> None:
+        self.motors["x"].move(self.mm_to_steps(self.home[0], True, 0))
+        self.motors["y"].move(self.mm_to_steps(self.home[1], True, 1))
+        self.motors["z"].move(self.mm_to_steps(self.home[2], False, 2))
+        self.motors_run()
+
+    def soft_home(self) -> None:
+        self.set_speeds(self.homing_speed, self.z_homing_speed)
+
+        # Home pads plus a small distance to remove any drift
+        self.motors["x"].move_to(self.mm_to_steps(self.joint_limit[1][0] + self.drift, True, 0))
+        self.motors["y"].move_to(self.mm_to_steps(-1 * self.drift, True, 1))
+        self.motors["z"].move_to(self.mm_to_steps(self.z_drift, False, 2))
+        self.motors_run()
+
+        self.move_home()
+        self.zero_positions()
+        self.set_speeds(self.stage_speed, self.z_stage_speed)
+
+        self.println("Gantry Homed")
+        self.homed = True
+
+    def hard_home(self) -> None:
+        self.set_speeds(self.homing_speed, self.z_homing_speed)
+
+        self.motors["x"].move(self.mm_to_steps(self.joint_limit[1][0] + self.x_shift, True, 0))
+        self.motors["y"].move(-1 * self.mm_to_steps(self.joint_limit[1][1], True, 1))
+        self.motors["z"].move(-1 * self.mm_to_steps(self.joint_limit[1][2], False, 2))
+        self.motors_run()
+
+        self.move_home()
+        self.zero_positions()
+
+        # Firmware returns Z to STAGE_SPEED (not Z_STAGE_SPEED) after hard homing
+        self.set_speeds(self.stage_speed, self.stage_speed)
+
+        self.println("Gantry Homed")
+        self.homed = True
+
+    def z_quick_home(self) -> None:
+        self.motors["z"].move_to(self.mm_to_steps(self.z_drift, False, 2))
+        self.run_motor("z")
+
+        self.motors["z"].move(self.mm_to_steps(self.home[2], False, 2))
+        self.run_motor("z")
+        self.motors["z"].set_current_position(0)
+
+        self.println("Z Motor Homed")
+
+    def gantry_zero(self) -> None:
+        # No response is sent
+        self.motors["x"].move_to(self.mm_to_steps(self.joint_limit[0][0] / 2, True, 0))
+        self.motors["y"].move_to(0)
+        self.motors["z"].move_to(0)
+
+        self.run_motor("z")
+        self.run_motor("x")
+        self.run_motor("y")
+
+        self.motors["x"].move_to(0)
+        self.run_motor("x")
+
+        self.homed = True
+
+    def mix(self, count: int, displacement: float, accel: float) -> None:
+        self.motors["m"].acceleration = accel * self.microsteps * self.steps_rev
+
+        # Response is sent half way through mixing
+        for half in range(2):
+            for _ in range(count // 2):
+                self.motors["m"].move_to(self.revs_to_steps(self.stepper_offset))
+                self.run_motor("m")
+
+                self.motors["m"].move_to(self.revs_to_steps(displacement + self.stepper_offset))
+                self.run_motor("m")
+
+                self.sleep(0.2)
+
+            if half == 0:
+                self.println("Mixing in progress")
+
+        self.motors["m"].move_to(0)
+        self.run_motor("m")
+
+class fluid_kit_emulator(serial_emulator):
+    def __init__(self, time_scale: float = 1.0, link: str | None = None) -> None:
+        # fluid-handling-kit/src/main.cpp
+        super().__init__("fluid handling kit", 9600, time_scale, link, resets=True, buffer_size=64)
+
+        self.microsteps = 4.0
+        self.steps_rev = 200.0
+        self.ml_rev = 0.1 # mL/rev
+
+        self.pump_speed = 200.0 * self.microsteps # microsteps/s
+        self.pump_accel = 100.0 * self.microsteps # microsteps/s2
+
+        self.loop_delay = 0.5 # s
+        self.relay_delay = 0.5 # s
+
+        # Net volume moved by each pump (mL): 1 = electrolyte in, 2 = cell to waste, 3 = cleaning, 4 = rinse
+        self.pumped = {1: 0.0, 2: 0.0, 3: 0.0, 4: 0.0}
+        self.relay = False
+
+        # Liquid waiting in the mixing chamber and in the test cell (mL), weighed by balance if linked. Cleaning and
+        # rinsing liquid is emptied before anything is weighed, so only electrolyte is tracked.
+        self.chamber = 0.0
+        self.cell = 0.0
+        self.density = 1.0 # g/mL
+        self.balance: mass_balance_emulator | None = None # weighs the test cell, loaded as fluid is pumped in or out
+
+    def fill_chamber(self, volume: float) -> None:
+        # Volume in uL, e.g. dispensed by pipette
+        self.chamber += volume / 1000
+
+    def vol_to_steps(self, vol: float) -> int:
+        return math.floor(self.microsteps * self.steps_rev * vol / self.ml_rev)
+
+    def run_pump(self, pump: int, vol: float) -> None:
+        motor = stepper(self.pump_speed, self.pump_accel)
+        motor.move(self.vol_to_steps(vol))
+
+        self.sleep(motor.run_time())
+        self.pumped[pump] += vol
+
+        # Overpumped volume is air once the chamber (or cell) is empty
+        if pump == 1:
+            moved = min(max(vol, 0), self.chamber)
+            self.chamber -= moved
+        elif pump == 2:
+            moved = -min(max(vol, 0), self.cell)
+        else:
+            moved = 0.0
+
+        self.cell += moved
+
+        if self.balance is not None and moved != 0:
+            self.balance.add_load(self.density * moved)
+
+    def pump(self, pump: int, vol: float, deprime: bool = False) -> None:
+        self.relay = True
+        self.sleep(self.relay_delay)
+
+        start = self.millis() // 1000
+        self.run_pump(pump, vol)
+
+        self.println(f"Pump complete in {self.millis() // 1000 - start}s")
+
+        if deprime is True:
+            # After reporting, so the kit is still busy when the controller sends its next command
+            self.run_pump(pump, -vol)
+
+        self.relay = False
+
+    def setup(self) -> None:
+        self.relay = False
+        self.println("Fluid Handling Kit Ready")
+
+    def loop(self) -> None:
+        self.sleep(self.loop_delay)
+
+        if self.available() > 0:
+            action = self.read_until("(")
+            self.commands += 1
+
+            if action == "addElectrolyte":
+                self.pump(1, to_float(self.read_until(")")))
+            elif action == "cleanCell":
+                self.pump(3, to_float(self.read_until(")")), deprime=True)
+            elif action == "emptyCell":
+                self.pump(2, to_float(self.read_until(")")))
+            elif action == "rinseCell":
+                self.pump(4, to_float(self.read_until(")")), deprime=True)
+            elif action == "returnState":
+                self.read_until(")")
+                self.println("Fluid Handling Kit Ready")
+            else:
+                self.println("Unknown command")
+
+class disc_pump_emulator(serial_emulator):
+    def __init__(self, time_scale: float = 1.0, link: str | None = None, noise: float = 0.0, ul_per_mbar: float = 2.76) -> None:
+        # Lee Smart Pump Module register protocol: "#W<register>,<value>\n" is echoed back if accepted,
+        # "#R<register>\n" returns "#R<register>,<value>\n" and anything malformed gets no response
+        super().__init__("disc pump", 115200, time_scale, link)
+
+        self.registers = {0: 0, 1: 275, 2: 0, 10: 0, 12: 0, 13: 0, 23: 0, 33: 0}
+        self.response_time = 0.001 # s
+
+        # Pipette pressure follows the PID set point (R23) with a first order response whilst enabled (R0),
+        # and vents towards zero when disabled
+        self.rise_constant = 0.15 # s
+        self.vent_constant = 0.3 # s
+        self.idle_power = 20 # mW
+        self.power_per_mbar = 1.2 # mW/mbar
+        self.noise = noise # mbar
+
+        self.pressure_start = (0.0, 0.0) # mbar, device s
+
+        # Liquid held in the pipette tip rises with the set point above the lowest one since the pump was enabled
+        # (the charge pressure), and is dispensed when the pump is disabled, e.g. into fluid kit chamber
+        self.ul_per_mbar = ul_per_mbar
+        self.base_pressure = None # mbar
+        self.on_dispense: Callable[[float], None] | None = None # called with volume (uL)
+
+    def target_pressure(self) -> float:
+        if self.registers.get(0, 0) == 1 and self.registers.get(10, 0) == 1:
+            return min(float(self.registers.get(23, 0)), self.registers.get(1, 275) / self.power_per_mbar)
+
+        return 0.0
+
+    def pressure(self) -> float:
+        pressure, start = self.pressure_start
+        target = self.target_pressure()
+        constant = self.rise_constant if target > 0 else self.vent_constant
+
+        return target + (pressure - target) * math.exp(-(self.device_time() - start) / constant)
+
+    def track_volume(self, register: int, value: float) -> None:
+        enabled = self.registers.get(0, 0) == 1
+
+        if register == 0 and value == 1 and enabled is False:
+            self.base_pressure = None
+
+        elif register == 23 and enabled is True:
+            self.base_pressure = value if self.base_pressure is None else min(self.base_pressure, value)
+
+        elif register == 0 and value == 0 and enabled is True:
+            held = 0.0 if self.base_pressure is None else self.ul_per_mbar * (self.registers.get(23, 0) - self.base_pressure)
+            self.base_pressure = None
+
+            if held > 0 and self.on_dispense is not None:
+                self.on_dispense(held)
+
+    def read_register(self, register: int) -> str:
+        if register == 39:
+            pressure = self.pressure()
+
+            if self.noise > 0:
+                pressure += random.gauss(0, self.noise)
+
+            return f"{pressure:.3f}"
+        elif register == 5:
+            power = self.idle_power + self.power_per_mbar * self.pressure() if self.registers.get(0, 0) == 1 else 0.0
+            return f"{min(power, self.registers.get(1, 275)):.2f}"
+        elif register == 6:
+            return "21000"
+
+        return format_value(self.registers.get(register, 0))
+
+    def loop(self) -> None:
+        line = self.read_line()
+        self.sleep(self.response_time)
+        self.commands += 1
+
+        if (match := re.fullmatch(r"#W(\d+),([-+\d.eE]+)\n", line)) is not None:
+            register, value = int(match.group(1)), float(match.group(2))
+
+            if register in [0, 10, 23]:
+                # Current pressure becomes start of new response
+                self.pressure_start = (self.pressure(), self.device_time())
+
+            self.track_volume(register, value)
+            self.registers[register] = value
+            self.send(line)
+
+        elif (match := re.fullmatch(r"#R(\d+)\n", line)) is not None:
+            register = int(match.group(1))
+            self.send(f"#R{register},{self.read_register(register)}\n")
+
+class laird_emulator(serial_emulator):
+    def __init__(self, time_scale: float = 1.0, link: str | None = None, ambient: float = 25.0) -> None:
+        # Laird TC-XX-PR-59: every character is echoed, then on <CR> the response is sent as
+        # CR LF <response> CR LF followed by the "> " prompt. Unknown commands are answered with "?" + command.
+        super().__init__("temperature controller", 115200, time_scale, link)
+
+        self.identity = "18245 TC-XX-PR-59 REV2.6"
+        self.status = "0000 0000 0000"
+
+        self.registers = {0: ambient, 13: 6}
+        self.run_flag = False
+        self.command = ""
+
+        # Cell temperature ramps linearly to the set point (R0) whilst running, otherwise drifts towards ambient
+        self.ambient = ambient # C
+        self.heating_rate = 3.0 # C/min
+        self.cooling_rate = 2.0 # C/min
+        self.drift_rate = 0.5 # C/min
+
+        self.temperature_start = (ambient, 0.0) # C, device s
+
+    def temperature(self) -> float:
+        temperature, start = self.temperature_start
+        target = self.registers[0] if self.run_flag is True else self.ambient
+
+        if self.run_flag is False:
+            rate = self.drift_rate
+        elif target >= temperature:
+            rate = self.heating_rate
+        else:
+            rate = self.cooling_rate
+
+        change = rate * (self.device_time() - start) / 60
+
+        if abs(target - temperature) <= change:
+            return target
+
+        return temperature + math.copysign(change, target - temperature)
+
+    def restart_ramp(self) -> None:
+        self.temperature_start = (self.temperature(), self.device_time())
+
+    def read_register(self, register: int) -> str:
+        if register == 100:
+            return f"{self.temperature():.2f}"
+        elif register == 101:
+            return f"{self.ambient:.2f}"
+        elif register == 106:
+            # Output (%) whilst ramping
+            return f"{0.0 if self.run_flag is False or abs(self.temperature() - self.registers[0]) < 0.1 else 60.0:.2f}"
+
+        return format_value(self.registers.get(register, 0))
+
+    def respond(self, command: str) -> str:
+        if command == "$LI":
+            return self.identity
+        elif command == "$W":
+            self.restart_ramp()
+            self.run_flag = True
+            return "Run"
+        elif command == "$Q":
+            self.restart_ramp()
+            self.run_flag = False
+            return "Stop"
+        elif command == "$S":
+            return self.status
+        elif command == "$SC":
+            self.status = "0000 0000 0000"
+            return self.status
+
+        elif (match := re.fullmatch(r"\$R(\d+)=([-+\d.eE]+)", command)) is not None:
+            register, text = int(match.group(1)), match.group(2)
+
+            if register == 0:
+                self.restart_ramp()
+
+            self.registers[register] = float(text)
+
+            # Integers are read back, floats get an empty response
+            return text if re.fullmatch(r"[-+]?\d+", text) is not None else ""
+
+        elif (match := re.fullmatch(r"\$R(\d+)\?", command)) is not None:
+            return self.read_register(int(match.group(1)))
+
+        return "?" + command
+
+    def loop(self) -> None:
+        character = chr(self.read_byte())
+
+        if character == "\r":
+            self.commands += 1
+            self.send("\r\n" + self.respond(self.command) + "\r\n> ")
+            self.command = ""
+        else:
+            self.send(character)
+            self.command += character
+
+class mass_balance_emulator(serial_emulator):
+    def __init__(self, time_scale: float = 1.0, link: str | None = None, noise: float = 0.0, continuous: bool = False) -> None:
+        # KERN PCD: "s" sends the next stable reading, "w" the current reading, "t" tares once stable.
+        # Readings look like "     12.34 g  " (sign, if any, first)
+        super().__init__("mass balance", 9600, time_scale, link)
+
+        self.load = 0.0 # g, on the pan
+        self.reading_start = (0.0, 0.0) # g, device s
+        self.settle_constant = 0.3 # s
+        self.division = 0.01 # g
+        self.noise = noise # g
+        self.offset = 0.0 # g, tare
+
+        # Continuous output (no requests needed) at period
+        self.continuous = continuous
+        self.period = 0.1 # s
+
+    def set_load(self, mass: float) -> None:
+        # e.g. fluid pumped into the test cell
+        self.reading_start = (self.raw_reading(), self.device_time())
+        self.load = mass
+
+    def add_load(self, mass: float) -> None:
+        self.set_load(self.load + mass)
+
+    def raw_reading(self) -> float:
+        mass, start = self.reading_start
+        return self.load + (mass - self.load) * math.exp(-(self.device_time() - start) / self.settle_constant)
+
+    def is_stable(self) -> bool:
+        return abs(self.raw_reading() - self.load) < self.division / 2
+
+    def reading(self) -> str:
+        mass = self.raw_reading() - self.offset
+
+        if self.noise > 0:
+            mass += random.gauss(0, self.noise)
+
+        mass = round(mass / self.division) * self.division
+        sign = "-" if mass < 0 else " "
+
+        return f"{sign}{abs(mass):9.2f} g  \r\n"
+
+    def wait_until_stable(self) -> None:
+        while self.is_stable() is False:
+            self.sleep(self.period)
+
+    def loop(self) -> None:
+        byte = self.read_byte(self.period if self.continuous is True else None)
+
+        if byte is None:
+            self.send(self.reading())
+            return
+
+        self.commands += 1
+        character = chr(byte)
+
+        if character == "s":
+            self.wait_until_stable()
+            self.send(self.reading())
+        elif character == "w":
+            self.send(self.reading())
+        elif character == "t":
+            self.wait_until_stable()
+            self.offset = self.raw_reading()
+
+def emulate_station(folder: str = "/tmp/robot_controller", time_scale: float = 1.0) -> dict[str, serial_emulator]:
+    # Every serial device on the station, linked at the addresses of the emulated device in hardcoded_values.json
+    pipette = disc_pump_emulator(time_scale, os.path.join(folder, "pipette"))
+    fluid = fluid_kit_emulator(time_scale, os.path.join(folder, "fluid_handling_kit"))
+    mass = mass_balance_emulator(time_scale, os.path.join(folder, "mass_balance"), continuous=True)
+
+    # Dispensed doses collect in the mixing chamber, then are pumped onto the balance with the test cell
+    pipette.on_dispense = fluid.fill_chamber
+    fluid.balance = mass
+
+    emulators: dict[str, serial_emulator] = {"gantry": gantry_kit_emulator(time_scale, os.path.join(folder, "gantry_kit")),
+                                             "pipette": pipette,
+                                             "fluid": fluid,
+                                             "mass": mass,
+                                             "temperature": laird_emulator(time_scale, os.path.join(folder, "temperature_controller")),
+        }
+
+    for emulator in emulators.values():
+        emulator.start()
+
+    return emulators
@@ -0,0 +1,174 @@
+import json
+import logging
+import math
+
+import pandas as pd
+
+from robot_controller import clock, mixing_station
+
+logging.basicConfig(level = logging.INFO)
+
+class dose_planner:
+    def __init__(self, mixer: mixing_station.electrolyte_mixer, max_dose: float) -> None:
+        # Compiles a recipe into a list of primitive operations before any reagent is touched
+        self.mixer = mixer
+        self.max_dose = max_dose # ul
+
+        # Gantry motion model, used to estimate travel time
+        self.gantry = mixer.gantry
+        self.home = self.gantry.home # gantry zero in workspace coordinates
+
+    def step_waypoints(self, step: dict, position: tuple[float, float, float]) -> list[list[tuple[float, float, float]]]:
+        # Waypoints sent by the mixer for each operation, grouped per serial exchange
+        mixer = self.mixer
+
+        if step["op"] == "pick_pipette":
+            x, y = mixer.pipette_locations[step["pipette"]-1]
+            return [[(x + mixer.pipette_lead_in, y, 0), (x, y, 0), (x, y, mixer.pipette_pick_height)],
+                    [(x, y, 0)],
+                    [(x + mixer.pipette_lead_in, y, 0)]]
+
+        elif step["op"] == "return_pipette":
+            x, y = mixer.pipette_locations[step["pipette"]-1]
+            return [[(x + mixer.pipette_lead_in, y, 0), (x, y, 0), (x, y, mixer.pipette_pick_height + 2)],
+                    [], # pinch
+                    [(x, y, 0)],
+                    [], # release
+                    [(x + mixer.pipette_lead_in / 2, y, 0), (x + mixer.pipette_lead_in / 2, y, mixer.pipette_pick_height + mixer.pipette_head_height), (x + mixer.pipette_lead_in, y, 0)]]
+
+        elif step["op"] == "collect":
+            x, y = mixer.pot_locations[step["pot"]-1]
+            return [[(x, y, 0)], [(x, y, step["z"])]]
+
+        elif step["op"] == "deliver":
+            x, y = mixer.chamber_location
+            return [[(position[0], position[1], 0), (x, y, 0), (x, y, mixer.dispense_height)], [(x, y, 0)]]
+
+        elif step["op"] == "mix":
+            return [[self.home], []]
+
+        return []
+
+    def order_reagents(self, rows: list[int]) -> list[int]:
+        # Each reagent is collected, transferred and returned with its own pipette, so the only order-dependent
+        # travel is between pipette rack slots. Exact search over subsets (max 9 pipettes).
+        if len(rows) < 2:
+            return rows
+
+        def rack(i: int) -> tuple[float, float, float]:
+            x, y = self.mixer.pipette_locations[i]
+            return (x + self.mixer.pipette_lead_in, y, 0)
+
+        n = len(rows)
+        best = {(1 << k, k): (self.gantry.move_time(self.home, rack(rows[k])), [k]) for k in range(n)}
+
+        for mask in range(1, 1 << n):
+            for last in range(n):
+                if (mask, last) not in best:
+                    continue
+
+                cost, order = best[(mask, last)]
+                for k in range(n):
+                    if mask & (1 << k):
+                        continue
+
+                    new_cost = cost + self.gantry.move_time(rack(rows[last]), rack(rows[k]))
+                    key = (mask | (1 << k), k)
+
+                    if key not in best or new_cost < best[key][0]:
+                        best[key] = (new_cost, [*order, k])
+
+        full = (1 << n) - 1
+        cost, order = min(best[(full, last)] for last in range(n))
+
+        # Keep recipe order unless reordering gives a real saving
+        original = self.gantry.move_time(self.home, rack(rows[0])) + sum(self.gantry.move_time(rack(a), rack(b)) for a, b in zip(rows[:-1], rows[1:]))
+        if cost > original - 0.1:
+            return rows
+
+        return [rows[k] for k in order]
+
+    def compile(self, df: pd.DataFrame, optimise: bool = True) -> dict:
+        non_zero = df[df["Dose Volume (uL)"] > 0]
+        rows = [int(i) for i in non_zero.index.to_numpy(dtype=int)]
+
+        if optimise is True:
+            rows = self.order_reagents(rows)
+
+        steps = []
+        for i in rows:
+            row = non_zero.loc[i]
+            required_volume = float(row["Dose Volume (uL)"])
+
+            # Collect pipette for desired chemical (pipette 1 for pot 1)
+            steps.append({"op": "pick_pipette", "pipette": i+1})
+
+            doses = math.floor(required_volume // self.max_dose) + 1
+            last_dose = required_volume % self.max_dose
+
+            # Extract starting volume in pot
+            pot_volume = float(row["Container Volume (mL)"])
+
+            # If larger than maximum required, perform multiple collections and deliveries until entire volume is transferred
+            for j in range(doses):
+                if j == doses-1:
+                    dose = last_dose
+                else:
+                    dose = self.max_dose
+
+                if math.floor(dose) == 0:
+                    continue
+
+                new_volume = round(pot_volume - dose * 1e-3, 4) #ml
+
+                steps.append({"op": "collect",
+                              "row": i,
+                              "pot": i+1,
+                              "name": str(row["Name"]),
+                              "volume": dose,
+                              "starting_volume": pot_volume,
+                              "remaining_volume": new_volume,
+                              "z": self.mixer.get_pot_height(new_volume), # mm, aspiration height
+                              "scalar": float(row["Aspirate Scalar"]),
+                              "speed": float(row["Aspirate Speed (uL/s)"]),
+                            })
+
+                steps.append({"op": "deliver", "pot": i+1})
+                pot_volume = new_volume
+
+            steps.append({"op": "return_pipette", "pipette": i+1})
+
+        steps.append({"op": "mix"})
+
+        plan = {"created": clock.now().strftime("%d/%m/%Y %H:%M:%S"),
+                "electrolyte_volume": float(non_zero["Dose Volume (uL)"].sum()), # ul
+                "total_mass": float((non_zero["Density (g/mL)"] * non_zero["Dose Volume (uL)"]).sum() / 1000), # g
+                "steps": steps,
+            }
+
+        plan["travel_time"] = self.estimate_travel_time(plan)
+        logging.info(f"Dose plan compiled: {len(steps)} operations, {len(rows)} pipettes, estimated gantry time of {round(plan['travel_time'], 1)}s.")
+
+        return plan
+
+    def estimate_travel_time(self, plan: dict) -> float:
+        position = self.home
+        total = 0.0
+
+        for step in plan["steps"]:
+            for exchange in self.step_waypoints(step, position):
+                total += self.gantry.exchange_time
+
+                for waypoint in exchange:
+                    total += self.gantry.move_time(position, waypoint)
+                    position = waypoint
+
+        return total
+
+    def save(self, plan: dict, path: str) -> None:
+        with open(path, 'w') as file:
+            json.dump(plan, file, indent=4)
+
+    def load(self, path: str) -> dict:
+        with open(path) as file:
+            return json.load(file)
@@ -0,0 +1,110 @@
+import logging
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+from robot_controller import clock
+
+logging.basicConfig(level = logging.INFO)
+
+class experiment_database:
+    def __init__(self, path: str = "data/results/experiments.db") -> None:
+        # SQLite index of every experiment: recipe, temperature, cost, derived results and where the raw data is kept.
+        # Written by test_cell (measurements) and the scheduler (recipe), which share the experiment identifier.
+        self.path = path
+        self.lock = threading.Lock()
+
+        # Columns that may be written for each experiment
+        self.fields = {
+            "device": "TEXT",
+            "temperature_target": "REAL",
+            "temperature_mean": "REAL",
+            "temperature_std": "REAL",
+            "electrolyte_volume": "REAL", # uL
+            "cost": "REAL",
+            "ohmic_resistance": "REAL",
+            "ionic_conductivity": "REAL", # mS/cm
+            "fit_conductivity": "REAL", # mS/cm
+            "chi_square": "REAL",
+            "cell_constant": "REAL",
+            "spectrum_store": "TEXT", # folder of spectrum store holding raw data
+            "data_kinds": "TEXT", # e.g. "AC,DC"
+        }
+
+        folder = os.path.dirname(path)
+        if folder != "" and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        columns = ", ".join(f"{name} {kind}" for name, kind in self.fields.items())
+
+        with self.lock, self.connect() as db:
+            db.execute(f"CREATE TABLE IF NOT EXISTS experiments (identifier TEXT PRIMARY KEY, created TEXT NOT NULL, {columns})")
+            db.execute("CREATE TABLE IF NOT EXISTS composition (identifier TEXT NOT NULL REFERENCES experiments(identifier), name TEXT NOT NULL, volume REAL NOT NULL, PRIMARY KEY (identifier, name))")
+
+            db.execute("CREATE INDEX IF NOT EXISTS composition_volume ON composition (name, volume)")
+            db.execute("CREATE INDEX IF NOT EXISTS experiments_created ON experiments (created)")
+            db.execute("CREATE INDEX IF NOT EXISTS experiments_temperature ON experiments (temperature_target)")
+
+        db.close()
+
+    def connect(self) -> sqlite3.Connection:
+        # Short lived connections, so the database can be written from worker threads and read by other processes
+        return sqlite3.connect(self.path, timeout=10)
+
+    def record(self, identifier: str, **fields: float | str | None) -> None:
+        # Create experiment if new, then set any provided fields, e.g. record(id, cost=0.95)
+        unknown = [name for name in fields if name not in self.fields]
+
+        if len(unknown) > 0:
+            logging.error(f"Unknown experiment fields: {unknown}.")
+            raise KeyError(unknown[0])
+
+        with self.lock, self.connect() as db:
+            db.execute("INSERT OR IGNORE INTO experiments (identifier, created) VALUES (?, ?)", (identifier, clock.now().isoformat(timespec="seconds")))
+
+            if len(fields) > 0:
+                assignments = ", ".join(f"{name} = ?" for name in fields)
+                db.execute(f"UPDATE experiments SET {assignments} WHERE identifier = ?", (*fields.values(), identifier))
+
+        db.close()
+
+    def record_composition(self, identifier: str, composition: dict[str, float]) -> None:
+        # e.g. {'ZnCl2': 500.0, 'H2O': 1500.0} in uL, zero doses are not stored
+        self.record(identifier)
+
+        with self.lock, self.connect() as db:
+            db.execute("DELETE FROM composition WHERE identifier = ?", (identifier,))
+            db.executemany("INSERT INTO composition (identifier, name, volume) VALUES (?, ?, ?)", [(identifier, name, float(volume)) for name, volume in composition.items() if volume > 0])
+
+        db.close()
+
+    def query(self, sql: str, parameters: tuple | dict = ()) -> pd.DataFrame:
+        db = self.connect()
+
+        try:
+            return pd.read_sql_query(sql, db, params=parameters)
+        finally:
+            db.close()
+
+    def find(self, volumes: dict[str, tuple[float, float]] | None = None, temperature: float | None = None, tolerance: float = 0.5) -> pd.DataFrame:
+        # e.g. find({"ZnCl2": (500, float("inf"))}, temperature=25) for all runs with more than 500uL of ZnCl2 at 25C
+        conditions = []
+        parameters = []
+
+        for name, (low, high) in (volumes or {}).items():
+            conditions.append("identifier IN (SELECT identifier FROM composition WHERE name = ? AND volume > ? AND volume <= ?)")
+            parameters += [name, low, high]
+
+        if temperature is not None:
+            conditions.append("temperature_target BETWEEN ? AND ?")
+            parameters += [temperature - tolerance, temperature + tolerance]
+
+        where = " AND ".join(conditions) if len(conditions) > 0 else "1"
+
+        return self.query(f"SELECT * FROM experiments WHERE {where} ORDER BY created", tuple(parameters))
+
+    def get_composition(self, identifier: str) -> dict[str, float]:
+        table = self.query("SELECT name, volume FROM composition WHERE identifier = ?", (identifier,))
+        return dict(zip(table["name"], table["volume"]))
@@ -1,23 +1,23 @@
 import logging
 import math
 import sys
-import time
 
-import serial
+from robot_controller import clock, command_futures, serial_transport, tracing
 
 logging.basicConfig(level = logging.INFO)
 
-class fluid_handler:
-    def __init__(self, COM: str, sim: bool = False) -> None:
+class fluid_handler(command_futures.queued_device):
+    def __init__(self, COM: str, sim: bool = False, timeout: float = 600) -> None:
         self.sim = sim
 
+        # Pump motion, from fluid handling kit firmware (1rev/s at 0.1mL/rev), used to time simulated pumping
+        self.flow_rate = 0.1 # mL/s
+        self.flow_accel = 0.05 # mL/s2
+
         if self.sim is False:
             logging.info("Configuring fluid handling kit serial port..")
-            self.ser = serial.Serial(COM) 
-            self.ser.baudrate = 9600
-            self.ser.bytesize = 8 
-            self.ser.parity = 'N' # No parity
-            self.ser.stopbits = 1
+            # Timeout must cover the largest pump volume (0.1mL/s)
+            self.ser = serial_transport.serial_transport(COM, baudrate=9600, timeout=timeout, name="fluid handling kit")
 
             logging.info("Attempting to open fluid handling kit serial port..")
 
@@ -34,10 +34,7 @@ class fluid_handler:
             logging.info("No serial connection to fluid handling kit established.")
 
     def get_data(self) -> str:
-        while self.ser.in_waiting == 0:
-            pass
-
-        return self.ser.readline().decode().rstrip().replace("\x00", "")
+        return self.ser.read_line().rstrip().replace("\x00", "")
         
     def get_response(self) -> None:
         data = self.get_data()
@@ -47,13 +44,25 @@ class fluid_handler:
             sys.exit()
         else:
             logging.info("Response from fluid handling kit: " + data)
+            tracing.annotate(response=data)
 
     def close_ser(self) -> None:
         logging.info("Closing serial connection to fluid handling kit.")
+        # Finish any queued commands before closing port
+        self.close_commands()
+
         if self.sim is False:
             if self.ser.isOpen():
                 self.ser.close()
 
+    def pump_time(self, vol: float) -> float:
+        # Trapezoidal velocity profile (or triangular if too short to reach full speed), vol in mL
+        if vol < self.flow_rate ** 2 / self.flow_accel:
+            return 2 * math.sqrt(vol / self.flow_accel)
+        else:
+            return vol / self.flow_rate + self.flow_rate / self.flow_accel
+
+    @tracing.traced("fluid")
     def add_electrolyte(self, fluid_vol: float, tube_length: float = 630.0, overpump: float = 1.3) -> None:
         # Fluid volume in uL -> sent volume in mL
         logging.info(f"Pumping {fluid_vol}uL of electrolyte to test cell..")
@@ -61,39 +70,53 @@ class fluid_handler:
         vol = overpump * (fluid_vol / 1000 + tube_vol) #ml
         
         if self.sim is False:
-            self.ser.write(f"addElectrolyte({vol})".encode())
+            self.ser.write(f"addElectrolyte({vol})")
             self.get_response()
+        else:
+            clock.simulate(self.pump_time(vol))
 
+    @tracing.traced("fluid")
     def empty_cell(self, fluid_vol: float, tube_length: float = 500.0, overpump: float = 1.2) -> None:
         logging.info(f"Pumping {fluid_vol}uL from test cell to waste..")
         tube_vol = math.pi * tube_length * 1e-3 # 2mm ID tubing (Area = Pi)
         vol = overpump * (fluid_vol / 1000 + tube_vol) #ml
         
         if self.sim is False:
-            self.ser.write(f"emptyCell({vol})".encode())
+            self.ser.write(f"emptyCell({vol})")
             self.get_response()
+        else:
+            clock.simulate(self.pump_time(vol))
 
+    @tracing.traced("fluid")
     def clean_cell(self, fluid_vol: float, wait_time: float, tube_length: float = 500.0, overpump: float = 1.2) -> None:
         logging.info(f"Pumping {fluid_vol}uL of cleaning solution to test cell..")
         tube_vol = math.pi * tube_length * 1e-3 # 2mm ID tubing (Area = Pi)
         vol = overpump * (fluid_vol / 1000 + tube_vol) #ml
         
         if self.sim is False:
-            self.ser.write(f"cleanCell({vol})".encode())
+            self.ser.write(f"cleanCell({vol})")
             self.get_response()
 
             logging.info(f"Waiting for {wait_time}s to remove contaminants..")
-            time.sleep(wait_time)
+            clock.sleep(wait_time)
 
-            self.empty_cell(vol)   
+            self.empty_cell(vol)
+        else:
+            # Line is deprimed after pumping
+            clock.simulate(2 * self.pump_time(vol) + wait_time)
+            self.empty_cell(vol)
 
+    @tracing.traced("fluid")
     def rinse_cell(self, fluid_vol: float, tube_length: float = 500.0, overpump: float = 1.2) -> None:
         logging.info(f"Pumping {fluid_vol}uL of ethanol to test cell..")
         tube_vol = math.pi * tube_length * 1e-3 # 2mm ID tubing (Area = Pi)
         vol = overpump * (fluid_vol / 1000 + tube_vol) #ml
         
         if self.sim is False:
-            self.ser.write(f"rinseCell({vol})".encode())
+            self.ser.write(f"rinseCell({vol})")
             self.get_response()
 
+            self.empty_cell(vol)
+        else:
+            clock.simulate(2 * self.pump_time(vol))
             self.empty_cell(vol)
\ No newline at end of file
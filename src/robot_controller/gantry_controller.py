@@ -1,25 +1,43 @@
 import logging
+import math
 import sys
 
-import serial
+from robot_controller import clock, command_futures, serial_transport, tracing
 
 logging.basicConfig(level = logging.INFO)
 
-class gantry:
-    def __init__(self, COM: str, sim: bool = False) -> None:
+class gantry(command_futures.queued_device):
+    def __init__(self, COM: str, sim: bool = False, timeout: float = 120) -> None:
         self.sim = sim
 
         # To be set by scheduler
         self.x_correction = 0 #mm 
         self.y_correction = 0 #mm
 
+        # Must match MAX_WAYPOINTS in gantry kit firmware
+        self.max_waypoints = 8
+        self.max_command_bytes = 63 # Arduino serial buffer is 64 bytes
+
+        # Motion limits, from gantry kit firmware (800 microsteps/rev)
+        self.xy_speed = 5.0 * 2 * math.pi * 6.34 # mm/s (STAGE_SPEED, belt pulley radius 6.34mm)
+        self.xy_accel = 1.5 * 2 * math.pi * 6.34 # mm/s2 (MAX_ACCEL)
+        self.z_speed = 6.0 * 2.0 # mm/s (Z_STAGE_SPEED, 2mm rod pitch)
+        self.z_accel = 2.5 * 2.0 # mm/s2 (Z_ACCEL)
+
+        self.xy_homing_speed = 0.25 * 2 * math.pi * 6.34 # mm/s (HOMING_SPEED)
+        self.z_homing_speed = 0.75 * 2.0 # mm/s (Z_HOMING_SPEED)
+        self.mix_speed = 2.5 # revs/s (MAX_MIX_SPEED)
+
+        self.exchange_time = 0.51 # s, relay switch on + command poll per serial exchange
+        self.home = (154.9, 0, 0) # gantry zero in workspace coordinates (x_shift in firmware)
+
+        # Last position sent, used to time simulated motion
+        self.position = self.home
+
         if self.sim is False:
             logging.info("Configuring gantry kit serial port..")
-            self.ser = serial.Serial(COM)
-            self.ser.baudrate = 9600 
-            self.ser.bytesize = 8
-            self.ser.parity = 'N' # No parity
-            self.ser.stopbits = 1 
+            # Timeout must cover the longest motion (hard homing at reduced speed)
+            self.ser = serial_transport.serial_transport(COM, baudrate=9600, timeout=timeout, name="gantry kit")
 
             logging.info("Attempting to open gantry kit serial port..")
 
@@ -39,10 +57,7 @@ class gantry:
             logging.info("No serial connection to gantry kit established.")
 
     def get_data(self) -> str:
-        while self.ser.in_waiting == 0:
-            pass
-
-        return self.ser.readline().decode().rstrip().replace("\x00", "")
+        return self.ser.read_line().rstrip().replace("\x00", "")
         
     def get_response(self) -> None:
         data = self.get_data()
@@ -52,13 +67,46 @@ class gantry:
             sys.exit()
         else:
             logging.info("Response from gantry kit: " + data)
+            tracing.annotate(response=data)
 
     def close_ser(self) -> None:
         logging.info("Closing serial connection to gantry kit.")
+        # Finish any queued commands before closing port
+        self.close_commands()
+
         if self.sim is False:
             if self.ser.isOpen():
                 self.ser.close()
 
+    def axis_time(self, distance: float, speed: float, accel: float) -> float:
+        # Trapezoidal (or triangular if too short to reach full speed) velocity profile
+        distance = abs(distance)
+        ramp = speed ** 2 / accel
+
+        if distance < ramp:
+            return 2 * math.sqrt(distance / accel)
+        else:
+            return distance / speed + speed / accel
+
+    def move_time(self, start: tuple[float, float, float], end: tuple[float, float, float]) -> float:
+        # Z moves first, then X and Y together (see motorsRun in firmware)
+        z_time = self.axis_time(end[2] - start[2], self.z_speed, self.z_accel)
+        x_time = self.axis_time(end[0] - start[0], self.xy_speed, self.xy_accel)
+        y_time = self.axis_time(end[1] - start[1], self.xy_speed, self.xy_accel)
+
+        return z_time + max(x_time, y_time)
+
+    def simulate_motion(self, waypoints: list[tuple[float, float, float]], extra: float = 0.0) -> None:
+        # Advance clock by the time the gantry kit would take to respond (no effect in real time)
+        duration = self.exchange_time + extra
+
+        for waypoint in waypoints:
+            duration += self.move_time(self.position, waypoint)
+            self.position = waypoint
+
+        clock.simulate(duration)
+
+    @tracing.traced("gantry")
     def move(self, x: float, y: float, z: float, accurately: bool = True) -> None:
         if accurately is False:
             msg = f"move({x},{y},{z})"
@@ -67,52 +115,112 @@ class gantry:
             msg = f"move({x+self.x_correction},{y+self.y_correction},{z})"
 
         if self.sim is False:
-            self.ser.write(msg.encode())
+            self.ser.write(msg)
             self.get_response()
+        else:
+            self.simulate_motion([(x, y, z)])
 
+    @tracing.traced("gantry")
+    def move_path(self, waypoints: list[tuple[float, float, float]], accurately: bool = True) -> None:
+        # Send a sequence of moves as one command, run back to back by the firmware with a single response
+        if accurately is True:
+            sent = [(x+self.x_correction, y+self.y_correction, z) for x, y, z in waypoints]
+        else:
+            sent = waypoints
+
+        for start, end in self.path_chunks(sent):
+            if self.sim is False:
+                self.ser.write(self.path_message(sent[start:end]))
+                self.get_response()
+            else:
+                self.simulate_motion(waypoints[start:end])
+
+    def path_message(self, waypoints: list[tuple[float, float, float]]) -> str:
+        # Fixed precision, so message length is predictable
+        return f"path({len(waypoints)}," + ",".join(f"{x:.2f},{y:.2f},{z:.2f}" for x, y, z in waypoints) + ")"
+
+    def path_chunks(self, waypoints: list[tuple[float, float, float]]) -> list[tuple[int, int]]:
+        # (start, end) of each command, filled up to the firmware waypoint queue or serial buffer, whichever is smaller
+        chunks = []
+        start = 0
+
+        for end in range(1, len(waypoints) + 1):
+            if end - start > self.max_waypoints or len(self.path_message(waypoints[start:end])) > self.max_command_bytes:
+                chunks.append((start, end - 1))
+                start = end - 1
+
+        if start < len(waypoints):
+            chunks.append((start, len(waypoints)))
+
+        return chunks
+
+    @tracing.traced("gantry")
     def softHome(self) -> None:
         logging.info("Soft homing gantry..")
         if self.sim is False:
-            self.ser.write("softHome()".encode())
+            self.ser.write("softHome()")
             self.get_response()
+        else:
+            self.simulate_motion([self.home])
 
+    @tracing.traced("gantry")
     def hardHome(self) -> None:
         logging.info("Hard homing gantry..")
         if self.sim is False:
-            self.ser.write("hardHome()".encode())
+            self.ser.write("hardHome()")
             self.get_response()
+        else:
+            # Each axis seeks its end stop at homing speed
+            x, y, z = self.position
+            self.simulate_motion([self.home], extra=max(abs(x - self.home[0]), abs(y)) / self.xy_homing_speed + abs(z) / self.z_homing_speed)
 
+    @tracing.traced("gantry")
     def zQuickHome(self) -> None:
         logging.info("Homing z axis..")
         if self.sim is False:
-            self.ser.write("zQuickHome()".encode())
+            self.ser.write("zQuickHome()")
             self.get_response()
+        else:
+            self.simulate_motion([(self.position[0], self.position[1], 0)])
 
+    @tracing.traced("gantry")
     def gantryZero(self) -> None:
         logging.info("Safely returning gantry to zero..")
         if self.sim is False:
-            self.ser.write("gantryZero()".encode())
+            self.ser.write("gantryZero()")
+        else:
+            self.simulate_motion([(self.position[0], self.position[1], 0), self.home])
 
+    @tracing.traced("gantry")
     def mix(self, count: int = 36, displacement: float = 0.125, accel: float = 200) -> None:
         logging.info(f"Mixing electrolyte {count}x times: {displacement}revs at {accel}revs/s2..")
         # Move away from mixing chamber first
         self.gantryZero()
 
         if self.sim is False:
-            self.ser.write(f"mix({count},{displacement},{accel})".encode())
+            self.ser.write(f"mix({count},{displacement},{accel})")
             self.get_response()
+        else:
+            # Out and back for each count
+            self.simulate_motion([], extra=2 * count * self.axis_time(displacement, self.mix_speed, accel))
 
+    @tracing.traced("gantry")
     def release(self) -> None:
         logging.info("Releasing pipette rack..")
         if self.sim is False:
-            self.ser.write("release()".encode())
+            self.ser.write("release()")
             self.get_response()
+        else:
+            self.simulate_motion([])
 
+    @tracing.traced("gantry")
     def remove_pipette(self) -> None:
         logging.info("Pinching pipette rack..")
         if self.sim is False:
-            self.ser.write("pinch()".encode())
+            self.ser.write("pinch()")
             self.get_response()
+        else:
+            self.simulate_motion([])
 
         self.zQuickHome()
         self.release()
\ No newline at end of file
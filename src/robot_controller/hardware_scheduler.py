@@ -3,38 +3,47 @@ import logging
 import math
 import os
 import sys
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
-from robot_controller import fluid_controller, mass_balance, mixing_station, test_cell
+from robot_controller import clock, command_futures, dose_planner, fluid_controller, mass_balance, mixing_station, state_journal, station_logging, test_cell, tracing
 
-# Save logs to file
-logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S',
-                    level=logging.INFO,
-                    force=True,
-                    handlers=[logging.FileHandler("mixing_station.log", mode="a"), logging.StreamHandler(sys.stdout)])
+# Save logs to file (JSON lines, rotated and compressed) and stdout, written by a background thread
+station_logging.configure("mixing_station.log")
 
 class scheduler:
     def __init__(self, device_name: str, resume: bool = False, home: bool = False, clear: bool = False) -> None:
         # Read device data JSON
         self.json_file = "data/devices/hardcoded_values.json"
+        self.gains_file = "data/devices/peltier_gains.json" # tuned gains, kept apart so hand-written device data is never rewritten
+        self.device_name = device_name
         device_data = self.read_json(device_name)
 
+        # Journal of station state (container volumes, doses, active pipette), replayed on start up
+        self.journal = state_journal.state_journal("data/variables/state")
+
         # Establish serial connections
         self.fluid_handler = fluid_controller.fluid_handler(device_data["Fluid_Address"], not device_data["Fluid_Active"])
-        self.mass_balance = mass_balance.mass_reader(device_data["Mass_Address"], not device_data["Mass_Active"])
+        self.mass_balance = mass_balance.mass_reader(device_data["Mass_Address"], not device_data["Mass_Active"],
+                                                     stream=device_data.get("Mass_Stream", False), continuous=device_data.get("Mass_Continuous", False))
         
         self.test_cell = test_cell.measurements(squid_port=device_data["Squid_Address"], temp_port=device_data["Temp_Address"], squid_sim=not device_data["Squid_Active"], temp_sim=not device_data["Temp_Active"])
-        self.mixer = mixing_station.electrolyte_mixer(gantry_port=device_data["Gantry_Address"], pipette_port=device_data["Pipette_Address"], gantry_sim=not device_data["Gantry_Active"], pipette_sim=not device_data["Pipette_Active"], home=home)
+        self.mixer = mixing_station.electrolyte_mixer(gantry_port=device_data["Gantry_Address"], pipette_port=device_data["Pipette_Address"], gantry_sim=not device_data["Gantry_Active"],
+                                                      pipette_sim=not device_data["Pipette_Active"], home=home, journal=self.journal)
 
         # Retrieve any requried variables from controllers
         self.max_dose = self.mixer.pipette.max_dose
 
+        # Recipes are compiled into a dose plan before execution, reordered to minimise gantry travel
+        self.planner = dose_planner.dose_planner(self.mixer, self.max_dose)
+        self.optimise_plan = True
+        self.plan_file = "data/variables/dose_plan.json"
+
         # Retrieve hardcoded values and pass down
         self.mixer.gantry.x_correction = device_data["X_Gantry_Shift"]
         self.mixer.gantry.y_correction = device_data["Y_Gantry_Shift"]
@@ -45,9 +54,33 @@ class scheduler:
         self.test_cell.squid.mode = device_data["Squid_Mode"]
         self.test_cell.cell_constant = device_data["Cell_Constant"]
 
+        # Peltier PID gains for each temperature band, tuned gains (see tune_temperature_control) override device data
+        tuned_gains = self.read_tuned_gains().get(device_name, {})
+
+        for band, gains in {**device_data.get("Peltier_Gains", {}), **tuned_gains}.items():
+            self.test_cell.peltier.set_band_gains(band, gains)
+
         logging.info("Successfully passed hardcoded values for " + device_name + ".")
 
         self.electrolyte_volume = None
+        self.cell_mixture = None # mixture currently in test cell, recorded with its measurements
+
+        # Progress through current experiment (sequential mode), journaled so a restart continues at the exact step:
+        # new -> preparing (plan step index) -> prepared -> transferred -> measured -> analysed
+        self.phases = ["new", "preparing", "prepared", "transferred", "measured", "analysed"]
+        self.tracking = False
+        self.resume_phase = "new"
+
+        # Pipelined mode: next mixture is prepared in the mixing chamber (gantry and pipette only) whilst the
+        # test cell side (fluid handler, mass balance, peltier and fans) analyses or cleans the previous one
+        self.mixer_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mixer")
+        self.cell_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cell")
+
+        self.preparation: Future | None = None
+        self.cleaning: Future | None = None
+
+        self.fluid_lock = threading.RLock()
+        self.balance_lock = threading.RLock() # mass balance and fans (fan noise upsets readings)
 
         # Declare variables for CSV read
         self.df = pd.DataFrame()
@@ -82,6 +115,38 @@ class scheduler:
         logging.error("Device data for " + device_name + " could not be located.")
         sys.exit()
 
+    def read_tuned_gains(self) -> dict:
+        # Device ID -> band -> gains
+        if not os.path.exists(self.gains_file):
+            return {}
+
+        with open(self.gains_file) as json_data:
+            return json.load(json_data)
+
+    def save_peltier_gains(self, band: str, gains: dict) -> None:
+        tuned_gains = self.read_tuned_gains()
+        tuned_gains.setdefault(self.device_name, {})[band] = gains
+
+        with open(self.gains_file, 'w') as json_data:
+            json.dump(tuned_gains, json_data, indent=4)
+
+        logging.info(f"Saved {band} gains for " + self.device_name + ".")
+
+    def tune_temperature_control(self, setpoints: dict | None = None, cycles: int = 4) -> None:
+        # Relay auto-tune each temperature band, e.g. {"heating": 50, "cooling": 5, "subzero": -15}, and save gains to device data
+        if setpoints is None:
+            setpoints = {"heating": 50, "cooling": 5, "subzero": -15}
+
+        for band, setpoint in setpoints.items():
+            if self.test_cell.peltier.get_band(setpoint) != band:
+                logging.error(f"Setpoint of {setpoint}C is outside of {band} band.")
+                continue
+
+            gains = self.test_cell.peltier.auto_tune(setpoint, cycles=cycles)
+
+            if gains is not None:
+                self.save_peltier_gains(band, gains)
+
     def read_csv(self) -> None:
         # Open CSV as dataframe
         logging.info("Reading CSV file..")
@@ -100,22 +165,58 @@ class scheduler:
         
         self.df = pd.read_csv(csv_location, header=0, names=df_columns.keys(), index_col=False).astype(df_columns)
         self.df.set_index("#")
-        self.save_csv()
+
+        if self.csv_filename == self.save_file:
+            # Resuming: apply changes journaled since saved state was last written
+            for column, prefix in [("Container Volume (mL)", "volume/"), ("Dose Volume (uL)", "dose/")]:
+                for i, value in self.journal.items(prefix).items():
+                    self.df.loc[int(i), column] = value
+        else:
+            # New recipe file, so journaled volumes and experiment progress no longer apply
+            self.journal.remove("volume/")
+            self.journal.remove("dose/")
+            self.journal.remove("experiment/")
+
+        self.checkpoint()
         
-        now = datetime.now()
+        now = clock.now()
         logging.info("Experiment ready to begin: " + now.strftime("%d/%m/%Y %H:%M:%S"))
 
     def save_csv(self) -> None:
         logging.info("Saving volume changes to CSV.")
-        self.df.to_csv(os.path.join(self.csv_path, self.save_file), index=False)
+
+        # Write to temporary file then rename, so an interruption cannot leave a truncated CSV
+        save_location = os.path.join(self.csv_path, self.save_file)
+        temporary = save_location + ".tmp"
+
+        with open(temporary, 'w') as file:
+            self.df.to_csv(file, index=False)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temporary, save_location)
+
+    def checkpoint(self) -> None:
+        # Saved state includes all journaled changes, so journal can be compacted
+        self.save_csv()
+        self.journal.checkpoint()
 
     def close_all_ports(self) -> None:
+        # Let any background work finish first
+        self.wait_for_clean()
+        self.mixer_worker.shutdown(wait=True)
+        self.cell_worker.shutdown(wait=True)
+
         self.mixer.gantry.close_ser()
         self.mixer.pipette.close_ser()
         self.fluid_handler.close_ser()
         self.test_cell.peltier.close_ser()
         self.mass_balance.close_ser()
 
+        self.checkpoint()
+        self.journal.close()
+
+    @tracing.traced("scheduler")
     def update_dose_volumes(self, values: dict) -> None:
         #{'param_a': 5.0, 'param_b': 5.0, ..} dict formal provided by atinary
 
@@ -132,20 +233,83 @@ class scheduler:
                 if target == name:
                     new_value = values[name]
                     self.df.loc[i, "Dose Volume (uL)"] = new_value
+                    self.journal.record(f"dose/{i}", float(new_value))
                     logging.info(target + f" dose volume updated to {new_value}uL.")
                     found = True
 
             if found is False:
                 logging.error("No suggestion found for " + target + ", dose volume set to zero.")
-        
+                self.journal.record(f"dose/{i}", 0.0)
+
         # Save to current state
-        self.save_csv()
+        self.journal.sync()
 
         # Get total volume for later use by fluid handling kit
         self.electrolyte_volume = self.df["Dose Volume (uL)"].sum()
 
         logging.info(f'Recipe will result in a total electrolyte volume of {self.electrolyte_volume/1000}mL.')
 
+    def start_experiment(self, values: dict) -> str:
+        # Begin tracking progress of a suggestion, returns phase reached if it was interrupted part way through
+        self.tracking = True
+
+        if self.journal.get("experiment/values") == values:
+            self.resume_phase = self.journal.get("experiment/phase", "new")
+            self.cell_mixture = self.journal.get("experiment/mixture")
+
+            logging.info(f"Resuming interrupted experiment from {self.resume_phase} phase..")
+        else:
+            # A different suggestion may have left a stale (partial) mixture in the mixing chamber
+            if self.journal.get("experiment/phase", "new") in ["preparing", "prepared"]:
+                self.journal.record("chamber_dirty", True, sync=True)
+
+            self.clear_stale_mixture()
+
+            self.resume_phase = "new"
+            self.journal.remove("experiment/")
+            self.journal.record("experiment/values", values)
+            self.journal.record("experiment/phase", "new", sync=True)
+
+        # Previous mixture may have been left in the test cell
+        if self.phases.index(self.resume_phase) < self.phases.index("transferred") and self.journal.get("cell_dirty", False) is True:
+            logging.info("Test cell was not cleaned before interruption.")
+            self.clean()
+
+        return self.resume_phase
+
+    def clear_stale_mixture(self) -> None:
+        # Dosing interrupted, or mixture never transferred, would otherwise be dosed on top of. Journalled whether or not
+        # an experiment is tracked (pipelined mode restarts interrupted suggestions rather than resuming them).
+        if self.journal.get("chamber_dirty", False) is False:
+            return
+
+        logging.info("Mixing chamber was not emptied before interruption.")
+        self.wait_for_clean()
+
+        with self.fluid_lock:
+            self.journal.record("cell_dirty", True, sync=True)
+            self.clear_mixing_chamber()
+
+        self.clean()
+
+    def set_phase(self, phase: str, **values: state_journal.journal_value) -> None:
+        # Journal progress (and any values needed to resume), only whilst an experiment is being tracked
+        if self.tracking is False:
+            return
+
+        for key, value in values.items():
+            self.journal.record("experiment/" + key, value)
+
+        self.journal.record("experiment/phase", phase, sync=True)
+
+    def finish_experiment(self) -> None:
+        # Measurements sent, so an interruption from here on starts a new suggestion
+        self.journal.remove("experiment/")
+        self.journal.sync()
+
+        self.tracking = False
+        self.resume_phase = "new"
+
     def calculate_cost(self) -> float:
         self.df["Total Cost"] =  self.df["Cost (/uL)"] * self.df["Dose Volume (uL)"]
         total_cost = self.df["Total Cost"].sum()
@@ -156,11 +320,33 @@ class scheduler:
     def subtract_dose_volume(self, i: int, dose: float) -> None:
         self.df.loc[i, "Dose Volume (uL)"] -= dose
 
+    @tracing.traced("scheduler")
     def synthesise(self) -> None:
+        if self.resume_phase in ["transferred", "measured", "analysed"]:
+            logging.info("Mixture already transferred to test cell.")
+            return
+
+        if self.resume_phase == "prepared":
+            logging.info("Mixture already prepared in mixing chamber.")
+            mixture = self.journal.get("experiment/mixture")
+        else:
+            mixture = self.prepare_mixture()
+
+        self.transfer_mixture(mixture)
+
+        logging.info("Synthesis complete.")
+
+    @tracing.traced("scheduler")
+    def prepare_mixture(self) -> dict:
+        # Dose and mix current recipe in the mixing chamber, only uses the gantry and pipette
         logging.info("Beginning electrolyte mixing..")
 
-        # Check if pipette currently active, return if so
-        self.mixer.return_pipette()
+        # Continue interrupted plan from the step after the last one completed
+        resume = self.resume_phase == "preparing" and os.path.exists(self.plan_file)
+
+        if resume is False:
+            # Check if pipette currently active, return if so
+            self.mixer.return_pipette()
 
         try:
             non_zero = self.df[self.df["Dose Volume (uL)"] > 0]
@@ -172,108 +358,230 @@ class scheduler:
         if self.electrolyte_volume is None:
             self.electrolyte_volume = non_zero["Dose Volume (uL)"].sum()
 
-        # Calculate mass for later checks
-        self.df["Mass (1e3*g)"] =  self.df["Density (g/mL)"] * self.df["Dose Volume (uL)"]
-        total_mass = self.df["Mass (1e3*g)"].sum()/1000
-        self.df = self.df.drop("Mass (1e3*g)", axis=1)
-            
-        # Loop through all non zero constituents
-        for i in non_zero.index.to_numpy(dtype=int):
-            # Collect pipette for desired chemical (pipette 1 for pot 1)
-            self.mixer.pick_pipette(i+1)
-    
-            # Extract relevant df row
-            relevant_row = non_zero.loc[i]
-            required_volume = relevant_row["Dose Volume (uL)"]
-                
-            doses = math.floor(required_volume // self.max_dose) + 1
-            last_dose = required_volume % self.max_dose
+        if resume is True:
+            plan = self.planner.load(self.plan_file)
+            start = self.journal.get("experiment/step", -1) + 1
 
-            # Extract starting volume in pot
-            pot_volume = relevant_row["Container Volume (mL)"]
+            logging.info(f"Resuming dose plan at operation {start+1} of {len(plan['steps'])}..")
+        else:
+            # Compile recipe into plan of primitive operations (also gives mass for later checks)
+            plan = self.planner.compile(self.df, optimise=self.optimise_plan)
+            self.planner.save(plan, self.plan_file)
+            start = 0
 
-            # If larger than maximum required, perform multiple collections and deliveries until entire volume is transferred
-            for j in range(doses):
-                if j == doses-1:
-                    dose = last_dose
-                else:
-                    dose = self.max_dose
+            self.journal.record("experiment/step", None)
+            self.set_phase("preparing")
 
-                if math.floor(dose) == 0:
-                    continue
+        self.journal.record("chamber_dirty", True, sync=True)
 
-                # Aspirate using data from relevant df row, increment pot co ordinates
-                pot_volume = self.mixer.collect_volume(dose, pot_volume, relevant_row["Name"], i+1, relevant_row["Aspirate Scalar"], relevant_row["Aspirate Speed (uL/s)"])
+        mixture = {"electrolyte_volume": plan["electrolyte_volume"], # ul
+                   "total_mass": plan["total_mass"], # g
+                   "cost": float(self.calculate_cost()),
+                   "composition": dict(zip(non_zero["Name"], non_zero["Dose Volume (uL)"].astype(float))), # ul
+                }
 
-                # Move to mixing chamber and dispense
-                self.mixer.deliver_volume()
+        self.execute_plan(plan, start)
+        self.set_phase("prepared", mixture=mixture)
 
-                # Set new starting volume for next repeat
-                self.df.loc[i, "Container Volume (mL)"] = pot_volume
+        # Compact journaled volume changes into saved state once per recipe
+        self.checkpoint()
 
-                # Save csv in current state (starting volumes up to date in case of interruption)
-                self.save_csv()
+        logging.info("Mixture prepared in mixing chamber.")
+        return mixture
 
-            # Return pipette
-            self.mixer.return_pipette()
+    @tracing.traced("scheduler")
+    def transfer_mixture(self, mixture: dict) -> None:
+        # Pump mixture from mixing chamber to test cell, checking mass balance changes
+        self.cell_mixture = mixture
+        self.journal.record("cell_dirty", True, sync=True)
 
-        # Trigger servo to mix electrolyte
-        self.mixer.gantry.mix()
+        with self.balance_lock:
+            # Turn off fans to remove noise from mass readings
+            self.test_cell.peltier.turn_fans_off()
 
-        # Turn off fans to remove noise from mass readings
-        self.test_cell.peltier.turn_fans_off()
+            # Take mass balance reading
+            starting_mass = self.mass_balance.get_mass()
 
-        # Take mass balance reading
-        starting_mass = self.mass_balance.get_mass()
+        with self.balance_lock, self.fluid_lock:
+            # Turn fans back on whilst pumping electrolyte to next stage (separate ports, so run together)
+            fans = self.test_cell.peltier.submit("set_fan_modes")
+            pumping = self.fluid_handler.submit("add_electrolyte", mixture["electrolyte_volume"])
 
-        # Turn fans back on during pumping
-        self.test_cell.peltier.set_fan_modes()
+            command_futures.wait_all([fans, pumping])
+            self.journal.record("chamber_dirty", False, sync=True)
 
-        # Pump electrolyte to next stage
-        self.fluid_handler.add_electrolyte(self.electrolyte_volume)
+        with self.balance_lock:
+            # Turn off fans to remove noise from mass readings
+            self.test_cell.peltier.turn_fans_off()
+                
+            self.mass_balance.check_mass_change(mixture["total_mass"], starting_mass)
+
+            # Turn fans back on
+            self.test_cell.peltier.set_fan_modes()
+
+        self.set_phase("transferred")
+
+    def start_preparation(self, values: dict) -> None:
+        # Pipelined mode: update recipe and begin dosing it into the mixing chamber in the background
+        if self.preparation is not None:
+            logging.error("Cannot start preparing a new mixture before the previous one has been transferred.")
+            sys.exit()
+
+        # Only set after an interruption, as each mixture is transferred before the next is started
+        self.clear_stale_mixture()
 
-        # Turn off fans to remove noise from mass readings
-        self.test_cell.peltier.turn_fans_off()
-            
-        self.mass_balance.check_mass_change(total_mass, starting_mass)
+        self.update_dose_volumes(values)
+        self.preparation = self.mixer_worker.submit(self.prepare_mixture)
 
-        # Turn fans back on
-        self.test_cell.peltier.set_fan_modes()
+    def start_clean(self, cleaning_temp: float = 40, wait_time: float = 10, next_temp: float | None = None) -> None:
+        # Pipelined mode: clean test cell in the background
+        self.wait_for_clean()
+        self.cleaning = self.cell_worker.submit(self.clean, cleaning_temp, wait_time, next_temp)
+
+    def wait_for_clean(self) -> None:
+        if self.cleaning is not None:
+            self.cleaning.result()
+            self.cleaning = None
+
+    def complete_synthesis(self) -> dict:
+        # Pipelined mode: wait for prepared mixture and a clean test cell, then transfer
+        if self.preparation is None:
+            logging.error("No mixture is being prepared.")
+            sys.exit()
+
+        mixture = self.preparation.result()
+        self.preparation = None
+
+        self.wait_for_clean()
+        self.transfer_mixture(mixture)
 
         logging.info("Synthesis complete.")
+        return mixture
 
-    def analyse(self, temp: float) -> tuple[float, float]:
-        # Potentiostat / Temperature control functions
-        impedance_results = self.test_cell.single_temperature_analysis(temp)
-        
-        # Empty cell
-        self.fluid_handler.empty_cell(fluid_vol=self.electrolyte_volume)
+    def restore_pipette(self, plan: dict, start: int) -> None:
+        # Attach pipette that plan expects to be holding before step start
+        required = 0
+
+        for step in plan["steps"][:start]:
+            if step["op"] == "pick_pipette":
+                required = step["pipette"]
+            elif step["op"] == "return_pipette":
+                required = 0
+
+        active = self.journal.get("pipette", 0)
+
+        if active != required:
+            if active != 0:
+                self.mixer.return_pipette()
+
+            if required != 0:
+                self.mixer.pick_pipette(required)
+
+        if start < len(plan["steps"]) and plan["steps"][start]["op"] == "deliver":
+            logging.warning("Resuming at a delivery, collected dose may have been lost from pipette.")
+
+    def execute_plan(self, plan: dict, start: int = 0) -> None:
+        # Stream primitive operations from a compiled dose plan, optionally continuing from an interrupted step
+        if start > 0:
+            self.restore_pipette(plan, start)
+
+        for index in range(start, len(plan["steps"])):
+            step = plan["steps"][index]
+
+            if step["op"] == "pick_pipette":
+                self.mixer.pick_pipette(step["pipette"])
+
+            elif step["op"] == "collect":
+                # Aspirate using planned dose, leaving pipette in pot to lift on way to chamber
+                pot_volume = self.mixer.collect_volume(step["volume"], step["starting_volume"], step["name"], step["pot"], step["scalar"], step["speed"], lift=False, z=step.get("z"))
+
+                # Set new starting volume for next repeat (journaled in case of interruption)
+                self.df.loc[step["row"], "Container Volume (mL)"] = pot_volume
+                self.journal.record(f"volume/{step['row']}", float(pot_volume))
+
+            elif step["op"] == "deliver":
+                # Lift, move to mixing chamber and dispense
+                self.mixer.deliver_volume(step["pot"])
+
+            elif step["op"] == "return_pipette":
+                self.mixer.return_pipette()
+
+            elif step["op"] == "mix":
+                # Trigger servo to mix electrolyte
+                self.mixer.gantry.mix()
+
+            else:
+                logging.error("Unknown dose plan operation: " + step["op"])
+                sys.exit()
+
+            # Completed steps are never repeated on resume, so each must survive power loss
+            if self.tracking is True:
+                self.journal.record("experiment/step", index, sync=True)
+
+    @tracing.traced("scheduler")
+    def analyse(self, temp: float, fluid_vol: float | None = None) -> tuple[float, float]:
+        # Volume in cell may differ from current recipe when pipelined
+        if fluid_vol is None:
+            fluid_vol = self.electrolyte_volume
+
+        if self.resume_phase in ["measured", "analysed"]:
+            # Measured before interruption, results kept in journal
+            impedance_results = tuple(self.journal.get("experiment/results"))
+            logging.info(f"Using measurements taken before interruption: {impedance_results}.")
+        else:
+            # Potentiostat / Temperature control functions
+            impedance_results = self.test_cell.single_temperature_analysis(temp)
+
+            # Link recipe and cost to measurements in experiment database
+            if self.cell_mixture is not None:
+                identifier = self.test_cell.last_identifier
+
+                self.test_cell.database.record(identifier, device=self.device_name, electrolyte_volume=float(self.cell_mixture["electrolyte_volume"]), cost=float(self.cell_mixture["cost"]))
+                self.test_cell.database.record_composition(identifier, self.cell_mixture["composition"])
+
+            self.set_phase("measured", results=[float(value) for value in impedance_results], identifier=self.test_cell.last_identifier)
+
+        if self.resume_phase != "analysed":
+            # Empty cell
+            with self.fluid_lock:
+                self.fluid_handler.empty_cell(fluid_vol=fluid_vol)
+
+            self.set_phase("analysed")
 
         logging.info("Analysis complete.")
 
         # returns tuple (ohmics res, ionic conductivity)
         return impedance_results
     
-    def clean(self, cleaning_temp: float = 40, wait_time: float = 10) -> None:
+    @tracing.traced("scheduler")
+    def clean(self, cleaning_temp: float = 40, wait_time: float = 10, next_temp: float | None = None) -> None:
         logging.info("Beginning cell cleaning procedure..")
 
-        # Clean cell (acid) and empty
-        self.fluid_handler.clean_cell(fluid_vol=self.test_cell.test_cell_volume, wait_time=wait_time)
+        with self.fluid_lock:
+            # Clean cell (acid) and empty
+            self.fluid_handler.clean_cell(fluid_vol=self.test_cell.test_cell_volume, wait_time=wait_time)
 
-        # Ethanol rinse followed by empty and heating
-        self.fluid_handler.rinse_cell(fluid_vol=self.test_cell.test_cell_volume)
+            # Ethanol rinse followed by empty and heating
+            self.fluid_handler.rinse_cell(fluid_vol=self.test_cell.test_cell_volume)
 
         # Only run if test cell is below cleaning temperature
         if self.test_cell.peltier.get_t1_value() < cleaning_temp:
             logging.info(f"Raising temperature to {cleaning_temp}C to remove liquid residues..")
             self.test_cell.peltier.wait_until_temperature(cleaning_temp, keep_on=False, steady_state=wait_time)
 
+        self.journal.record("cell_dirty", False, sync=True)
+
+        # Start ramping to next experiment's set point whilst the next mixture is prepared
+        if next_temp is not None:
+            self.test_cell.peltier.set_temperature(next_temp)
+
         logging.info("Cell cleaning complete.")
 
     def clear_mixing_chamber(self) -> None:
         logging.info("Beginning chamber clearing procedure..")
         self.fluid_handler.add_electrolyte(self.test_cell.test_cell_volume)
         self.fluid_handler.empty_cell(self.test_cell.test_cell_volume)
+        self.journal.record("chamber_dirty", False, sync=True)
 
     def run_life_test(self, N: int = 1) -> None:
         logging.info(f"Beginning {N}X life test..")
@@ -322,7 +630,7 @@ class scheduler:
         plt.show()
 
     def tune(self, pot_number: int, aspirate_scalars: list[float], aspirate_volume: list[float], container_volume: float, density: float, N: int, M: int, aspirate_speed: float = 100.0, move_electrolyte: bool = False) -> None:
-        now = datetime.now()
+        now = clock.now()
         logging.info(f"Tuning will perform a total of {N*M} aspirations: " + now.strftime("%d/%m/%Y %H:%M:%S"))
 
         errors = np.zeros((N,M))
@@ -348,8 +656,8 @@ class scheduler:
                     if math.floor(dose) == 0:
                         continue 
                     
-                    container_volume = self.mixer.collect_volume(dose, container_volume, "_", pot_number, scalar, aspirate_speed)
-                    self.mixer.deliver_volume()
+                    container_volume = self.mixer.collect_volume(dose, container_volume, "_", pot_number, scalar, aspirate_speed, lift=False)
+                    self.mixer.deliver_volume(pot_number)
 
                 if move_electrolyte is True: 
                     # Pump electrolyte to next stage
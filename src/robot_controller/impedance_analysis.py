@@ -0,0 +1,313 @@
+import glob
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from robot_controller import spectrum_store
+
+logging.basicConfig(level = logging.INFO)
+
+class impedance_analyser:
+    def __init__(self, cell_constant: float = 1.0, epsilon_0: float = 8.8541878128e-12) -> None:
+        # Vectorised EIS analysis: derived spectra in one pass plus an equivalent circuit fit of
+        # R0 + (Rct || CPE1) + CPE2, i.e. a Randles cell with a blocking electrode (double layer) tail
+        self.cell_constant = cell_constant
+        self.epsilon_0 = epsilon_0 # vacuum permittivity
+
+        # Scaling of reported values. Ohmic resistance has always been reported x100 (20 Ohms as 2000), kept so
+        # results stay comparable with earlier campaigns, divide by ohmic_scale for Ohms
+        self.ohmic_scale = 100
+        self.conductivity_scale = 1000 # mS/cm
+
+        # Levenberg-Marquardt settings
+        self.max_iterations = 100
+        self.tolerance = 1e-8 # relative change in cost to stop
+        self.n_limits = (0.3, 1.0) # CPE exponent bounds
+        self.max_fit_error = 0.1 # rms relative error, above which fitted values are not used
+        self.max_step = 2.0 # largest change in any (log) parameter per iteration
+        self.grid_points = 8 # per resistance and frequency, for starting point search
+        self.starts = 3 # best grid points to fit from
+
+        self.parameter_names = ["R0", "Rct", "Q1", "n1", "Q2", "n2"]
+
+    def load_spectrum(self, path: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Named columns, so the CSV index column (and any column reordering) does not matter
+        data = pd.read_csv(path, usecols=["Frequency [Hz]", "Real Impedance", "Imaginary Impedance"])
+        data = data.dropna()
+
+        return data["Frequency [Hz]"].to_numpy(dtype=float), data["Real Impedance"].to_numpy(dtype=float), data["Imaginary Impedance"].to_numpy(dtype=float)
+
+    def derived_spectra(self, frequency: np.ndarray, z_real: np.ndarray, z_imag: np.ndarray) -> dict[str, np.ndarray]:
+        # Complex permittivity, conductivity and loss tangent for every frequency at once
+        omega = 2 * np.pi * frequency
+        z_img = -z_imag
+        z_square = z_real ** 2 + z_img ** 2
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            epsilon_real = z_img * self.cell_constant / (omega * self.epsilon_0 * z_square)
+            epsilon_img = z_real * self.cell_constant / (omega * self.epsilon_0 * z_square)
+
+            conductivity = self.epsilon_0 * epsilon_img * omega
+            tan_delta = epsilon_img / epsilon_real
+
+        return {"epsilon_real": epsilon_real, "epsilon_img": epsilon_img, "conductivity": conductivity, "tan_delta": tan_delta}
+
+    def cpe(self, omega: np.ndarray, n: float | np.ndarray) -> np.ndarray:
+        # (j * omega) ^ n without complex powers
+        return omega ** n * np.exp(0.5j * np.pi * n)
+
+    def circuit_impedance(self, parameters: np.ndarray, omega: np.ndarray) -> np.ndarray:
+        # Parameters may be columns, to evaluate many circuits at once
+        R0, Rct, Q1, n1, Q2, n2 = parameters
+        return R0 + Rct / (1 + Rct * Q1 * self.cpe(omega, n1)) + 1 / (Q2 * self.cpe(omega, n2))
+
+    def to_parameters(self, x: np.ndarray) -> np.ndarray:
+        # Resistances and CPE magnitudes fitted in log space (always positive), exponents mapped smoothly into limits
+        R0, Rct, Q1, n1, Q2, n2 = x
+        low, high = self.n_limits
+
+        with np.errstate(over="ignore"):
+            return np.array([np.exp(R0), np.exp(Rct), np.exp(Q1), low + (high - low) / (1 + np.exp(-n1)), np.exp(Q2), low + (high - low) / (1 + np.exp(-n2))])
+
+    def from_parameters(self, parameters: np.ndarray) -> np.ndarray:
+        R0, Rct, Q1, n1, Q2, n2 = parameters
+        low, high = self.n_limits
+
+        def logit(n: float) -> float:
+            return np.log((n - low) / (high - n))
+
+        return np.array([np.log(R0), np.log(Rct), np.log(Q1), logit(n1), np.log(Q2), logit(n2)])
+
+    def initial_guesses(self, frequency: np.ndarray, z_real: np.ndarray, z_imag: np.ndarray) -> np.ndarray:
+        # Best starting points from a coarse grid, one per row
+        omega = 2 * np.pi * frequency
+        z = z_real + 1j * z_imag
+        high, low = np.argmax(frequency), np.argmin(frequency)
+
+        R0 = max(z_real[high], 1e-6)
+
+        # Electrode tail dominates -Z'' at lowest frequency: |Z''| = 1 / (Q2 * omega ^ n2)
+        Q2 = 1 / (max(abs(z_imag[low]), 1e-6) * omega[low] ** 0.9)
+
+        # Semicircle may be hidden by the tail, so search a coarse grid of Rct and arc frequency, omega = 1 / (Rct * Q1) ^ (1/n1)
+        Rct, corner = np.meshgrid(np.geomspace(0.1 * R0, max(np.abs(z).max(), R0), self.grid_points), np.geomspace(omega[low], omega[high], self.grid_points))
+        Rct, corner = Rct.reshape(-1, 1), corner.reshape(-1, 1)
+        Q1 = 1 / (Rct * corner ** 0.9)
+
+        with np.errstate(all="ignore"):
+            error = np.abs((self.circuit_impedance([R0, Rct, Q1, 0.9, Q2, 0.9], omega) - z) / np.abs(z)) ** 2
+
+        best = np.argsort(np.nan_to_num(error.sum(axis=1), nan=np.inf))[:self.starts]
+
+        return np.array([[R0, Rct[i, 0], Q1[i, 0], 0.9, Q2, 0.9] for i in best])
+
+    def residuals(self, x: np.ndarray, omega: np.ndarray, z: np.ndarray) -> np.ndarray:
+        # Modulus weighting, so every decade counts equally (trial steps may overflow, rejected by caller)
+        with np.errstate(all="ignore"):
+            error = (self.circuit_impedance(self.to_parameters(x), omega) - z) / np.abs(z)
+
+        return np.concatenate((error.real, error.imag))
+
+    def jacobian(self, x: np.ndarray, omega: np.ndarray, z: np.ndarray) -> np.ndarray:
+        # Analytic derivatives of the residuals with respect to the fitted (log and logit) parameters
+        R0, Rct, Q1, n1, Q2, n2 = self.to_parameters(x)
+        low, high = self.n_limits
+        log_jw = np.log(omega) + 0.5j * np.pi
+
+        s1 = self.cpe(omega, n1)
+        D = 1 + Rct * Q1 * s1
+        arc = -Rct ** 2 * Q1 * s1 / D ** 2
+        tail = 1 / (Q2 * self.cpe(omega, n2))
+
+        columns = [np.full(len(omega), R0, dtype=complex),
+                   Rct / D ** 2,
+                   arc,
+                   arc * log_jw * (n1 - low) * (high - n1) / (high - low),
+                   -tail,
+                   -tail * log_jw * (n2 - low) * (high - n2) / (high - low),
+                ]
+
+        J = np.stack(columns, axis=1) / np.abs(z)[:, None]
+        return np.concatenate((J.real, J.imag))
+
+    def least_squares(self, x: np.ndarray, omega: np.ndarray, z: np.ndarray) -> tuple[np.ndarray, float, int, bool]:
+        # Levenberg-Marquardt, with steps limited to a factor of e^max_step per parameter
+        r = self.residuals(x, omega, z)
+        cost = r @ r
+
+        damping = 1e-3
+        converged = False
+
+        for iteration in range(self.max_iterations):
+            J = self.jacobian(x, omega, z)
+            A = J.T @ J
+            g = J.T @ r
+
+            try:
+                step = np.linalg.solve(A + damping * np.diag(np.diag(A) + 1e-12), -g)
+            except np.linalg.LinAlgError:
+                break
+
+            step *= min(1.0, self.max_step / max(np.abs(step).max(), 1e-300))
+
+            new_x = x + step
+            new_r = self.residuals(new_x, omega, z)
+
+            with np.errstate(all="ignore"):
+                new_cost = new_r @ new_r
+
+            if np.isfinite(new_cost) and new_cost < cost:
+                improvement = (cost - new_cost) / max(cost, 1e-300)
+                x, r, cost = new_x, new_r, new_cost
+                damping = max(damping / 3, 1e-12)
+
+                if improvement < self.tolerance:
+                    converged = True
+                    break
+            else:
+                damping *= 4
+
+                if damping > 1e12:
+                    converged = True # no further improvement possible
+                    break
+
+        return x, float(cost), iteration + 1, converged
+
+    def fit_circuit(self, frequency: np.ndarray, z_real: np.ndarray, z_imag: np.ndarray) -> dict:
+        omega = 2 * np.pi * frequency
+        z = z_real + 1j * z_imag
+        points = 2 * len(z)
+
+        # Fit from several starting points, as overlapping arcs give local minima
+        fits = [self.least_squares(self.from_parameters(guess), omega, z) for guess in self.initial_guesses(frequency, z_real, z_imag)]
+        x, cost, _, converged = min(fits, key=lambda fit: fit[1])
+        iterations = sum(fit[2] for fit in fits)
+
+        parameters = self.to_parameters(x)
+        dof = max(points - len(x), 1)
+
+        return {"parameters": dict(zip(self.parameter_names, parameters.tolist())),
+                "chi_square": cost / dof, # weighted, i.e. relative error squared per point
+                "rms_error": float(np.sqrt(cost / points)),
+                "iterations": iterations,
+                "converged": converged,
+            }
+
+    def analyse(self, frequency: np.ndarray, z_real: np.ndarray, z_imag: np.ndarray, fit: bool = True) -> dict:
+        spectra = self.derived_spectra(frequency, z_real, z_imag)
+
+        # Ionic conductivity at peak of loss tangent
+        max_index = np.nanargmax(spectra["tan_delta"])
+        ionic_conductivity = np.round(spectra["conductivity"][max_index], 5).item() * self.conductivity_scale # mS/cm
+
+        # Ohmic resistance from minimum of abs(Imag), used if fit is not run or fails
+        min_index = np.argmin(np.abs(z_imag)) # first index if multiple instances
+        ohmic_resistance = np.round(z_real[min_index], 5).item() * self.ohmic_scale
+
+        results = {"ohmic_resistance": ohmic_resistance,
+                   "ionic_conductivity": ionic_conductivity,
+                   "fit_conductivity": None,
+                   "chi_square": None,
+                   "fit": None,
+                }
+
+        if fit is True and len(frequency) > len(self.parameter_names):
+            circuit = self.fit_circuit(frequency, z_real, z_imag)
+            R0 = circuit["parameters"]["R0"]
+
+            results["fit"] = circuit
+            results["chi_square"] = circuit["chi_square"]
+
+            if circuit["rms_error"] < self.max_fit_error and np.isfinite(R0) and R0 > 0:
+                results["ohmic_resistance"] = np.round(R0, 5).item() * self.ohmic_scale
+                results["fit_conductivity"] = np.round(self.cell_constant / R0, 5).item() * self.conductivity_scale # mS/cm
+
+        return results
+
+    def load_stored_spectrum(self, store: spectrum_store.spectrum_store, identifier: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        frequency, z_real, z_imag = store.load_columns("AC", identifier, ["Frequency [Hz]", "Real Impedance", "Imaginary Impedance"])
+        valid = np.isfinite(frequency) & np.isfinite(z_real) & np.isfinite(z_imag)
+
+        return frequency[valid], z_real[valid], z_imag[valid]
+
+    def analyse_file(self, path: str, fit: bool = True) -> dict:
+        frequency, z_real, z_imag = self.load_spectrum(path)
+        return self.analyse(frequency, z_real, z_imag, fit=fit)
+
+    def analyse_stored(self, store: spectrum_store.spectrum_store, identifier: str, fit: bool = True) -> dict:
+        frequency, z_real, z_imag = self.load_stored_spectrum(store, identifier)
+        return self.analyse(frequency, z_real, z_imag, fit=fit)
+
+# Spectrum stores opened by this process, so worker processes read each index once
+stores = {}
+
+def open_store(path: str) -> spectrum_store.spectrum_store:
+    if path not in stores:
+        stores[path] = spectrum_store.spectrum_store(path)
+
+    return stores[path]
+
+def analyse_dataset(path: str, cell_constant: float, fit: bool = True, identifier: str | None = None) -> dict:
+    # Worker for batch reprocessing (module level so it can be sent to a process pool), one row per spectrum.
+    # Path is either an AC CSV file, or a spectrum store folder holding identifier.
+    try:
+        if identifier is None:
+            identifier = os.path.basename(path).removesuffix("_AC.csv")
+            results = impedance_analyser(cell_constant).analyse_file(path, fit=fit)
+        else:
+            results = impedance_analyser(cell_constant).analyse_stored(open_store(path), identifier, fit=fit)
+
+    except (ValueError, KeyError, OSError) as ex:
+        return {"Identifier": identifier, "Error": str(ex)}
+
+    row = {"Identifier": identifier,
+           "Ohmic Resistance (Ohms x100)": results["ohmic_resistance"],
+           "Ionic Conductivity (mS/cm)": results["ionic_conductivity"],
+           "Fit Conductivity (mS/cm)": results["fit_conductivity"],
+           "Chi Square": results["chi_square"],
+        }
+
+    if results["fit"] is not None:
+        row["RMS Error"] = results["fit"]["rms_error"]
+        row.update(results["fit"]["parameters"])
+
+    return row
+
+def reprocess_archive(results_path: str, cell_constant: float, fit: bool = True, workers: int | None = None) -> pd.DataFrame:
+    # Re-analyse every stored AC spectrum in parallel, e.g. after recalibrating the cell constant.
+    # Spectra in the store under results_path/spectra, plus any older CSV files not in the store.
+    store_path = os.path.join(results_path, "spectra")
+    identifiers = []
+
+    if os.path.exists(os.path.join(store_path, "layout.json")):
+        identifiers = open_store(store_path).identifiers("AC")
+
+    paths = [path for path in sorted(glob.glob(os.path.join(results_path, "ID_*_AC.csv"))) if os.path.basename(path).removesuffix("_AC.csv") not in identifiers]
+
+    sources = [(store_path, identifier) for identifier in identifiers] + [(path, None) for path in paths]
+    logging.info(f"Reprocessing {len(sources)} AC datasets in {results_path} ({len(identifiers)} stored, {len(paths)} CSV) with a cell constant of {cell_constant}..")
+
+    if len(sources) == 0:
+        return pd.DataFrame(columns=["Identifier"])
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Several spectra per task, so process start up and pickling are small next to analysis time
+    chunksize = max(1, len(sources) // (4 * workers))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rows = list(executor.map(analyse_dataset, [source[0] for source in sources], repeat(cell_constant), repeat(fit), [source[1] for source in sources], chunksize=chunksize))
+
+    table = pd.DataFrame(rows)
+
+    if "Error" in table.columns:
+        failed = table["Error"].notna().sum()
+        if failed > 0:
+            logging.error(f"Failed to analyse {failed} datasets.")
+
+    return table
@@ -1,16 +1,20 @@
 import logging
 import random
 import sys
+import threading
 import time
+from collections import deque
 
 import serial
 
+from robot_controller import clock, command_futures, serial_transport, tracing
+
 logging.basicConfig(level = logging.INFO)
 
 # To communicate with: https://www.kern-sohn.com/shop/en/products/laboratory-balances/precision-balances/PCD-2500-2/
 
-class mass_reader:
-    def __init__(self, COM: str, sim: bool = False) -> None:
+class mass_reader(command_futures.queued_device):
+    def __init__(self, COM: str, sim: bool = False, stream: bool = False, continuous: bool = False) -> None:
         self.sim = sim
 
         # Mass balance checks
@@ -20,20 +24,39 @@ class mass_reader:
         self.correction = 0.05 #g or mL left behind in mixing chamber
 
         self.timeout = 2 #s 
+        self.retries = 5 # requests before giving up on a silent balance
+
+        # Stability criterion, readings must agree within tolerance for the whole window
+        self.stable_tolerance = 0.01 #g, one division of PCD 2500-2
+        self.stable_window = 1.0 #s
+        self.settle_timeout = 30 #s, maximum wait for a stable reading
+
+        # Streaming mode: background thread fills a ring buffer of (time, mass) readings
+        self.stream = False
+        self.continuous = continuous # balance configured (in its menu) for continuous output, otherwise readings are polled
+        self.poll_period = 0.1 #s
+        self.readings: deque[tuple[float, float]] = deque(maxlen=600)
+        self.new_reading = threading.Condition()
+        self.reader: threading.Thread | None = None
+
+        # Whilst streaming, tare is sent by the reader thread between readings
+        self.tare_requested = threading.Event()
+        self.tare_complete = threading.Event()
+        self.tared_at = 0.0 # s, readings stamped before this are discarded
 
         if self.sim is False:
             logging.info("Configuring mass balance serial port..")
-            self.ser = serial.Serial(COM) 
-            self.ser.baudrate = 9600
-            self.ser.bytesize = 8
-            self.ser.parity = 'N' # No parity
-            self.ser.stopbits = 1
+            self.ser = serial_transport.serial_transport(COM, baudrate=9600, timeout=self.timeout, name="mass balance")
 
             logging.info("Attempting to open mass balance serial port..")            
 
             if self.ser.isOpen() is False:
                 self.ser.open()
 
+            # Continuous output arrives unrequested, so has to be streamed
+            if stream is True or continuous is True:
+                self.start_stream()
+
             self.tare()
 
             if self.get_mass() == 0.0:
@@ -46,40 +69,169 @@ class mass_reader:
             logging.info("No serial connection to mass balance established.")
 
     def close_ser(self) -> None:
+        # Finish any queued commands before closing port
+        self.close_commands()
+        self.stop_stream()
+
         if self.sim is False:
             if self.ser.isOpen():
                 self.ser.close()
 
+    def parse_reading(self, line: str) -> float:
+        # e.g. '    12.34 g  ' or '-    0.05 g'
+        return float(line.rstrip().replace("g", "").replace(" ", ""))
+
+    def request_reading(self) -> float:
+        for _ in range(self.retries):
+            # Send char to trigger stable value to be sent
+            logging.info("Requesting mass balance reading..")
+            self.ser.write("s")
+
+            try:
+                return self.parse_reading(self.ser.read_line())
+            except serial.SerialTimeoutException:
+                logging.error("Mass balance request timed out.")
+
+        raise serial.SerialTimeoutException(f"Mass balance failed to respond after {self.retries} requests.")
+
+    def start_stream(self) -> None:
+        if self.sim is True or self.stream is True:
+            return
+        
+        self.ser.reset_input_buffer()
+        self.readings.clear()
+
+        self.stream = True
+        self.reader = threading.Thread(target=self.read_stream, name="mass_reader", daemon=True)
+        self.reader.start()
+
+        logging.info("Mass balance streaming started.")
+
+    def stop_stream(self) -> None:
+        if self.stream is False:
+            return
+        
+        self.stream = False
+
+        if self.reader is not None:
+            self.reader.join()
+            self.reader = None
+
+        logging.info("Mass balance streaming stopped.")
+
+    def read_stream(self) -> None:
+        # Background thread: sole reader of the serial port whilst streaming
+        while self.stream is True:
+            if self.tare_requested.is_set():
+                self.send_tare()
+
+            if self.continuous is False:
+                # Request unstable (immediate) reading, stability is judged here instead
+                self.ser.write("w")
+
+            try:
+                line = self.ser.read_line(timeout=self.timeout)
+            except serial.SerialTimeoutException:
+                continue
+
+            try:
+                mass = self.parse_reading(line)
+            except ValueError:
+                # Partial line or balance overload/underload message
+                continue
+
+            with self.new_reading:
+                self.readings.append((time.monotonic(), mass))
+                self.new_reading.notify_all()
+
+            if self.continuous is False:
+                time.sleep(self.poll_period)
+
+    def send_tare(self) -> None:
+        # Reader thread: no poll is awaiting a reply here, and continuous readings already received are dropped
+        self.ser.write("t")
+        self.ser.reset_input_buffer()
+
+        with self.new_reading:
+            self.readings.clear()
+            self.tared_at = time.monotonic()
+
+        self.tare_requested.clear()
+        self.tare_complete.set()
+
+    def is_stable(self, since: float) -> float | None:
+        # Returns median of window if every reading after since (and the last tare), spanning stable_window, is within tolerance
+        since = max(since, self.tared_at)
+        window = [(t, mass) for t, mass in self.readings if t >= since]
+
+        if len(window) < 3:
+            return None
+
+        latest = window[-1][0]
+        recent = [mass for t, mass in window if t >= latest - self.stable_window]
+
+        if latest - window[0][0] < self.stable_window:
+            return None
+
+        if max(recent) - min(recent) > self.stable_tolerance:
+            return None
+
+        recent.sort()
+        return recent[len(recent) // 2]
+
+    def get_stable_mass(self) -> float:
+        # Only use readings taken after the request, then return as soon as they settle
+        start = time.monotonic()
+        deadline = start + self.settle_timeout
+
+        with self.new_reading:
+            while time.monotonic() < deadline:
+                mass = self.is_stable(start)
+
+                if mass is not None:
+                    logging.info(f"Stable mass balance reading after {round(time.monotonic() - start, 2)}s.")
+                    return mass
+
+                self.new_reading.wait(timeout=deadline - time.monotonic())
+
+        raise serial.SerialTimeoutException(f"Mass balance failed to settle within {self.settle_timeout}s.")
+
+    @tracing.traced("mass balance")
     def get_mass(self) -> float:        
         if self.sim is False:
-            # Wait for balance to settle in case fluid is moving
-            time.sleep(5)
-            received = False
-
-            while received is False:
-                # Send char to trigger stable value to be sent
-                logging.info("Requesting mass balance reading..")
-                self.ser.write("s".encode())
-
-                start = time.time()
-                while (self.ser.in_waiting == 0) and (time.time() - start < self.timeout):
-                    time.sleep(0.2)
-
-                if self.ser.in_waiting > 0:
-                    received = True
-                else:
-                    logging.error("Mass balance request timed out.")
-
-            readout = self.ser.readline().decode().rstrip().replace("g", "").replace(" ", "")
-            
-            return float(readout)
+            if self.stream is True:
+                return self.get_stable_mass()
+
+            # Balance may report stable whilst fluid is still moving, so repeat until consecutive readings agree
+            deadline = time.monotonic() + self.settle_timeout
+            mass = self.request_reading()
+
+            while time.monotonic() < deadline:
+                previous, mass = mass, self.request_reading()
+
+                if abs(mass - previous) <= self.stable_tolerance:
+                    return mass
+
+            raise serial.SerialTimeoutException(f"Mass balance failed to settle within {self.settle_timeout}s.")
         else:
+            # Two consecutive readings
+            clock.simulate(2 * self.stable_window)
             return random.uniform(1, 50)
         
+    @tracing.traced("mass balance")
     def tare(self) -> None:
         # Send char to trigger tare
         if self.sim is False:
-            self.ser.write("t".encode())
+            if self.stream is False:
+                self.ser.write("t")
+                return
+
+            # Reader thread sends tare once its last poll is answered, so no pre-tare reading is accepted after
+            self.tare_complete.clear()
+            self.tare_requested.set()
+
+            if self.tare_complete.wait(timeout=self.settle_timeout) is False:
+                logging.error("Mass balance reader failed to send tare.")
 
     def check_mass_change(self, expected_mass: float, starting_mass: float) -> None:
         logging.info("Assessing mass balance changes..")
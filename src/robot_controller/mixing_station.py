@@ -2,12 +2,12 @@ import logging
 import math
 import os
 
-from robot_controller import gantry_controller, pipette_controller
+from robot_controller import gantry_controller, pipette_controller, state_journal, tracing
 
 logging.basicConfig(level = logging.INFO)
 
 class electrolyte_mixer:
-    def __init__(self, gantry_port: str, pipette_port: str, gantry_sim: bool = False, pipette_sim: bool = False, home: bool = False) -> None:
+    def __init__(self, gantry_port: str, pipette_port: str, gantry_sim: bool = False, pipette_sim: bool = False, home: bool = False, journal: state_journal.state_journal | None = None) -> None:
 
         self.gantry = gantry_controller.gantry(gantry_port, gantry_sim)            
         self.pipette = pipette_controller.pipette(pipette_port, pipette_sim)
@@ -36,8 +36,18 @@ class electrolyte_mixer:
         self.pipette_lead_in = 12 #mm to position pipette to the right of rack (in X direction) when returning pipette
         self.pipette_head_height = 26 #mm
 
-        # File to store last known active pipette for recovery
-        self.pipette_file = "data/variables/active_pipette.txt" # 1-9, 0 = not active        
+        # Journal to store last known active pipette for recovery (1-9, 0 = not active), shared with scheduler if provided
+        if journal is None:
+            journal = state_journal.state_journal("data/variables/state")
+
+        self.journal = journal
+
+        # Active pipette file used before journal, read once if journal has no record
+        self.pipette_file = "data/variables/active_pipette.txt"
+
+        if self.journal.get("pipette") is None and os.path.exists(self.pipette_file):
+            with open(self.pipette_file, 'r') as filehandler:
+                self.journal.record("pipette", int(filehandler.read()), sync=True)
         
         self.pot_base_height = -68 #mm (from CAD)
         self.pot_area = math.pi * 2.78**2 / 4 #cm2
@@ -49,32 +59,29 @@ class electrolyte_mixer:
         if home is True:
             self.gantry.softHome()
 
-        # Create variables folder if first time running code on PC
-        if not os.path.exists(os.path.dirname(self.pipette_file)):
-            os.mkdir(os.path.dirname(self.pipette_file))
-
     def correct_workspace_heights(self) -> None:
          self.pot_base_height += self.workspace_height_correction
          self.pipette_pick_height += self.workspace_height_correction
 
+    def get_pot_height(self, volume: float) -> float:
+        # Height of fluid surface (mm) for a given pot volume (mL)
+        return self.pot_base_height + 10 * volume / self.pot_area
+
+    @tracing.traced("mixer")
     def pick_pipette(self, pipette_no: int) -> None:
         # Turn pump off just in case
         self.pipette.pump_off(check=False)
 
         x, y = self.pipette_locations[pipette_no-1][0], self.pipette_locations[pipette_no-1][1]
 
-        # Move above pipette rack
-        logging.info(f"Moving to Pipette #{pipette_no}..")
-        self.gantry.move(x + self.pipette_lead_in, y, 0)
-        self.gantry.move(x, y, 0)
-
-        # Move into pipette rack
-        logging.info("Dropping to collect pipette..")
-        self.gantry.move(x, y, self.pipette_pick_height)
+        # Move above pipette rack, then drop into rack to collect pipette
+        logging.info(f"Moving to Pipette #{pipette_no} and dropping to collect..")
+        self.gantry.move_path([(x + self.pipette_lead_in, y, 0), 
+                               (x, y, 0), 
+                               (x, y, self.pipette_pick_height)])
 
         # Update active pipette variable 
-        with open(self.pipette_file, 'w+') as filehandler:
-                filehandler.write(f"{pipette_no}")
+        self.journal.record("pipette", pipette_no, sync=True)
 
         # Move up from pipette rack - home to remove any errors from collision
         logging.info(f"Raising Pipette #{pipette_no}..")
@@ -84,47 +91,40 @@ class electrolyte_mixer:
         logging.info("Moving away from pipette rack..")
         self.gantry.move(x + self.pipette_lead_in, y, 0)
 
+    @tracing.traced("mixer")
     def return_pipette(self) -> None:
         # Turn pump off just in case
         self.pipette.pump_off(check=False)
 
-        # Return active pipette
-        file_exists = os.path.exists(self.pipette_file)
-        active_pipette = 0 # assume no pipette active if file not exists
-
-        if file_exists:
-            with open(self.pipette_file, 'r') as filehandler:
-                active_pipette = int(filehandler.read())
+        # Return active pipette (assume no pipette active if never recorded)
+        active_pipette = self.journal.get("pipette", 0)
         
-        if active_pipette == 0 or not file_exists:
+        if active_pipette == 0:
             logging.error("Return pipette requested whilst no pipette is active.")
             return
 
         x, y = self.pipette_locations[active_pipette-1][0], self.pipette_locations[active_pipette-1][1]
 
-        # Move above pipette rack (first to lead in location to avoid clash)
-        logging.info(f"Moving to Pipette #{active_pipette}..")
-        self.gantry.move(x + self.pipette_lead_in, y, 0)
-        self.gantry.move(x, y, 0)
-
-        # Move into pipette rack
+        # Move above pipette rack (first to lead in location to avoid clash), then into rack
         logging.info(f"Delivering Pipette #{active_pipette} to rack..")
-        self.gantry.move(x, y, self.pipette_pick_height + 2)
+        self.gantry.move_path([(x + self.pipette_lead_in, y, 0), 
+                               (x, y, 0), 
+                               (x, y, self.pipette_pick_height + 2)])
 
         logging.info("Removing pipette from module..")
         self.gantry.remove_pipette()
 
+        # Check pipette is correctly inserted into rack, then move to lead in position just to be safe (if pipette failed to remove)
         logging.info("Checking pipette is correctly inserted into rack..")
-        self.gantry.move(x + self.pipette_lead_in / 2, y, 0)
-        self.gantry.move(x + self.pipette_lead_in / 2, y, self.pipette_pick_height + self.pipette_head_height)
-
-        # Move to lead in position just to be safe (if pipette failed to remove)
-        self.gantry.move(x + self.pipette_lead_in, y, 0)
+        self.gantry.move_path([(x + self.pipette_lead_in / 2, y, 0), 
+                               (x + self.pipette_lead_in / 2, y, self.pipette_pick_height + self.pipette_head_height), 
+                               (x + self.pipette_lead_in, y, 0)])
 
-        with open(self.pipette_file, 'w+') as filehandler:
-                filehandler.write("0")
+        self.journal.record("pipette", 0, sync=True)
 
-    def collect_volume(self, aspirate_volume: float, starting_volume: float, name: str, pot_no: int, aspirate_scalar: float, aspirate_speed: float) -> float:
+    @tracing.traced("mixer")
+    def collect_volume(self, aspirate_volume: float, starting_volume: float, name: str, pot_no: int, aspirate_scalar: float, aspirate_speed: float, lift: bool = True,
+                       z: float | None = None) -> float:
         new_volume = round(starting_volume - aspirate_volume * 1e-3, 4) #ml
 
         x, y = self.pot_locations[pot_no-1][0], self.pot_locations[pot_no-1][1]
@@ -137,8 +137,9 @@ class electrolyte_mixer:
         self.pipette.charge_pipette()
         logging.info("Pipette charged.")
 
-        # Drop into fluid (based on starting volume)
-        z = self.pot_base_height + 10 * new_volume / self.pot_area
+        # Drop into fluid (height after aspiration, unless precomputed in a dose plan)
+        if z is None:
+            z = self.get_pot_height(new_volume)
 
         logging.info(f"Dropping Pipette to {z}mm..")
         self.gantry.move(x, y, z)
@@ -149,20 +150,25 @@ class electrolyte_mixer:
         logging.info("Aspiration complete.")
         logging.info(f"{aspirate_volume}uL extracted, {new_volume}mL remaining..")
 
-        # Move out of fluid
-        logging.info("Lifting Pipette..")
-        self.gantry.move(x, y, 0)
+        # Move out of fluid (or leave lift to deliver_volume, to transfer in a single path)
+        if lift is True:
+            logging.info("Lifting Pipette..")
+            self.gantry.move(x, y, 0)
         
         return new_volume
     
-    def deliver_volume(self) -> None:
+    @tracing.traced("mixer")
+    def deliver_volume(self, pot_no: int = 0) -> None:
+        # pot_no > 0 => pipette still in pot after collect_volume(lift=False)
         x, y = self.chamber_location[0], self.chamber_location[1]
+        path = [(x, y, 0), (x, y, self.dispense_height)]
 
-        logging.info("Moving to Mixing Chamber..")
-        self.gantry.move(x, y, 0)
-        
-        logging.info(f"Dropping Pipette to {self.dispense_height}mm..")
-        self.gantry.move(x, y, self.dispense_height)
+        if pot_no > 0:
+            logging.info("Lifting Pipette..")
+            path.insert(0, (self.pot_locations[pot_no-1][0], self.pot_locations[pot_no-1][1], 0))
+
+        logging.info(f"Moving to Mixing Chamber and dropping Pipette to {self.dispense_height}mm..")
+        self.gantry.move_path(path)
 
         # Dispense pipette
         self.pipette.dispense()
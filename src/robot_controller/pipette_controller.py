@@ -1,14 +1,59 @@
 import logging
 import math
 import sys
-import time
+from collections import deque
 
 import numpy as np
 import serial
 
+from robot_controller import clock, command_futures, register_pipeline, serial_transport, tracing
+
 logging.basicConfig(level = logging.INFO)
 
-class pipette:
+class pressure_settle_detector:
+    def __init__(self, target: float, tolerance: float, window: float) -> None:
+        # Pressure is settled once every sample over the last window seconds is within tolerance of the target,
+        # the fitted trend would drift less than half the tolerance across the window and the noise about it
+        # is small
+        self.target = target
+        self.tolerance = tolerance # mbar
+        self.window = window # s
+
+        self.std_limit = tolerance / 3 # mbar
+
+        self.samples = deque() # (s, mbar)
+
+    def update(self, t: float, pressure: float) -> None:
+        self.samples.append((t, pressure))
+
+        while self.samples[0][0] < t - self.window:
+            self.samples.popleft()
+
+    def within_tolerance(self) -> bool:
+        return len(self.samples) > 0 and abs(self.target - self.samples[-1][1]) <= self.tolerance
+
+    def is_settled(self) -> bool:
+        if len(self.samples) < 4:
+            return False
+
+        times, pressures = np.array(self.samples).T
+
+        # Window only partly filled since first sample
+        if times[-1] - times[0] < 0.75 * self.window:
+            return False
+
+        if np.max(np.abs(pressures - self.target)) > self.tolerance:
+            return False
+
+        slope, intercept = np.polyfit(times, pressures, 1)
+        residuals = pressures - (slope * times + intercept)
+
+        return bool(abs(slope) * self.window < self.tolerance / 2 and residuals.std() <= self.std_limit)
+
+    def mean(self) -> float:
+        return float(np.mean([pressure for _, pressure in self.samples]))
+
+class pipette(command_futures.queued_device):
     def __init__(self, COM: str, sim: bool = False, maximum_power: float = 275, charge_pressure: float = 30, Kp: int = 1, Ki: int = 20, Kd: int = 0) -> None:
         self.sim = sim
 
@@ -25,14 +70,14 @@ class pipette:
 
         self.timeout = 5 # Maximum rise/fall time (s)
         self.time_resolution = 0.02 # s
+        self.settle_time = 2 # s, maximum wait for pressure to settle once reached
+        self.settle_window = 0.2 # s, pressure must be steady for this long to be settled
+        self.settle_times: deque[float] = deque(maxlen=1000) # s, from pressure reached to settled for recent checks
+        self.sim_settle_time = 0.3 # s, typical settle time (about 260ms against the emulated pump)
 
         if self.sim is False:
             logging.info("Configuring pipette serial port..")
-            self.ser = serial.Serial(COM) 
-            self.ser.baudrate = 115200 
-            self.ser.bytesize = 8 
-            self.ser.parity = 'N' # No parity
-            self.ser.stopbits = 1 
+            self.ser = serial_transport.serial_transport(COM, baudrate=115200, timeout=2, name="pipette")
 
             logging.info("Attempting to open pipette serial port..")
 
@@ -73,10 +118,7 @@ class pipette:
         logging.info(f"Disc pump gauge pressure is {self.gauge}mbar.")
 
     def get_data(self) -> str:
-        while self.ser.in_waiting == 0:
-            pass
-
-        return self.ser.readline().decode()
+        return self.ser.read_line()
     
     def get_aspiration_pressure(self, volume: float, scalar: float = 1.0) -> float:
         # Constant as function of volume (1/2.64 = 0.38mbar/ul)
@@ -94,7 +136,7 @@ class pipette:
         msg = f"#W{REGISTER_NUMBER},{VALUE}" + '\n'
      
         if self.sim is False:
-            self.ser.write(msg.encode('ascii'))
+            self.ser.write(msg)
 
             if (self.get_data() == msg):
                 return True
@@ -112,7 +154,7 @@ class pipette:
 
         msg = f"#R{REGISTER_NUMBER}" + '\n'
         if self.sim is False:
-            self.ser.write(msg.encode('ascii'))
+            self.ser.write(msg)
 
             data = self.get_data()
 
@@ -120,8 +162,45 @@ class pipette:
         else:
             return self.gauge
 
+    def register_batch(self, writes: list[tuple[int, float]] | None = None, reads: list[int] | None = None) -> register_pipeline.batch_result:
+        # Pipelined writes (in order) then reads, echoes and replies are matched once they arrive.
+        # A rejected write gets no response, so shows up as a failure without stalling the rest.
+        writes = [] if writes is None else writes
+        reads = [] if reads is None else reads
+        result = register_pipeline.batch_result()
+
+        if self.sim is True:
+            result.values = {**{register: value for register, value in writes}, **{register: self.gauge for register in reads}}
+            return result
+
+        commands = [(f"#W{register}", f"#W{register},{value}\n") for register, value in writes] + [(f"#R{register}", f"#R{register}\n") for register in reads]
+
+        def receive() -> tuple[str, str]:
+            line = self.get_data()
+            return line.split(",")[0], line
+
+        # Drive frequency read as sentinel, so a rejected final write does not wait for a timeout
+        replies = register_pipeline.pipeline(self.ser, commands, receive, sentinel=("#R6", "#R6\n"))
+
+        for (register, value), (_, msg), reply in zip(writes, commands, replies):
+            if reply == msg:
+                result.values[register] = value
+            else:
+                result.failures[register] = "write not acknowledged"
+
+        for register, reply in zip(reads, replies[len(writes):]):
+            try:
+                result.values[register] = float(reply.split(",")[1])
+            except (AttributeError, IndexError, ValueError):
+                result.failures[register] = "no reply to read" if reply is None else f"unreadable reply {reply.strip()}"
+
+        return result
+
     def close_ser(self) -> None:
         logging.info("Closing serial connection to pipette.")
+        # Finish any queued commands before closing port
+        self.close_commands()
+
         if self.sim is False:
             self.pump_off(check=False)
             if self.ser.isOpen():
@@ -133,10 +212,10 @@ class pipette:
         # R1 -> var = Maximum power (mW)
         # R2 -> 0 = Disable stream mode
 
-        if (self.register_write(0,0) is True) and (self.register_write(1,self.max_power) is True) and (self.register_write(2,0) is True):
-            return True
-        else:
-            return False
+        result = self.register_batch(writes=[(0,0), (1,self.max_power), (2,0)])
+        result.log_failures("pipette")
+
+        return result.succeeded()
         
     def configure_pid_settings(self) -> bool:
         # Configure PID Settings
@@ -145,10 +224,10 @@ class pipette:
         # R13 -> 5 = Input source (pressure sensor)
         # R33 -> 1 = Reset PID on pump enable
 
-        if (self.register_write(10,1) is True) and (self.register_write(12,0) is True) and (self.register_write(13,5) is True) and (self.register_write(33,1) is True):
-            return True
-        else:
-            return False
+        result = self.register_batch(writes=[(10,1), (12,0), (13,5), (33,1)])
+        result.log_failures("pipette")
+
+        return result.succeeded()
         
     def configure_pid_constants(self, Kp: float, Ki: float, Kd: float) -> bool:
         # Configure PID constants
@@ -157,10 +236,10 @@ class pipette:
             # R16 -> var = Integral limit (max power)
             # R17 -> var = Kd
 
-            if (self.register_write(14,Kp) is True) and (self.register_write(15,Ki) is True) and (self.register_write(16,self.max_power) is True) and (self.register_write(17,Kd) is True):
-                return True
-            else:
-                return False
+            result = self.register_batch(writes=[(14,Kp), (15,Ki), (16,self.max_power), (17,Kd)])
+            result.log_failures("pipette")
+
+            return result.succeeded()
     
     def get_pressure(self) -> float:
         return self.register_read(39)
@@ -192,15 +271,38 @@ class pipette:
         
         return power
 
+    def wait_until_settled(self, target: float, max_time: float) -> float | None:
+        # Sample pressure every time_resolution until settled about target, for at most max_time.
+        # Returns time taken, or None if not settled in time.
+        detector = pressure_settle_detector(target, self.pressure_error_criteria, self.settle_window)
+        start_time = clock.monotonic()
+
+        while True:
+            t = clock.monotonic() - start_time
+            pressure = self.get_pressure()
+            detector.update(t, pressure)
+
+            # Sampled every time_resolution, so at most once a second
+            logging.info(f"Pipette pressure settling at {pressure}mbar..", extra={"rate_limit": 1.0, "pressure": pressure})
+
+            if detector.is_settled() is True:
+                return t
+
+            if t > max_time:
+                return None
+
+            clock.sleep(self.time_resolution)
+
+    @tracing.traced("pipette")
     def check_pressure(self, target: float) -> None:
         if self.sim is False:
-            start_time = time.time()
+            start_time = clock.monotonic()
 
             pressure = self.get_pressure()
             error = target - pressure
             
             while (abs(error) > self.pressure_error_criteria):
-                new_time = time.time() - start_time
+                new_time = clock.monotonic() - start_time
                 if (new_time > self.timeout):
                     logging.error(f"Pipette failed to reach pressure of {target}mbar in {self.timeout}s.")
                     logging.info(f"Final Pipette pressure is {self.get_pressure()}mbar @ {self.get_power()}mW.")
@@ -208,20 +310,33 @@ class pipette:
                     #sys.exit()
                     break
 
-                time.sleep(10 * self.time_resolution) # pause to prevent excessive interrupts
+                clock.sleep(10 * self.time_resolution) # pause to prevent excessive interrupts
                 
                 pressure = self.get_pressure()
                 error = target - pressure
 
-            new_time = time.time() - start_time
-            logging.info(f"Pipette reached {pressure}mbar in less than {math.ceil(new_time*1000)}ms.")
+                # Polled until pressure reached, so at most once a second
+                logging.info(f"Pipette pressure is {pressure}/{target}mbar..", extra={"rate_limit": 1.0, "pressure": pressure})
 
-            # Delay to let system settle
-            time.sleep(2)
+            new_time = clock.monotonic() - start_time
+            logging.info(f"Pipette reached {pressure}mbar in less than {math.ceil(new_time*1000)}ms.", extra={"pressure": pressure, "rise_time": new_time})
+
+            # Wait for pressure to settle, rather than a fixed delay
+            settle_time = self.wait_until_settled(target, self.settle_time)
+
+            if settle_time is None:
+                settle_time = self.settle_time
+                logging.warning(f"Pipette pressure did not settle within {self.settle_time}s of reaching {target}mbar.")
+            else:
+                logging.info(f"Pipette pressure settled in {math.ceil(settle_time*1000)}ms.", extra={"settle_time": settle_time})
+
+            self.settle_times.append(settle_time)
+            tracing.annotate(pressure=pressure, rise_time=new_time, settle_time=settle_time)
 
             logging.info(f"Final Pump values: {self.get_pressure()}mbar @ {self.get_power()}mW.")
 
         else:
+            clock.simulate(self.sim_settle_time)
             logging.info(f"Pipette successfully reached {target}mbar.")
     
     def set_pressure(self, value: float, check: bool = False) -> None:
@@ -243,7 +358,8 @@ class pipette:
             value = 0
 
         if self.register_write(23, value) is True:
-            logging.info(f"Pipette target pressure set to {value}mbar.")
+            # Ramp set points are streamed by ramp_pressure instead, so this is not called often enough to throttle
+            logging.info(f"Pipette target pressure set to {value}mbar.", extra={"pressure": value})
         else:
             logging.error(f"Failed to set pipette target pressure to {value}mbar.")
             sys.exit()
@@ -251,16 +367,94 @@ class pipette:
         if check is True:
             self.check_pressure(value)
 
+    @tracing.traced("pipette")
+    def ramp_pressure(self, start: float, end: float, duration: float) -> bool:
+        # Linear set point ramp streamed to the pump: each write is sent at its own deadline from the start of the
+        # ramp without waiting for its echo, so serial round trips don't stretch or distort the ramp. Echoes are
+        # matched as they arrive and after the last write. Returns False if any set point was not echoed.
+        N = math.ceil(duration / (2.3 * self.time_resolution)) + 2 # Nyquist * smallest time step of SPM (no point changing pressure at any higher frequency)
+        dT = duration / (N-1)
+
+        if end > self.max_pressure:
+            logging.error(f"Requested pressure of {end}mbar exceeds maximum.")
+            logging.info(f"Ramp reduced to maximum of {self.max_pressure}mbar.")
+
+        path = np.round(np.clip(np.linspace(start, end, N), 0, self.max_pressure), 2)
+
+        if self.sim is True:
+            clock.sleep(duration)
+            return True
+
+        messages = [f"#W23,{set_point}\n" for set_point in path]
+        pending = list(messages)
+        missing = 0
+        max_lag = 0.0
+
+        def match(lines: list[str]) -> int:
+            # Echoes arrive in order, set points before a matched echo were never acknowledged
+            failed = 0
+
+            for line in lines:
+                if line in pending:
+                    index = pending.index(line)
+                    failed += index
+                    del pending[:index + 1]
+                else:
+                    logging.error(f"Unexpected response from pipette during pressure ramp: {line.strip()}")
+
+            return failed
+
+        start_time = clock.monotonic()
+
+        for i, msg in enumerate(messages):
+            deadline = start_time + i * dT
+            clock.sleep(max(deadline - clock.monotonic(), 0))
+
+            max_lag = max(max_lag, clock.monotonic() - deadline)
+            self.ser.write(msg)
+
+            missing += match(self.ser.read_available())
+
+        # Collect remaining echoes
+        while len(pending) > 0:
+            try:
+                missing += match([self.ser.read_line(timeout=self.timeout)])
+            except serial.SerialTimeoutException:
+                missing += len(pending)
+                pending.clear()
+
+        logging.info(f"Pressure ramp of {N} set points from {path[0]}mbar to {path[-1]}mbar streamed in {round(clock.monotonic() - start_time, 3)}s (latest write {math.ceil(max_lag*1000)}ms after deadline).")
+        tracing.annotate(set_points=N, max_lag=max_lag, missing=missing)
+
+        if missing > 0:
+            logging.error(f"{missing} of {N} ramp set points were not acknowledged by pipette.")
+            return False
+
+        return True
+
+    @tracing.traced("pipette")
     def charge_pipette(self, check: bool = True) -> None:        
         self.pump_on()
         self.set_pressure(self.charge_pressure, check=check)
 
+    @tracing.traced("pipette")
     def blow_out_pipette(self) -> None:
+        # Charge then vent, each for at most 0.5s but only until the pressure settles
         self.charge_pipette(check=False)
-        time.sleep(0.5)
+
+        if self.sim is False:
+            self.wait_until_settled(self.charge_pressure, 0.5)
+        else:
+            clock.sleep(self.sim_settle_time)
+
         self.pump_off()
-        time.sleep(0.5)
 
+        if self.sim is False:
+            self.wait_until_settled(0, 0.5)
+        else:
+            clock.sleep(self.sim_settle_time)
+
+    @tracing.traced("pipette")
     def aspirate(self, aspirate_volume: float, aspirate_scalar: float, aspirate_speed: float = 100.0, check: bool = True) -> None:
         if aspirate_volume > self.max_dose:
             logging.error(f"Requested dose of {aspirate_volume}uL exceeds maximum.")
@@ -282,15 +476,12 @@ class pipette:
             rise_time = aspirate_volume / aspirate_speed # Seconds
 
             logging.info(f"Rising to aspiration pressure of {aspirate_pressure}mbar in {rise_time}s, from charged pressure of {self.charge_pressure}mbar.")
-            N = math.ceil(rise_time / (2.3 * self.time_resolution)) + 2 # Nyquist * smallest time step of SPM (no point changing pressure at any higher frequency)
-            dT = rise_time / (N-1)
+            N = math.ceil(rise_time / (2.3 * self.time_resolution)) + 2
 
             if N > 2:
-                path = np.linspace(self.charge_pressure, aspirate_pressure, N)
-
-                for set_point in path:
-                    self.set_pressure(set_point)
-                    time.sleep(dT)
+                if self.ramp_pressure(self.charge_pressure, aspirate_pressure, rise_time) is False:
+                    # Make sure final set point is applied (exits if pipette doesn't respond)
+                    self.set_pressure(aspirate_pressure)
 
                 if check is True:
                     self.check_pressure(aspirate_pressure) # Only check final reading
@@ -302,6 +493,7 @@ class pipette:
             # Jump straight to aspirate pressure if no speed given
             self.set_pressure(aspirate_pressure, check)
     
+    @tracing.traced("pipette")
     def dispense(self, check: bool = True) -> None:
         self.pump_off(check)
         self.blow_out_pipette()
\ No newline at end of file
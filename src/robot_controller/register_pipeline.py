@@ -0,0 +1,63 @@
+import logging
+from typing import Callable
+
+import serial
+
+from robot_controller import serial_transport
+
+logging.basicConfig(level = logging.INFO)
+
+class batch_result:
+    def __init__(self) -> None:
+        # Outcome of a batch of register transactions, register -> value confirmed written or read back,
+        # and register -> reason for anything that failed
+        self.values: dict[int, float] = {}
+        self.failures: dict[int, str] = {}
+
+    def succeeded(self) -> bool:
+        return len(self.failures) == 0
+
+    def log_failures(self, name: str) -> None:
+        for register, reason in self.failures.items():
+            logging.error(f"Register R{register} of {name}: {reason}.")
+
+def pipeline(ser: serial_transport.serial_transport, commands: list[tuple[str, str]], receive: Callable[[], tuple[str, str]], depth: int = 8,
+             sentinel: tuple[str, str] | None = None) -> list[str | None]:
+    # Send (key, message) commands with up to depth awaiting a reply, rather than one round trip each.
+    # receive() returns the key and payload of the next reply. Replies come back in order, so any command
+    # ahead of a matched reply got no reply (e.g. a rejected write). Returns the payload for each command,
+    # None if no reply was received. A sentinel (a cheap read that is always answered) is sent after the last
+    # command, so a missing reply to that command is settled by the sentinel's reply instead of a timeout.
+    if sentinel is not None and len(commands) > 0:
+        return pipeline(ser, [*commands, sentinel], receive, depth)[:-1]
+
+    replies: list[str | None] = [None] * len(commands)
+    outstanding: list[int] = []
+    sent = 0
+
+    while sent < len(commands) or len(outstanding) > 0:
+        # Top up pipeline in a single write
+        if sent < len(commands) and len(outstanding) < depth:
+            burst = range(sent, min(sent + depth - len(outstanding), len(commands)))
+            ser.write("".join(commands[i][1] for i in burst))
+
+            outstanding.extend(burst)
+            sent = burst[-1] + 1
+
+        try:
+            key, payload = receive()
+        except serial.SerialTimeoutException:
+            # Device went quiet, nothing outstanding will be answered
+            outstanding = []
+            continue
+
+        position = next((k for k, i in enumerate(outstanding) if commands[i][0] == key), None)
+
+        if position is None:
+            logging.error(f"Unexpected reply from {ser.name}: {key}")
+            continue
+
+        replies[outstanding[position]] = payload
+        del outstanding[:position + 1]
+
+    return replies
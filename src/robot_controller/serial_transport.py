@@ -0,0 +1,93 @@
+import logging
+import time
+
+import serial
+
+logging.basicConfig(level = logging.INFO)
+
+class serial_transport:
+    def __init__(self, COM: str, baudrate: int, timeout: float = 5.0, name: str = "device", encoding: str = "ascii") -> None:
+        # Shared serial layer for all hardware controllers. Reads block in the OS (no busy waiting)
+        # until a full line is framed or the deadline passes, in which case an error is raised.
+        self.name = name
+        self.timeout = timeout # s, default deadline for a reply
+        self.encoding = encoding
+
+        # Bytes read ahead of the last framed line
+        self.buffer = bytearray()
+
+        self.ser = serial.Serial(COM)
+        self.ser.baudrate = baudrate
+        self.ser.bytesize = 8
+        self.ser.parity = 'N' # No parity
+        self.ser.stopbits = 1
+        self.ser.timeout = timeout
+
+    def isOpen(self) -> bool:
+        return self.ser.isOpen()
+
+    def open(self) -> None:
+        self.buffer.clear()
+        self.ser.open()
+
+    def close(self) -> None:
+        self.ser.close()
+
+    @property
+    def in_waiting(self) -> int:
+        # Bytes available without blocking (read ahead and still in OS buffer)
+        return len(self.buffer) + self.ser.in_waiting
+
+    def reset_input_buffer(self) -> None:
+        self.buffer.clear()
+        self.ser.reset_input_buffer()
+
+    def write(self, msg: str) -> None:
+        self.ser.write(msg.encode(self.encoding))
+
+    def fill_buffer(self, timeout: float) -> bool:
+        # Block until at least one byte arrives, then take everything else that is already waiting
+        self.ser.timeout = max(timeout, 0)
+        chunk = self.ser.read(max(1, self.ser.in_waiting))
+        self.buffer += chunk
+
+        return len(chunk) > 0
+
+    def read_available(self, eol: bytes = b"\n") -> list[str]:
+        # Complete lines that have already arrived, without blocking. A partial line is kept for the next read.
+        waiting = self.ser.in_waiting
+        if waiting > 0:
+            self.buffer += self.ser.read(waiting)
+
+        lines = []
+        index = self.buffer.find(eol)
+
+        while index >= 0:
+            lines.append(bytes(self.buffer[:index + len(eol)]).decode(self.encoding, errors="replace"))
+            del self.buffer[:index + len(eol)]
+            index = self.buffer.find(eol)
+
+        return lines
+
+    def read_line(self, timeout: float | None = None, eol: bytes = b"\n") -> str:
+        # Return the next complete line (including terminator), raising if the device goes quiet
+        if timeout is None:
+            timeout = self.timeout
+
+        deadline = time.monotonic() + timeout
+
+        while True:
+            index = self.buffer.find(eol)
+
+            if index >= 0:
+                line = bytes(self.buffer[:index + len(eol)])
+                del self.buffer[:index + len(eol)]
+
+                return line.decode(self.encoding, errors="replace")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logging.error(f"No response from {self.name} within {timeout}s.")
+                raise serial.SerialTimeoutException(f"No response from {self.name} within {timeout}s.")
+
+            self.fill_buffer(remaining)
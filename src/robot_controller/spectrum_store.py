@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+from csv import DictWriter
+
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(level = logging.INFO)
+
+class spectrum_store:
+    def __init__(self, path: str, columns: dict[str, list[str]] | None = None) -> None:
+        # Append-only columnar store for Squidstat data, one binary file of float64 rows per kind (AC, DC)
+        # plus an index of experiment ID -> row range. Reads are memory mapped, so no text is parsed.
+        self.path = path
+        self.layout_file = os.path.join(path, "layout.json")
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        # Column names per kind, fixed when the store is created
+        if os.path.exists(self.layout_file):
+            with open(self.layout_file) as file:
+                self.columns = json.load(file)
+        else:
+            self.columns = {}
+
+        if columns is not None:
+            for kind, names in columns.items():
+                if kind in self.columns and self.columns[kind] != names:
+                    logging.error(f"{kind} columns do not match those already in spectrum store {path}.")
+                    raise ValueError(f"{kind} columns do not match spectrum store layout.")
+
+                self.columns[kind] = names
+
+            with open(self.layout_file, 'w') as file:
+                json.dump(self.columns, file, indent=4)
+
+        self.refresh()
+
+    def get_data_path(self, kind: str) -> str:
+        return os.path.join(self.path, kind + ".f64")
+
+    def get_index_path(self, kind: str) -> str:
+        return os.path.join(self.path, kind + "_index.csv")
+
+    def refresh(self) -> None:
+        # Re-read indexes, e.g. after another process has appended. Later entries replace earlier ones.
+        self.index = {}
+
+        for kind in self.columns:
+            self.index[kind] = {}
+            index_path = self.get_index_path(kind)
+
+            if os.path.exists(index_path):
+                for row in pd.read_csv(index_path, dtype={"Identifier": str}).itertuples(index=False):
+                    self.index[kind][row.Identifier] = (int(row.Start), int(row.Rows))
+
+    def identifiers(self, kind: str) -> list[str]:
+        return list(self.index.get(kind, {}).keys())
+
+    def contains(self, kind: str, identifier: str) -> bool:
+        return identifier in self.index.get(kind, {})
+
+    def append(self, kind: str, identifier: str, data: np.ndarray) -> None:
+        # data has one row per sample and one column per name in layout
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        width = len(self.columns[kind])
+
+        if data.ndim != 2 or data.shape[1] != width:
+            logging.error(f"Expected {width} columns of {kind} data, received array of shape {data.shape}.")
+            raise ValueError(f"Expected {width} columns of {kind} data.")
+
+        data_path = self.get_data_path(kind)
+        row_bytes = 8 * width
+
+        with open(data_path, 'ab') as file:
+            # Drop any partial row left by an interrupted write, so rows stay aligned
+            size = file.tell()
+            if size % row_bytes != 0:
+                file.truncate(size - size % row_bytes)
+                file.seek(0, os.SEEK_END)
+
+            start = file.tell() // row_bytes
+            file.write(data.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+        # Index written last, so an interrupted append is never visible
+        index_path = self.get_index_path(kind)
+        new_index = not os.path.exists(index_path)
+
+        with open(index_path, 'a', newline='') as file:
+            writer = DictWriter(file, fieldnames=["Identifier", "Start", "Rows"])
+
+            if new_index is True:
+                writer.writeheader()
+
+            writer.writerow({"Identifier": identifier, "Start": start, "Rows": len(data)})
+
+        self.index[kind][identifier] = (start, len(data))
+
+    def load_array(self, kind: str, identifier: str) -> np.ndarray:
+        # Read only view into the memory mapped file (no copy)
+        if not self.contains(kind, identifier):
+            logging.error(f"No {kind} data stored for {identifier}.")
+            raise KeyError(identifier)
+
+        start, rows = self.index[kind][identifier]
+        width = len(self.columns[kind])
+
+        data = np.memmap(self.get_data_path(kind), dtype=np.float64, mode='r', offset=8 * width * start, shape=(rows, width))
+        return data
+
+    def load_columns(self, kind: str, identifier: str, columns: list[str]) -> list[np.ndarray]:
+        data = self.load_array(kind, identifier)
+        return [data[:, self.columns[kind].index(name)] for name in columns]
+
+    def load(self, kind: str, identifier: str) -> pd.DataFrame:
+        return pd.DataFrame(np.array(self.load_array(kind, identifier)), columns=self.columns[kind])
+
+    def export_csv(self, kind: str, identifier: str, path: str) -> None:
+        # Same layout as CSV files written before the store was introduced
+        self.load(kind, identifier).to_csv(path)
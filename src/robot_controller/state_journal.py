@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any
+
+logging.basicConfig(level = logging.INFO)
+
+# Journal values are anything JSON serialisable (numbers, strings, lists, dicts), None removes a key
+journal_value = Any
+
+class state_journal:
+    def __init__(self, path: str = "data/variables/state", sync_every: int = 8, sync_interval: float = 2.0) -> None:
+        # Write-ahead journal of station state as key -> value pairs (e.g. "pipette" -> 3, "volume/2" -> 24.85).
+        # Each change is one appended JSON line, flushed immediately but fsynced in batches. A checkpoint writes
+        # the full state atomically (temporary file then rename) and starts a new journal. Values are absolute,
+        # so replaying a record twice is harmless.
+        self.journal_file = path + "_journal.jsonl"
+        self.checkpoint_file = path + "_checkpoint.json"
+
+        self.sync_every = sync_every # records
+        self.sync_interval = sync_interval # s
+
+        self.lock = threading.RLock()
+
+        folder = os.path.dirname(path)
+        if folder != "" and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.state: dict[str, journal_value] = {}
+        self.seq = 0
+        self.replay()
+
+        self.file = open(self.journal_file, 'a')
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def replay(self) -> None:
+        # Rebuild state from last checkpoint plus any later journal records
+        checkpoint_seq = 0
+
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file) as file:
+                checkpoint = json.load(file)
+
+            self.state = checkpoint["state"]
+            checkpoint_seq = self.seq = checkpoint["seq"]
+
+        replayed = 0
+
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'rb+') as file:
+                valid = 0 # bytes of complete records
+
+                for line in file:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise json.JSONDecodeError("Missing end of record", line.decode(errors="replace"), len(line))
+
+                        record = json.loads(line)
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        # Torn final record from a crash mid-write, removed so new records follow the last good one
+                        logging.error("Discarding incomplete record at end of state journal.")
+                        file.truncate(valid)
+                        break
+
+                    valid += len(line)
+
+                    # Records may predate checkpoint if interrupted before journal was reset
+                    if record["seq"] > checkpoint_seq:
+                        self.apply(record["key"], record["value"])
+                        self.seq = record["seq"]
+                        replayed += 1
+
+        if replayed > 0:
+            logging.info(f"Replayed {replayed} state journal records.")
+
+    def apply(self, key: str, value: journal_value) -> None:
+        # None removes key
+        if value is None:
+            self.state.pop(key, None)
+        else:
+            self.state[key] = value
+
+    def get(self, key: str, default: journal_value = None) -> journal_value:
+        return self.state.get(key, default)
+
+    def items(self, prefix: str) -> dict:
+        # e.g. items("volume/") -> {"0": 24.85, "3": 12.0}
+        return {key[len(prefix):]: value for key, value in self.state.items() if key.startswith(prefix)}
+
+    def record(self, key: str, value: journal_value, sync: bool = False) -> None:
+        # Use sync for changes that must survive power loss (e.g. pipette attached), others are batched. None removes key.
+        with self.lock:
+            if self.state.get(key, None) == value:
+                return
+
+            self.seq += 1
+            self.apply(key, value)
+
+            self.file.write(json.dumps({"seq": self.seq, "key": key, "value": value}, separators=(",", ":")) + "\n")
+            self.file.flush()
+            self.unsynced += 1
+
+            if sync is True or self.unsynced >= self.sync_every or time.monotonic() - self.last_sync > self.sync_interval:
+                self.sync()
+
+    def sync(self) -> None:
+        with self.lock:
+            if self.unsynced > 0:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+            self.last_sync = time.monotonic()
+
+    def remove(self, prefix: str) -> None:
+        # Drop keys, e.g. progress through a finished recipe
+        with self.lock:
+            for key in [key for key in self.state if key.startswith(prefix)]:
+                self.record(key, None)
+
+    def checkpoint(self) -> None:
+        # Compact journal into a single state file, replaced atomically
+        with self.lock:
+            self.sync()
+
+            temporary = self.checkpoint_file + ".tmp"
+            with open(temporary, 'w') as file:
+                json.dump({"seq": self.seq, "state": self.state}, file)
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.replace(temporary, self.checkpoint_file)
+
+            # Start new journal, records up to seq are now in checkpoint
+            self.file.close()
+            self.file = open(self.journal_file, 'w')
+
+    def close(self) -> None:
+        with self.lock:
+            self.sync()
+            self.file.close()
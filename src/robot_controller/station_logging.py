@@ -0,0 +1,137 @@
+import atexit
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import threading
+from datetime import datetime
+
+from robot_controller import clock
+
+# Attributes of every LogRecord, anything else on a record was passed with extra={...}
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+# Extras used to throttle a call site, not written out
+THROTTLE_ATTRIBUTES = {"rate_limit", "sample"}
+
+class json_formatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        # One JSON object per line, with any extra={...} fields alongside the message
+        entry = {"time": datetime.fromtimestamp(record.created).isoformat(sep=" ", timespec="milliseconds"),
+                 "level": record.levelname,
+                 "module": record.module,
+                 "function": record.funcName,
+                 "thread": record.threadName,
+                 "message": record.getMessage(),
+            }
+
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES and name not in THROTTLE_ATTRIBUTES and name not in entry:
+                entry[name] = value
+
+        return json.dumps(entry, default=str)
+
+class compressed_rotating_handler(logging.handlers.RotatingFileHandler):
+    def __init__(self, filename: str, max_bytes: int = 10_000_000, backups: int = 20) -> None:
+        # Rotated files are gzipped (e.g. mixing_station.log.1.gz), by the listener thread
+        super().__init__(filename, mode="a", maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+        self.namer = self.compressed_name
+        self.rotator = self.compress
+
+    def compressed_name(self, name: str) -> str:
+        return name + ".gz"
+
+    def compress(self, source: str, dest: str) -> None:
+        with open(source, 'rb') as file, gzip.open(dest, 'wb') as compressed:
+            shutil.copyfileobj(file, compressed)
+
+        os.remove(source)
+
+class throttle_filter(logging.Filter):
+    def __init__(self) -> None:
+        # Throttles call sites that log with extra={"rate_limit": seconds} (at most one record per interval of
+        # station time) or extra={"sample": n} (every nth record). The next record let through reports how many
+        # were dropped. Records without either are always passed.
+        super().__init__()
+        self.sites = {} # (path, line) -> [time of last record, calls, suppressed since last record]
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate_limit = getattr(record, "rate_limit", None)
+        sample = getattr(record, "sample", None)
+
+        if rate_limit is None and sample is None:
+            return True
+
+        now = clock.monotonic()
+
+        with self.lock:
+            site = self.sites.setdefault((record.pathname, record.lineno), [None, 0, 0])
+            site[1] += 1
+
+            if rate_limit is not None and site[0] is not None and now - site[0] < rate_limit:
+                site[2] += 1
+                return False
+
+            if sample is not None and (site[1] - 1) % sample != 0:
+                site[2] += 1
+                return False
+
+            suppressed = site[2]
+            site[0] = now
+            site[2] = 0
+
+        if suppressed > 0:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+            record.suppressed = suppressed
+
+        return True
+
+# Listener thread writing queued records, None until configure() is called
+listener = None
+
+def configure(path: str = "mixing_station.log", level: int = logging.INFO, max_bytes: int = 10_000_000, backups: int = 20) -> logging.handlers.QueueListener:
+    # Controllers only format the message and put the record on a queue, a listener thread writes JSON lines to
+    # a rotating compressed file and plain text to stdout. Replaces any handlers already on the root logger.
+    global listener
+
+    stop()
+
+    records = queue.SimpleQueue()
+
+    file_handler = compressed_rotating_handler(path, max_bytes, backups)
+    file_handler.setFormatter(json_formatter())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+
+    # Message (with any traceback) is formatted before queueing, everything else by the listener
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    queue_handler.addFilter(throttle_filter())
+
+    logging.basicConfig(level=level, force=True, handlers=[queue_handler])
+
+    listener = logging.handlers.QueueListener(records, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+
+    return listener
+
+def stop() -> None:
+    # Flush queued records, called at exit (including sys.exit after a fatal error)
+    global listener
+
+    if listener is not None:
+        listener.stop()
+
+        for handler in listener.handlers:
+            handler.close()
+
+        listener = None
+
+atexit.register(stop)
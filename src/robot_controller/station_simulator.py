@@ -0,0 +1,377 @@
+import heapq
+import logging
+import os
+import random
+import tempfile
+from typing import Callable, Generator
+
+import pandas as pd
+
+from robot_controller import clock, dose_planner, fluid_controller, mass_balance, mixing_station, state_journal, temperature_controller, temperature_sequencer, timing_model
+
+logging.basicConfig(level = logging.INFO)
+
+def random_suggestion(config: dict) -> dict:
+    # Uniform over each parameter range (on its stride), scaled to meet any linear equality constraint
+    values = {}
+
+    for parameter in config["parameters"]:
+        value = random.uniform(parameter["low_value"], parameter["high_value"])
+
+        if "stride" in parameter:
+            value = parameter["low_value"] + parameter["stride"] * round((value - parameter["low_value"]) / parameter["stride"])
+
+        values[parameter["name"]] = float(value)
+
+    for constraint in config.get("constraints", []):
+        if constraint["type"] == "linear_eq":
+            total = sum(definition["weight"] * values[definition["parameter"]] for definition in constraint["definitions"])
+
+            if total > 0:
+                for definition in constraint["definitions"]:
+                    values[definition["parameter"]] = round(values[definition["parameter"]] * constraint["targets"][0] / total, 1)
+
+    return values
+
+def extract_temperature(values: dict) -> float | None:
+    for name in values:
+        # Loop through all and check if Temperature
+        if name == "Temperature":
+            new_value = float(values[name])
+            logging.info(f"New temperature found in received suggestions: {new_value}C.")
+            return new_value
+
+    return None
+
+def campaign_suggestions(config: dict, count: int, temp: float = 25) -> list[tuple[dict, float]]:
+    # (values, temperature) for each experiment, temperature from suggestion if a campaign parameter
+    suggestions = []
+
+    for _ in range(count):
+        values = random_suggestion(config)
+        target_temp = extract_temperature(values)
+
+        suggestions.append((values, temp if target_temp is None else target_temp))
+
+    return suggestions
+
+class signal:
+    def __init__(self) -> None:
+        # One-off event that simulated processes can wait for (e.g. mixture prepared)
+        self.fired = False
+        self.waiting: list[Generator] = []
+
+class station_simulator:
+    def __init__(self, model: timing_model.timing_model | None = None, recipe_file: str = "data/recipes/campaign_start.csv") -> None:
+        # Discrete-event simulation of a campaign. The mixer side (gantry and pipette) and the test cell side (fluid handler,
+        # mass balance, Peltier and Squidstat) are resources used by processes, written as generators that yield either a
+        # delay in seconds or a signal to wait for. Operation durations come from the fitted timing model where available,
+        # otherwise from the simulated controllers (dose plans are compiled and executed against a virtual clock).
+        self.model = timing_model.timing_model() if model is None else model
+        self.clock = clock.virtual_clock()
+
+        # Station settings, as used by scheduler and tools
+        self.cell_volume = 2500 # ul, test cell (see test_cell)
+        self.cleaning_temp = 40 # C
+        self.wait_time = 10 # s, cleaning solution contact and hold at cleaning temperature
+        self.suggestion_time = 30 # s, from sending measurements to receiving the next batch
+        self.measure_time = 80 # s, if not fitted (default EIS sweep)
+        self.start_temp = 25 # C
+
+        # Simulated controllers, with their own journal so the station's saved state is untouched
+        self.folder = tempfile.TemporaryDirectory(prefix="station_simulator_")
+        previous = clock.set_clock(self.clock)
+
+        try:
+            self.journal = state_journal.state_journal(os.path.join(self.folder.name, "state"))
+
+            self.mixer = mixing_station.electrolyte_mixer("", "", gantry_sim=True, pipette_sim=True, journal=self.journal)
+            self.planner = dose_planner.dose_planner(self.mixer, self.mixer.pipette.max_dose)
+            self.fluid_handler = fluid_controller.fluid_handler("", sim=True)
+            self.mass_balance = mass_balance.mass_reader("", sim=True)
+            self.peltier = temperature_controller.peltier("", sim=True)
+        finally:
+            clock.set_clock(previous)
+
+        self.sequencer = temperature_sequencer.temperature_sequencer(self.peltier)
+
+        if self.model.heating_rate is not None:
+            self.peltier.heating_rate = self.model.heating_rate
+
+        if self.model.cooling_rate is not None:
+            self.peltier.cooling_rate = self.model.cooling_rate
+
+        self.hold_time = self.peltier.steady_state if self.model.hold_time is None else self.model.hold_time
+
+        columns = ['#', 'Name', 'Dose Volume (uL)', 'Container Volume (mL)', 'Density (g/mL)', 'Aspirate Scalar', 'Aspirate Speed (uL/s)', 'Cost (/uL)']
+        self.df = pd.read_csv(recipe_file, header=0, names=columns, index_col=False)
+
+        # Simulation state, reset by run()
+        self.now = 0.0 # s
+        self.events: list[tuple[float, int, Generator]] = [] # (time, sequence, process) heap
+        self.sequence = 0
+        self.busy = {"mixer": 0.0, "cell": 0.0, "optimiser": 0.0} # s
+        self.phases: dict[str, list[float]] = {} # phase -> durations (s)
+        self.completed = 0
+        self.cleaned: signal | None = None
+
+        self.temp_start: float = self.start_temp # C
+        self.temp_target: float = self.start_temp # C
+        self.temp_time = 0.0 # s
+
+    def close(self) -> None:
+        # Remove simulated journal
+        self.journal.close()
+        self.folder.cleanup()
+
+    # Operation durations
+
+    def timed(self, operation: Callable, *args: object, **kwargs: object) -> float:
+        # Virtual time taken by a simulated controller call
+        previous = clock.set_clock(self.clock)
+
+        try:
+            start = self.clock.elapsed
+            operation(*args, **kwargs)
+
+            return self.clock.elapsed - start
+        finally:
+            clock.set_clock(previous)
+
+    def execute_plan(self, plan: dict) -> None:
+        # As scheduler.execute_plan, without volume tracking
+        for step in plan["steps"]:
+            if step["op"] == "pick_pipette":
+                self.mixer.pick_pipette(step["pipette"])
+            elif step["op"] == "collect":
+                self.mixer.collect_volume(step["volume"], step["starting_volume"], step["name"], step["pot"], step["scalar"], step["speed"], lift=False, z=step.get("z"))
+            elif step["op"] == "deliver":
+                self.mixer.deliver_volume(step["pot"])
+            elif step["op"] == "return_pipette":
+                self.mixer.return_pipette()
+            elif step["op"] == "mix":
+                self.mixer.gantry.mix()
+
+    def prepare_time(self, values: dict) -> tuple[float, float]:
+        # Returns duration and electrolyte volume (ul)
+        self.df["Dose Volume (uL)"] = [float(values.get(name, 0)) for name in self.df["Name"]]
+        plan = self.planner.compile(self.df)
+
+        doses = sum(step["op"] == "collect" for step in plan["steps"])
+        duration = self.model.prepare_time(plan["travel_time"], doses)
+
+        if duration is None:
+            duration = self.timed(self.execute_plan, plan)
+
+        return duration, plan["electrolyte_volume"]
+
+    def pump_time(self, kind: str, volume: float) -> float:
+        duration = self.model.pump_time(kind, volume)
+
+        if duration is None:
+            if kind == "add":
+                duration = self.timed(self.fluid_handler.add_electrolyte, volume)
+            else:
+                duration = self.timed(self.fluid_handler.empty_cell, volume)
+
+        return duration
+
+    def mass_time(self) -> float:
+        if self.model.mass_time is not None:
+            return self.model.mass_time
+
+        return self.timed(self.mass_balance.get_mass)
+
+    def clean_time(self) -> float:
+        # Cleaning and rinsing pumps, heating is simulated separately
+        if self.model.clean_time is not None:
+            return self.model.clean_time
+
+        return self.timed(self.fluid_handler.clean_cell, self.cell_volume, self.wait_time) + self.timed(self.fluid_handler.rinse_cell, self.cell_volume)
+
+    # Test cell temperature, ramps linearly between set points
+
+    def temperature(self) -> float:
+        duration = self.peltier.ramp_time(self.temp_start, self.temp_target)
+
+        if duration <= 0:
+            return self.temp_target
+
+        progress = min((self.now - self.temp_time) / duration, 1.0)
+        return self.temp_start + progress * (self.temp_target - self.temp_start)
+
+    def set_temperature(self, target: float) -> None:
+        if target != self.temp_target:
+            self.temp_start = self.temperature()
+            self.temp_time = self.now
+            self.temp_target = target
+
+    def temperature_wait(self, target: float, hold: float) -> float:
+        # As peltier.wait_until_temperature: finish ramp, then hold within error
+        self.set_temperature(target)
+        remaining = self.temp_time + self.peltier.ramp_time(self.temp_start, self.temp_target) - self.now
+
+        return max(remaining, 0) + hold
+
+    # Event loop
+
+    def schedule(self, delay: float, process: Generator) -> None:
+        heapq.heappush(self.events, (self.now + delay, self.sequence, process))
+        self.sequence += 1
+
+    def start(self, process: Generator) -> None:
+        self.schedule(0, process)
+
+    def fire(self, event: signal) -> None:
+        event.fired = True
+
+        for process in event.waiting:
+            self.schedule(0, process)
+
+        event.waiting = []
+
+    def step(self, process: Generator) -> None:
+        try:
+            request = next(process)
+        except StopIteration:
+            return
+
+        if isinstance(request, signal):
+            if request.fired is True:
+                self.schedule(0, process)
+            else:
+                request.waiting.append(process)
+        else:
+            self.schedule(request, process)
+
+    def occupy(self, resource: str, phase: str, duration: float) -> float:
+        # Record time spent, to be yielded by the calling process
+        self.busy[resource] += duration
+        self.phases.setdefault(phase, []).append(duration)
+
+        return duration
+
+    # Processes, following tools.run_campaign
+
+    def analyse(self, temp: float, volume: float) -> Generator:
+        yield self.occupy("cell", "temperature", self.temperature_wait(temp, self.hold_time))
+        yield self.occupy("cell", "measure", self.measure_time if self.model.measure_time is None else self.model.measure_time)
+        yield self.occupy("cell", "empty", self.pump_time("empty", volume))
+
+        self.completed += 1
+
+    def clean(self, next_temp: float | None, cleaned: signal | None = None) -> Generator:
+        yield self.occupy("cell", "clean", self.clean_time())
+
+        # Residues removed at cleaning temperature
+        if self.temperature() < self.cleaning_temp:
+            yield self.occupy("cell", "clean", self.temperature_wait(self.cleaning_temp, self.wait_time))
+
+        if next_temp is not None:
+            self.set_temperature(next_temp)
+
+        if cleaned is not None:
+            self.fire(cleaned)
+
+    def prepare(self, values: dict, volumes: list, k: int, prepared: signal) -> Generator:
+        duration, volumes[k] = self.prepare_time(values)
+        yield self.occupy("mixer", "prepare", duration)
+
+        self.fire(prepared)
+
+    def sequential_batch(self, batch: list[tuple[dict, float]]) -> Generator:
+        for k, (values, temp) in enumerate(batch):
+            next_temp = batch[k+1][1] if k+1 < len(batch) else None
+
+            # Set early to reduce effective time to reach
+            self.set_temperature(temp)
+
+            duration, volume = self.prepare_time(values)
+            yield self.occupy("mixer", "prepare", duration)
+
+            transfer = 2 * self.mass_time() + self.pump_time("add", volume) + self.mass_time()
+            yield self.occupy("cell", "transfer", transfer)
+
+            yield from self.analyse(temp, volume)
+            yield from self.clean(next_temp)
+
+    def pipelined_batch(self, batch: list[tuple[dict, float]]) -> Generator:
+        # Next mixture in batch is prepared whilst the previous one is analysed and the cell cleaned. With a batch
+        # size of 1 there is no next mixture, so only preparation and the previous clean overlap.
+        prepared = [signal() for _ in batch]
+        volumes = [0.0] * len(batch)
+
+        self.start(self.prepare(batch[0][0], volumes, 0, prepared[0]))
+
+        for k, (values, temp) in enumerate(batch):
+            next_temp = batch[k+1][1] if k+1 < len(batch) else None
+
+            if self.cleaned is not None:
+                yield self.cleaned
+
+            # Set as soon as the cell is clean, whilst the mixture may still be prepared
+            self.set_temperature(temp)
+
+            yield prepared[k]
+
+            transfer = 2 * self.mass_time() + self.pump_time("add", volumes[k]) + self.mass_time()
+            yield self.occupy("cell", "transfer", transfer)
+
+            if k+1 < len(batch):
+                self.start(self.prepare(batch[k+1][0], volumes, k+1, prepared[k+1]))
+
+            yield from self.analyse(temp, volumes[k])
+
+            self.cleaned = signal()
+            self.start(self.clean(next_temp, self.cleaned))
+
+    def campaign(self, suggestions: list[tuple[dict, float]], strategy: str, sequence: str, batch_size: int) -> Generator:
+        for start in range(0, len(suggestions), batch_size):
+            batch = suggestions[start:start+batch_size]
+
+            # Optimiser returns next batch once measurements are sent
+            yield self.occupy("optimiser", "optimiser", self.suggestion_time)
+
+            order = self.sequencer.order([temp for _, temp in batch], start=self.temperature(), method=sequence, cleaning_temp=self.cleaning_temp)
+            batch = [batch[i] for i in order]
+
+            if strategy == "pipelined":
+                yield from self.pipelined_batch(batch)
+            else:
+                yield from self.sequential_batch(batch)
+
+        # Final clean finishes the campaign
+        if self.cleaned is not None:
+            yield self.cleaned
+
+    def run(self, suggestions: list[tuple[dict, float]], strategy: str = "sequential", sequence: str = "auto", batch_size: int = 1) -> dict:
+        self.now = 0.0
+        self.events = []
+        self.sequence = 0
+
+        self.busy = {"mixer": 0.0, "cell": 0.0, "optimiser": 0.0}
+        self.phases = {}
+        self.completed = 0
+        self.cleaned = None
+
+        self.temp_start = self.temp_target = self.start_temp
+        self.temp_time = 0.0
+
+        self.start(self.campaign(suggestions, strategy, sequence, batch_size))
+
+        while len(self.events) > 0:
+            self.now, _, process = heapq.heappop(self.events)
+            self.step(process)
+
+        total = max(self.now, 1e-9)
+
+        return {"strategy": strategy,
+                "sequence": sequence,
+                "batch_size": batch_size,
+                "experiments": self.completed,
+                "total_time": total, # s
+                "experiments_per_day": 86400 * self.completed / total,
+                "mixer_utilisation": self.busy["mixer"] / total,
+                "cell_utilisation": self.busy["cell"] / total,
+                "phases": {phase: sum(durations) / len(durations) for phase, durations in self.phases.items()}, # mean s
+            }
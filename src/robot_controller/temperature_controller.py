@@ -1,17 +1,122 @@
 import logging
 import random
 import sys
-import time
 
 import matplotlib.pyplot as plt
 import numpy as np
-import serial
+
+from robot_controller import clock, command_futures, register_pipeline, serial_transport, tracing
 
 logging.basicConfig(level = logging.INFO)
 
 # To communicate with: https://lairdthermal.com/products/product-temperature-controllers/tc-xx-pr-59-temperature-controller
 
-class peltier:
+class steady_state_estimator:
+    def __init__(self, target: float, allowable_error: float, min_window: float, max_window: float) -> None:
+        # Online convergence test for a first-order thermal response, T(t) = T_ss + (T_0 - T_ss) * exp(-t / tau).
+        # Steady state is declared once the in-tolerance samples show no drift or excess noise and the fitted
+        # final temperature is within tolerance, or (as before) after max_window seconds within tolerance.
+        self.target = target
+        self.allowable_error = allowable_error
+        self.min_window = min_window # s
+        self.max_window = max_window # s
+
+        self.std_limit = allowable_error / 3 # C, noise allowed about rolling trend
+
+        self.times = np.empty((0,))
+        self.temperatures = np.empty((0,))
+        self.streak_start = None # Time of first sample in current in-tolerance run
+
+    def update(self, t: float, temperature: float) -> None:
+        self.times = np.append(self.times, t)
+        self.temperatures = np.append(self.temperatures, temperature)
+
+        # Keep approach samples for fitting, drop anything older than the steady state window
+        keep = self.times >= t - max(self.max_window, 3 * self.min_window)
+        self.times, self.temperatures = self.times[keep], self.temperatures[keep]
+
+        if abs(self.target - temperature) < self.allowable_error:
+            if self.streak_start is None:
+                self.streak_start = t
+        else:
+            self.streak_start = None
+
+    def streak(self) -> tuple[np.ndarray, np.ndarray]:
+        if self.streak_start is None:
+            return np.empty((0,)), np.empty((0,))
+
+        inside = self.times >= self.streak_start
+        return self.times[inside], self.temperatures[inside]
+
+    def fit(self) -> tuple[float, float] | None:
+        # Linear regression of dT/dt against T gives dT/dt = (T_ss - T) / tau
+        if len(self.times) < 4:
+            return None
+
+        rate = np.diff(self.temperatures) / np.diff(self.times)
+        midpoint = (self.temperatures[1:] + self.temperatures[:-1]) / 2
+
+        if np.ptp(midpoint) == 0:
+            return float(midpoint[-1]), 0.0
+
+        gradient, intercept = np.polyfit(midpoint, rate, 1)
+
+        if gradient >= 0:
+            # Not converging (yet)
+            return None
+
+        return float(-intercept / gradient), float(-1 / gradient)
+
+    def time_to_setpoint(self) -> float | None:
+        # Predicted time until within half the allowable error of the fitted final temperature
+        result = self.fit()
+
+        if result is None or abs(result[0] - self.target) > self.allowable_error:
+            return None
+
+        final, tau = result
+        distance = abs(self.temperatures[-1] - final)
+
+        if distance <= self.allowable_error / 2:
+            return 0.0
+
+        return float(tau * np.log(2 * distance / self.allowable_error))
+
+    def is_steady(self) -> bool:
+        times, temperatures = self.streak()
+
+        if len(times) < 2:
+            return False
+
+        if times[-1] - times[0] >= self.max_window:
+            return True
+
+        if times[-1] - times[0] < self.min_window:
+            return False
+
+        # Rolling statistics over the most recent min_window of samples
+        recent = times >= times[-1] - self.min_window
+        slope, intercept = np.polyfit(times[recent], temperatures[recent], 1)
+        residuals = temperatures[recent] - (slope * times[recent] + intercept)
+
+        if residuals.std() > self.std_limit or abs(temperatures[recent].mean() - self.target) >= self.allowable_error:
+            return False
+
+        # Converging: fitted final temperature within error and already (almost) reached
+        if self.time_to_setpoint() == 0.0:
+            return True
+
+        # Not converging (e.g. already at temperature): no significant drift across the window
+        return self.fit() is None and abs(slope) * self.min_window < self.allowable_error / 2
+
+    def stats(self) -> tuple[float, float]:
+        # Mean and deviation over the most recent min_window of samples
+        times, temperatures = self.streak()
+        recent = temperatures[times >= times[-1] - self.min_window]
+
+        return float(round(recent.mean(), 2)), float(round(recent.std(), 3))
+
+class peltier(command_futures.queued_device):
     def __init__(self, COM: str, sim: bool = False) -> None:
         self.sim = sim
 
@@ -37,7 +142,8 @@ class peltier:
 
         # Steady state temperature
         self.allowable_error = 0.5 #C
-        self.steady_state = 180 #s (3mins)
+        self.steady_state = 180 #s (3mins), maximum time within error before steady state is assumed
+        self.min_steady_state = 30 #s, minimum time within error before steady state can be predicted
         self.timeout = 1800 #s (30mins)
 
         # Heating/Cooling control
@@ -56,6 +162,15 @@ class peltier:
         self.subzero_Ki = 0.1
         self.subzero_Kd = 0.0
 
+        # Approximate ramp rates, used to sequence experiments (see temperature_sequencer) and in simulation
+        self.heating_rate = 3.0 #C/min
+        self.cooling_rate = 2.0 #C/min
+        self.subzero_rate = 1.0 #C/min
+
+        # Simulated cell temperature ramps linearly from start to target
+        self.sim_start = (25.0, clock.monotonic()) #C, s
+        self.sim_target = 25.0 #C
+
         self.run_flag = False
 
         self.temp_threshold = 15 #C, to set heating or cooling parameters
@@ -64,11 +179,7 @@ class peltier:
 
         if self.sim is False:
             logging.info("Configuring temperature controller serial port..")
-            self.ser = serial.Serial(COM) 
-            self.ser.baudrate = 115200
-            self.ser.bytesize = 8
-            self.ser.parity = 'N' # No parity
-            self.ser.stopbits = 1
+            self.ser = serial_transport.serial_transport(COM, baudrate=115200, timeout=5, name="temperature controller")
 
             logging.info("Attempting to open temperature controller serial port..")
 
@@ -136,15 +247,15 @@ class peltier:
             logging.info("No serial connection to temperature controller established.")
 
     def close_ser(self) -> None:
+        # Finish any queued commands before closing port
+        self.close_commands()
+
         if self.sim is False:
             if self.ser.isOpen():
                 self.ser.close()
 
     def get_data(self) -> str:
-        while self.ser.in_waiting == 0:
-            pass
-
-        return self.ser.readline().decode().rstrip()
+        return self.ser.read_line().rstrip()
     
     def handshake(self) -> bool:
         msg = "$LI"
@@ -152,7 +263,7 @@ class peltier:
         # returns '18245 TC-XX-PR-59 REV2.6'
 
         if self.sim is False:
-            self.ser.write((msg+'\r').encode('ascii'))
+            self.ser.write(msg+'\r')
 
             repeat = self.get_data()
             info = self.get_data()
@@ -169,7 +280,7 @@ class peltier:
         msg = "$W"
 
         if self.sim is False and self.run_flag is False:
-            self.ser.write((msg+'\r').encode('ascii'))
+            self.ser.write(msg+'\r')
             repeat = self.get_data().split(" ")[1]
 
             if self.get_data() == "Run" and repeat == msg:
@@ -182,7 +293,7 @@ class peltier:
         msg = "$Q"
 
         if self.sim is False and self.run_flag is True:
-            self.ser.write((msg+'\r').encode('ascii'))
+            self.ser.write(msg+'\r')
             repeat = self.get_data().split(" ")[1]
 
             if self.get_data() == "Stop" and repeat == msg:
@@ -195,7 +306,7 @@ class peltier:
         msg = "$S"
 
         if self.sim is False:
-            self.ser.write((msg+'\r').encode('ascii'))
+            self.ser.write(msg+'\r')
             repeat = self.get_data().split(" ")[1]
 
             if repeat == msg:
@@ -212,7 +323,7 @@ class peltier:
         msg = "$SC"
 
         if self.sim is False:
-            self.ser.write((msg+'\r').encode('ascii'))
+            self.ser.write(msg+'\r')
             repeat = self.get_data().split(" ")[1]
 
             if repeat == msg:
@@ -258,12 +369,13 @@ class peltier:
         if self.sim is False:
             msg = f"$R{REGISTER_NUMBER}={VALUE}"
 
-            self.ser.write((msg+'\r').encode('ascii'))
+            self.ser.write(msg+'\r')
 
             repeat = self.get_data().split(" ")[1]
             response = self.get_data()
             if (response == f"{VALUE}" or response == '') and repeat == msg:
-                #logging.info(f"Successfully wrote to R{REGISTER_NUMBER}.")
+                # Every register helper writes through here, so only every 20th is logged
+                logging.info(f"Successfully wrote to R{REGISTER_NUMBER}.", extra={"sample": 20})
                 return True
             else:
                 logging.error(f"Failed to write to R{REGISTER_NUMBER}.")
@@ -275,7 +387,7 @@ class peltier:
     def register_read(self, REGISTER_NUMBER: int) -> float | int:
         if self.sim is False:
             msg = f"$R{REGISTER_NUMBER}?"
-            self.ser.write((msg+'\r').encode('ascii'))
+            self.ser.write(msg+'\r')
 
             repeat = self.get_data().split(" ")[1]
             if repeat != msg:
@@ -284,6 +396,42 @@ class peltier:
             return float(self.get_data())
         else:
             return random.uniform(self.min_temp, self.max_temp)
+
+    def register_batch(self, writes: list[tuple[int, int | float]] | None = None, reads: list[int] | None = None) -> register_pipeline.batch_result:
+        # Pipelined writes (in order) then reads. Every command is echoed and answered (unknown ones with "?"),
+        # so each reply is the echoed command line followed by its response line.
+        writes = [] if writes is None else writes
+        reads = [] if reads is None else reads
+        result = register_pipeline.batch_result()
+
+        if self.sim is True:
+            result.values = {**{register: value for register, value in writes}, **{register: random.uniform(self.min_temp, self.max_temp) for register in reads}}
+            return result
+
+        commands = [(f"$R{register}={value}", f"$R{register}={value}\r") for register, value in writes] + [(f"$R{register}?", f"$R{register}?\r") for register in reads]
+
+        def receive() -> tuple[str, str]:
+            # Echo follows the prompt of the previous response, e.g. "> $R41=23.5"
+            repeat = self.get_data().split(" ")[-1]
+            return repeat, self.get_data()
+
+        # Temperature read as sentinel, so a missing reply to the final command does not wait for a timeout
+        replies = register_pipeline.pipeline(self.ser, commands, receive, sentinel=("$R100?", "$R100?\r"))
+
+        for (register, value), reply in zip(writes, replies):
+            # For RXX=, if data=int response is <Downloaded data>, if float <no response>
+            if reply == f"{value}" or reply == '':
+                result.values[register] = value
+            else:
+                result.failures[register] = "write not acknowledged" if reply is None else f"write rejected ({reply})"
+
+        for register, reply in zip(reads, replies[len(writes):]):
+            try:
+                result.values[register] = float(reply)
+            except (TypeError, ValueError):
+                result.failures[register] = "no reply to read" if reply is None else f"unreadable reply {reply}"
+
+        return result
         
     def set_regulator_mode(self, mode: int = 6) -> bool:
         # 1 = Power 
@@ -315,17 +463,17 @@ class peltier:
         # This helps to save the life of the peltier modules
 
     def set_pid_parameters(self, p: float, i: float, d: float) -> bool:
-        if (self.register_write(1, p) is True) and (self.register_write(2, i) is True) and (self.register_write(3, d) is True):
-            return True
-        else:
-            return False
+        result = self.register_batch(writes=[(1, p), (2, i), (3, d)])
+        result.log_failures("temperature controller")
+
+        return result.succeeded()
 
     def set_low_pass(self, low_pass_a: float = 2, low_pass_b: float = 3) -> bool:
         # Default controller values for now => no need to set
-        if self.register_write(4, abs(low_pass_a)) is True and self.register_write(5, abs(low_pass_b)) is True:
-            return True
-        else:
-            return False
+        result = self.register_batch(writes=[(4, abs(low_pass_a)), (5, abs(low_pass_b))])
+        result.log_failures("temperature controller")
+
+        return result.succeeded()
 
     def set_fan_modes(self, mode: int = 4) -> None:
         # Always OFF = 0
@@ -334,33 +482,39 @@ class peltier:
         # Heat = 3
         # Cool / Heat = 4, on when main output is non zero (reg[106])
         
-        if (self.register_write(16, mode) is True) and (self.register_write(23, mode) is True) and (self.register_write(22, self.fan_voltage) is True) and (self.register_write(29, self.fan_voltage) is True):
+        result = self.register_batch(writes=[(16, mode), (23, mode), (22, self.fan_voltage), (29, self.fan_voltage)])
+
+        if result.succeeded() is True:
             logging.info("Temperature regulator fan settings successfully configured.")
         else:
+            result.log_failures("temperature controller")
             logging.error("Temperature regulator fan configuration failed.")
             sys.exit()
         
     def turn_fans_off(self) -> None:
         # To be used when taking mass readings
-        if (self.register_write(16, 0) is True) and (self.register_write(23, 0) is True):
+        result = self.register_batch(writes=[(16, 0), (23, 0)])
+
+        if result.succeeded() is True:
             logging.info("Fans successfully turned off.")
         else:
+            result.log_failures("temperature controller")
             logging.error("Failed to turn off fans.")
         
     def set_voltage_alarm_settings(self) -> bool:
         # Set alarms for over and under voltage
-        if (self.register_write(45, self.input_voltage + 1) is True) and (self.register_write(46, self.input_voltage - 1) is True):
-            return True
-        else:
-            return False
+        result = self.register_batch(writes=[(45, self.input_voltage + 1), (46, self.input_voltage - 1)])
+        result.log_failures("temperature controller")
+
+        return result.succeeded()
         
     def set_current_alarm_settings(self) -> bool:
         # Main current under and over
         # Fan current over
-        if (self.register_write(47, self.max_current) is True) and (self.register_write(48, self.min_current) is True) and (self.register_write(49, self.fan_current) is True) and (self.register_write(51, self.fan_current) is True):
-            return True
-        else:
-            return False
+        result = self.register_batch(writes=[(47, self.max_current), (48, self.min_current), (49, self.fan_current), (51, self.fan_current)])
+        result.log_failures("temperature controller")
+
+        return result.succeeded()
         
     def configure_main_sensor(self, mode: int = 12) -> bool:
         # 2 = to activate Steinhart calculation
@@ -371,10 +525,10 @@ class peltier:
 
         # Also set alarms on over and under
 
-        if (self.register_write(55, mode) is True) and (self.register_write(71, self.max_temp + 5) is True) and (self.register_write(72, self.min_temp - 5) is True):
-            return True
-        else:
-            return False
+        result = self.register_batch(writes=[(55, mode), (71, self.max_temp + 5), (72, self.min_temp - 5)])
+        result.log_failures("temperature controller")
+
+        return result.succeeded()
         
     def configure_heat_sink_sensor(self, mode: int = 12) -> bool:
         # 2 = to activate Steinhart calculation
@@ -382,22 +536,22 @@ class peltier:
         # 4 = to activate PT mode 
 
         # Also set alarms on over and under
-        if (self.register_write(56, mode) is True) and (self.register_write(73, self.max_temp + 5) is True) and (self.register_write(74, self.min_temp - 5) is True):
-            return True
-        else:
-            return False
+        result = self.register_batch(writes=[(56, mode), (73, self.max_temp + 5), (74, self.min_temp - 5)])
+        result.log_failures("temperature controller")
+
+        return result.succeeded()
         
     def set_main_steinhart_coeffs(self) -> bool:
-        if (self.register_write(59, self.A_coeff_2) is True) and (self.register_write(60, self.B_coeff_2) is True) and (self.register_write(61, self.C_coeff_2) is True):
-            return True
-        else:
-            return False
+        result = self.register_batch(writes=[(59, self.A_coeff_2), (60, self.B_coeff_2), (61, self.C_coeff_2)])
+        result.log_failures("temperature controller")
+
+        return result.succeeded()
         
     def set_heat_sink_steinhart_coeffs(self) -> bool:
-        if (self.register_write(62, self.A_coeff_2) is True) and (self.register_write(63, self.B_coeff_2) is True) and (self.register_write(64, self.C_coeff_2) is True):
-            return True
-        else:
-            return False
+        result = self.register_batch(writes=[(62, self.A_coeff_2), (63, self.B_coeff_2), (64, self.C_coeff_2)])
+        result.log_failures("temperature controller")
+
+        return result.succeeded()
     
     def get_t1_mode(self) -> int:
         return self.register_read(55)
@@ -409,6 +563,9 @@ class peltier:
         return self.register_read(106)
     
     def get_t1_value(self) -> float:
+        if self.sim is True:
+            return self.simulated_temperature()
+
         return self.register_read(100)
     
     def get_t2_value(self) -> float:
@@ -425,84 +582,135 @@ class peltier:
     
     def set_heating_mode(self) -> None:
         if (self.set_max_tc(self.heating_tc) is True) and (self.set_pid_parameters(self.heating_Kp, self.heating_Ki, self.heating_Kd) is True):
-                logging.info("Temperature regulator set to heating mode.")
+                # Mode is set again on every set point change, so at most every 30s
+                logging.info("Temperature regulator set to heating mode.", extra={"rate_limit": 30.0})
         else:
             logging.error("Failed to set temperature regulator to heating mode.")
             sys.exit()
 
     def set_cooling_mode(self) -> None:
         if (self.set_max_tc(self.cooling_tc) is True) and (self.set_pid_parameters(self.cooling_Kp, self.cooling_Ki, self.cooling_Kd) is True):
-                logging.info("Temperature regulator set to cooling mode.")
+                logging.info("Temperature regulator set to cooling mode.", extra={"rate_limit": 30.0})
         else:
             logging.error("Failed to set temperature regulator to cooling mode.")
             sys.exit()
 
     def set_subzero_mode(self) -> None:
         if (self.set_max_tc(self.subzero_tc) is True) and (self.set_pid_parameters(self.subzero_Kp, self.subzero_Ki, self.subzero_Kd) is True):
-                logging.info("Temperature regulator set to subzero mode.")
+                logging.info("Temperature regulator set to subzero mode.", extra={"rate_limit": 30.0})
         else:
             logging.error("Failed to set temperature regulator to subzero mode.")
             sys.exit()
 
+    def get_band(self, temp: float) -> str:
+        # Temperature band used to select PID parameters
+        if temp >= self.temp_threshold:
+            return "heating"
+        elif temp >= self.subzero_threshold:
+            return "cooling"
+        else:
+            return "subzero"
+
+    def ramp_time(self, start: float, end: float) -> float:
+        # Seconds to ramp between temperatures, cooling slows below the subzero threshold
+        if end >= start:
+            return 60 * (end - start) / self.heating_rate
+
+        above = max(start, self.subzero_threshold) - max(end, self.subzero_threshold)
+        below = min(start, self.subzero_threshold) - min(end, self.subzero_threshold)
+
+        return 60 * (above / self.cooling_rate + below / self.subzero_rate)
+
+    def simulated_temperature(self) -> float:
+        temp, start_time = self.sim_start
+        duration = self.ramp_time(temp, self.sim_target)
+
+        if duration <= 0:
+            return self.sim_target
+
+        progress = min(max(clock.monotonic() - start_time, 0) / duration, 1.0)
+        return temp + progress * (self.sim_target - temp)
+
+    def set_band_gains(self, band: str, gains: dict) -> None:
+        # e.g. set_band_gains("heating", {"Kp": 8, "Ki": 0.01, "Kd": 0.0}), used by set_heating_mode etc.
+        for name in ["Kp", "Ki", "Kd"]:
+            setattr(self, f"{band}_{name}", gains[name])
+
+        logging.info(f"Temperature regulator {band} gains set to Kp = {gains['Kp']}, Ki = {gains['Ki']}, Kd = {gains['Kd']}.")
+
+    @tracing.traced("peltier")
     def set_temperature(self, temp: float) -> None:
         self.assess_status()
         
-        if temp >= self.temp_threshold:
+        band = self.get_band(temp)
+
+        if band == "heating":
             self.set_heating_mode()
-        elif temp >= self.subzero_threshold:
+        elif band == "cooling":
             self.set_cooling_mode()
         else:
             self.set_subzero_mode()
 
         if self.register_write(0, self.clamp(temp, self.min_temp, self.max_temp)) is True:
             logging.info(f"Peltier target temperature set to {temp}C.")
+
+            if self.sim is True:
+                self.sim_start = (self.simulated_temperature(), clock.monotonic())
+                self.sim_target = self.clamp(temp, self.min_temp, self.max_temp)
         else:
             logging.error("Failed to set peltier target temperature.")
             sys.exit()
 
         self.set_run_flag()
     
+    @tracing.traced("peltier")
     def wait_until_temperature(self, value: float, sample_rate: float = 0.2, keep_on: bool = True, steady_state: float | None = None) -> tuple[bool, float, float]:
-        if self.sim is True:
-            return True, 0.0, 0.0
-        
         if steady_state is not None:
             time_check = steady_state
         else:
             time_check = self.steady_state
+
+        if self.sim is True:
+            # Ramp then hold within error until steady state
+            self.set_temperature(value)
+            clock.simulate(self.ramp_time(self.sim_start[0], self.sim_target) + time_check)
+
+            if keep_on is False:
+                self.clear_run_flag()
+
+            return True, float(self.sim_target), 0.0
         
+        estimator = steady_state_estimator(value, self.allowable_error, min(self.min_steady_state, time_check), time_check)
+
         self.set_temperature(value)
-        global_start = time.time()
+        global_start = clock.monotonic()
 
-        while (time.time() - global_start) < self.timeout:
+        while (clock.monotonic() - global_start) < self.timeout:
 
             temperature = self.get_t1_value()
-            
-            stats = np.empty((1,))
-            local_start = time.time()
+            estimator.update(clock.monotonic() - global_start, temperature)
 
-            while (abs(value - temperature) < self.allowable_error) and (time.time() - local_start < time_check):
-                
-                temperature = self.get_t1_value()
-                stats = np.append(stats, np.array([temperature]), axis=0)
+            # Check if steady state reached (or predicted from convergence)
+            if estimator.is_steady() is True:
+                mean, std = estimator.stats()
 
-                time.sleep(1 / sample_rate)
-
-            # Check if steady state timeout reached
-            if (time.time() - local_start) >= time_check:
-                mean = round(stats.mean(), 2)
-                std = round(stats.std(), 3)
-
-                logging.info(f"Temperature controller successfully reached {value}C in {time.time() - global_start}s (mean = {mean}C, std = {std}C).")
+                logging.info(f"Temperature controller successfully reached {value}C in {clock.monotonic() - global_start}s (mean = {mean}C, std = {std}C).")
 
                 # Turn controller OFF if required
                 if keep_on is False:
                     self.clear_run_flag()
 
-                return True, float(mean), float(std)
+                return True, mean, std
             
-            logging.info(f"Temperature progress is {round(temperature, 2)}/{value}C ({round(self.get_tc_value(), 2)}% Power and {round(self.get_main_current(), 2)}A).")
-            time.sleep(1 / sample_rate)
+            if abs(value - temperature) >= self.allowable_error:
+                prediction = estimator.time_to_setpoint()
+
+                if prediction is not None:
+                    logging.info(f"Temperature progress is {round(temperature, 2)}/{value}C ({round(self.get_tc_value(), 2)}% Power and {round(self.get_main_current(), 2)}A), setpoint predicted in {round(prediction)}s.")
+                else:
+                    logging.info(f"Temperature progress is {round(temperature, 2)}/{value}C ({round(self.get_tc_value(), 2)}% Power and {round(self.get_main_current(), 2)}A).")
+
+            clock.sleep(1 / sample_rate)
             
         logging.error(f"Temperature controller timed out trying to reach {value}C.")
         logging.info(f"Final peltier current is {round(self.get_main_current(), 2)}A.")
@@ -511,9 +719,90 @@ class peltier:
         self.clear_run_flag()
         return False, 0.0, 0.0
     
+    def relay_analysis(self, times: np.ndarray, temperatures: np.ndarray, setpoint: float, cycles: int) -> tuple[float, float] | None:
+        # Amplitude and period of the limit cycle, from the last complete cycles between upward setpoint crossings
+        error = temperatures - setpoint
+        upward = np.where((error[:-1] < 0) & (error[1:] >= 0))[0] + 1
+
+        if len(upward) < cycles + 1:
+            return None
+
+        # Ignore first cycle (initial approach)
+        upward = upward[-cycles-1:]
+
+        peaks = [temperatures[a:b].max() for a, b in zip(upward[:-1], upward[1:])]
+        troughs = [temperatures[a:b].min() for a, b in zip(upward[:-1], upward[1:])]
+
+        amplitude = (np.mean(peaks) - np.mean(troughs)) / 2
+        period = np.mean(np.diff(times[upward]))
+
+        return float(amplitude), float(period)
+
+    def auto_tune(self, setpoint: float, cycles: int = 4, sample_rate: float = 1.0, rule: str = "no_overshoot") -> dict | None:
+        # Relay (Astrom-Hagglund) auto-tune: ON/OFF regulation at full output makes the plant oscillate about the
+        # setpoint, from which the ultimate gain Ku = 4d / (pi * a) and period Tu give PID gains for the band.
+        # Gains are returned in parallel form (Ki = Kp / Ti, Kd = Kp * Td).
+        band = self.get_band(setpoint)
+        amplitude_tc = getattr(self, f"{band}_tc") # %, relay amplitude d
+
+        logging.info(f"Beginning relay auto-tune of {band} band at {setpoint}C ({amplitude_tc}% output, {cycles} cycles)..")
+
+        if self.sim is True:
+            return {"Kp": getattr(self, f"{band}_Kp"), "Ki": getattr(self, f"{band}_Ki"), "Kd": getattr(self, f"{band}_Kd")}
+
+        # ON/OFF mode with band output limit acts as the relay
+        self.set_max_tc(amplitude_tc)
+        self.set_regulator_mode(2)
+        self.register_write(0, self.clamp(setpoint, self.min_temp, self.max_temp))
+        self.set_run_flag()
+
+        times = np.empty((0,))
+        temperatures = np.empty((0,))
+        result = None
+
+        start = clock.monotonic()
+        while (clock.monotonic() - start) < self.timeout:
+            times = np.append(times, clock.monotonic() - start)
+            temperatures = np.append(temperatures, self.get_t1_value())
+
+            result = self.relay_analysis(times, temperatures, setpoint, cycles)
+            if result is not None:
+                break
+
+            clock.sleep(1 / sample_rate)
+
+        # Return to PID regulation
+        self.clear_run_flag()
+        self.set_regulator_mode()
+
+        if result is None:
+            logging.error(f"Relay auto-tune failed to record {cycles} oscillations at {setpoint}C within {self.timeout}s.")
+            return None
+
+        amplitude, period = result
+        Ku = 4 * amplitude_tc / (np.pi * amplitude)
+
+        # Ziegler-Nichols style tuning rules: (Kp/Ku, Ti/Tu, Td/Tu)
+        rules = {"classic": (0.6, 0.5, 0.125),
+                 "some_overshoot": (0.33, 0.5, 0.33),
+                 "no_overshoot": (0.2, 0.5, 0.33),
+            }
+
+        kp_ratio, ti_ratio, td_ratio = rules[rule]
+        Kp = kp_ratio * Ku
+
+        gains = {"Kp": round(float(Kp), 3), 
+                 "Ki": round(float(Kp / (ti_ratio * period)), 5), 
+                 "Kd": round(float(Kp * td_ratio * period), 3)}
+
+        logging.info(f"Relay auto-tune of {band} band complete: amplitude = {round(amplitude, 3)}C, period = {round(period, 1)}s, Ku = {round(Ku, 2)}.")
+        self.set_band_gains(band, gains)
+
+        return gains
+
     def plot_live_temperature_control(self, value: float, sample_rate: float = 1) -> bool:        
         self.set_temperature(value)
-        global_start = time.time()
+        global_start = clock.monotonic()
 
         plt.ion()
         plot_width = self.timeout * sample_rate
@@ -540,7 +829,7 @@ class peltier:
         # Turn controller ON
         self.set_run_flag()
 
-        while (time.time() - global_start) < self.timeout:
+        while (clock.monotonic() - global_start) < self.timeout:
 
             temperature = self.get_t1_value()
             sink = self.get_t2_value()
@@ -549,7 +838,8 @@ class peltier:
 
             # Append and loose first element
             plt.title(f"Target Temp: {value}C, Sample Rate: {sample_rate}Hz")
-            plt.suptitle(f"Live Data: Control Temperature = {round(temperature,2)}C, Heat Sink Temperature = {round(sink,2)}C, Main Current = {round(curr,2)}A, Fan Current = {round(fan_curr,2)}A, Elapsed Time = {round(time.time() - global_start,2)}s")
+            plt.suptitle(f"Live Data: Control Temperature = {round(temperature,2)}C, Heat Sink Temperature = {round(sink,2)}C, Main Current = {round(curr,2)}A, "
+                         f"Fan Current = {round(fan_curr,2)}A, Elapsed Time = {round(clock.monotonic() - global_start,2)}s")
 
             error.append(value - temperature)
             error = error[-plot_width:]
@@ -567,21 +857,21 @@ class peltier:
             fig.canvas.draw()
             fig.canvas.flush_events()
                 
-            local_start = time.time()     
+            local_start = clock.monotonic()     
 
-            while (abs(value - self.get_t1_value()) < self.allowable_error) and (time.time() - local_start < self.steady_state):
-                time.sleep(1 / sample_rate)
+            while (abs(value - self.get_t1_value()) < self.allowable_error) and (clock.monotonic() - local_start < self.steady_state):
+                clock.sleep(1 / sample_rate)
 
             # Check if steady state timeout reached
-            if (time.time() - local_start) >= self.steady_state:
-                logging.info(f"Temperature controller successfully reached {value}C in {time.time() - global_start}s")
+            if (clock.monotonic() - local_start) >= self.steady_state:
+                logging.info(f"Temperature controller successfully reached {value}C in {clock.monotonic() - global_start}s")
                 logging.info(f"Final peltier current is {round(self.get_main_current(),2)}A.")
 
                 # Turn controller OFF
                 self.clear_run_flag()
                 return True
             
-            time.sleep(1 / sample_rate)
+            clock.sleep(1 / sample_rate)
             
         logging.error(f"Temperature controller timed out trying to reach {value}C.")
         logging.info(f"Final peltier current is {round(self.get_main_current(),2)}A.")
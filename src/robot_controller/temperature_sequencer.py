@@ -0,0 +1,94 @@
+import logging
+
+from robot_controller import temperature_controller
+
+logging.basicConfig(level = logging.INFO)
+
+class temperature_sequencer:
+    def __init__(self, peltier: temperature_controller.peltier) -> None:
+        # Reorders a batch of pending experiments to reduce time spent ramping the Peltier between set points
+        self.peltier = peltier
+
+        self.methods = ["arrival", "nearest", "sweep", "auto"]
+        self.min_saving = 10 # s, keep arrival order unless reordering saves at least this much
+
+    def ramp_time(self, start: float, end: float) -> float:
+        return self.peltier.ramp_time(start, end)
+
+    def after_experiment(self, temp: float, cleaning_temp: float | None = None) -> float:
+        # Cleaning raises the cell to cleaning_temp if below (see scheduler.clean)
+        if cleaning_temp is None:
+            return temp
+
+        return max(temp, cleaning_temp)
+
+    def transition_time(self, previous: float, temp: float, cleaning_temp: float | None = None) -> float:
+        cleaned = self.after_experiment(previous, cleaning_temp)
+        return self.ramp_time(previous, cleaned) + self.ramp_time(cleaned, temp)
+
+    def total_time(self, temperatures: list[float], start: float, cleaning_temp: float | None = None) -> float:
+        if len(temperatures) == 0:
+            return 0.0
+
+        total = self.ramp_time(start, temperatures[0])
+
+        for previous, temp in zip(temperatures[:-1], temperatures[1:]):
+            total += self.transition_time(previous, temp, cleaning_temp)
+
+        return total
+
+    def nearest_order(self, temperatures: list[float], start: float, cleaning_temp: float | None = None) -> list[int]:
+        # Greedy: always run the pending experiment that is quickest to reach next
+        pending = list(range(len(temperatures)))
+        order = []
+
+        while len(pending) > 0:
+            if len(order) == 0:
+                i = min(pending, key=lambda j: self.ramp_time(start, temperatures[j]))
+            else:
+                i = min(pending, key=lambda j: self.transition_time(temperatures[order[-1]], temperatures[j], cleaning_temp))
+
+            pending.remove(i)
+            order.append(i)
+
+        return order
+
+    def sweep_order(self, temperatures: list[float], start: float, cleaning_temp: float | None = None) -> list[int]:
+        # Monotonic: run in ascending or descending order, whichever is quicker from the start temperature
+        ascending = sorted(range(len(temperatures)), key=lambda i: temperatures[i])
+        descending = ascending[::-1]
+
+        options = [ascending, descending]
+        times = [self.total_time([temperatures[i] for i in option], start, cleaning_temp) for option in options]
+
+        return options[times.index(min(times))]
+
+    def order(self, temperatures: list[float], start: float, method: str = "auto", cleaning_temp: float | None = None) -> list[int]:
+        # Returns indices of temperatures in the order to run them
+        if method not in self.methods:
+            logging.error(f"Unknown sequencing method {method}, please choose from {self.methods}.")
+            return list(range(len(temperatures)))
+
+        arrival = list(range(len(temperatures)))
+
+        if len(temperatures) < 2 or method == "arrival":
+            return arrival
+
+        options = []
+        if method in ["nearest", "auto"]:
+            options.append(self.nearest_order(temperatures, start, cleaning_temp))
+
+        if method in ["sweep", "auto"]:
+            options.append(self.sweep_order(temperatures, start, cleaning_temp))
+
+        times = [self.total_time([temperatures[i] for i in option], start, cleaning_temp) for option in options]
+        best = options[times.index(min(times))]
+
+        arrival_time = self.total_time(temperatures, start, cleaning_temp)
+
+        if min(times) > arrival_time - self.min_saving:
+            logging.info(f"Keeping arrival order of {len(temperatures)} experiments (estimated ramp time of {round(arrival_time)}s).")
+            return arrival
+
+        logging.info(f"Reordered {len(temperatures)} experiments to {[temperatures[i] for i in best]}C, estimated ramp time reduced from {round(arrival_time)}s to {round(min(times))}s.")
+        return best
@@ -3,13 +3,12 @@ import os
 import random
 import sys
 from csv import DictWriter
-from datetime import datetime
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
-from robot_controller import admiral, temperature_controller
+from robot_controller import admiral, clock, experiment_database, impedance_analysis, temperature_controller, temperature_sequencer, tracing
 
 logging.basicConfig(level = logging.INFO)
 
@@ -18,6 +17,7 @@ class measurements:
 
         self.peltier = temperature_controller.peltier(COM=temp_port, sim=temp_sim)
         self.squid = admiral.squidstat(COM=squid_port, sim=squid_sim)
+        self.sequencer = temperature_sequencer.temperature_sequencer(self.peltier)
 
         self.sim = squid_sim
 
@@ -33,6 +33,14 @@ class measurements:
         
         self.test_cell_volume = 2500 # ul from CAD
 
+        # Cell constant passed to analyser before each analysis
+        self.analyser = impedance_analysis.impedance_analyser(self.cell_constant, self.epsilon_0)
+        self.last_analysis = None
+
+        # Index of all experiments, shared with scheduler (recipe and cost) using last identifier
+        self.database = experiment_database.experiment_database(os.path.join(self.squid.results_path, "experiments.db"))
+        self.last_identifier = None
+
         # Create file with header if first time running code on PC
         if not os.path.exists(self.temp_file):
             with open(self.temp_file, 'a+') as file:
@@ -40,9 +48,10 @@ class measurements:
                 writer.writeheader()
 
     def get_indentifier(self) -> str:
-        now = datetime.now()
+        now = clock.now()
         return "ID_" + now.strftime("%d-%m-%Y_%H-%M-%S")
         
+    @tracing.traced("test cell")
     def single_temperature_analysis(self, temp: float, report: bool = True) -> None:
         result, mean, std = self.peltier.wait_until_temperature(temp, keep_on=True)
 
@@ -65,6 +74,7 @@ class measurements:
 
         # Get data
         ohmic_resistance, ionic_conductivity = self.get_impedance_properties(identifier=id)
+        self.record_experiment(id, temp, mean, std, ohmic_resistance, ionic_conductivity)
 
         return (ohmic_resistance, ionic_conductivity)
 
@@ -72,6 +82,10 @@ class measurements:
         logging.info(f"Cycling through {self.temp_points} temperatures from {self.start_temp}C to {self.end_temp}C..")
 
         temperatures = np.linspace(self.start_temp, self.end_temp, self.temp_points)
+
+        # Sweep from whichever end of the range is closest to the current temperature
+        order = self.sequencer.order(list(temperatures), start=self.peltier.get_t1_value(), method="sweep")
+        temperatures = temperatures[order]
         data = np.empty((self.temp_points, 2))
 
         for i, temp in enumerate(temperatures):
@@ -93,21 +107,50 @@ class measurements:
 
             # Get data
             data[0,i], data[1,i] = self.get_impedance_properties(identifier=id)
+            self.record_experiment(id, temp, mean, std, data[0,i], data[1,i])
 
         # Turn off Peltiers
         self.peltier.clear_run_flag()
 
         return pd.DataFrame(data=np.vstack((temperatures, data)))
 
+    def record_experiment(self, identifier: str, temp: float, mean: float, std: float, ohmic_resistance: float, ionic_conductivity: float) -> None:
+        self.last_identifier = identifier
+
+        kinds = [kind for kind in ["AC", "DC"] if self.squid.store.contains(kind, identifier)]
+        fit = {"fit_conductivity": None, "chi_square": None}
+
+        if self.sim is False and self.last_analysis is not None:
+            fit = {name: self.last_analysis[name] for name in fit}
+
+        self.database.record(identifier,
+                             temperature_target=float(temp),
+                             temperature_mean=float(mean),
+                             temperature_std=float(std),
+                             ohmic_resistance=float(ohmic_resistance),
+                             ionic_conductivity=float(ionic_conductivity),
+                             cell_constant=self.cell_constant,
+                             spectrum_store=self.squid.store.path,
+                             data_kinds=",".join(kinds),
+                             **fit,
+                            )
+
+    def load_spectrum(self, identifier: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Spectrum store, or CSV file for datasets measured before the store was introduced
+        if self.squid.store.contains("AC", identifier):
+            return self.analyser.load_stored_spectrum(self.squid.store, identifier)
+        else:
+            return self.analyser.load_spectrum(self.squid.get_ac_path(identifier))
+
     def plot_EIS(self, identifier: str = "na") -> None:
         logging.info("Saving EIS plot (Dataset " + identifier + ")..")
-        data = pd.read_csv(self.squid.get_ac_path(identifier)).to_numpy()
+        _, z_real, z_imag = self.load_spectrum(identifier)
 
         plt.figure()
         plt.title("EIS Data Results: " + identifier)
         plt.xlabel("Zreal (Ohms)")
         plt.ylabel("Zimag (Ohms)")
-        plt.scatter(data[:, 3], -data[:, 4]) #Zreal vs -Zimag
+        plt.scatter(z_real, -z_imag) #Zreal vs -Zimag
         plt.savefig(os.path.join(self.squid.results_path, identifier+".png"))
         plt.close()
 
@@ -116,40 +159,25 @@ class measurements:
             return (random.random(), random.random())
         
         # AC data required for impedance properties
-        data = pd.read_csv(self.squid.get_ac_path(identifier)).to_numpy()
-
-        frequency = data[:, 2]
-        z_real = data[:, 3]
+        self.analyser.cell_constant = self.cell_constant
+        results = self.analyser.analyse(*self.load_spectrum(identifier))
 
-        z_img = -data[:, 4]
-        abs_imag = np.abs(data[:, 4])
-        
-        # Finding ohmic resistance
-        min_imag = np.amin(abs_imag) # minimum of abs(Imag)
-
-        min_index = np.where(abs_imag == min_imag)[0][0] # take the first index if multiple instances
-        ohmic_resistance = np.round(z_real[min_index], 5).item() * 100 # take real value corresponding to minimum imag
-
-        logging.info(f"Ohmic Resistance calculated as {ohmic_resistance}Ohms (Dataset: " + identifier + ").")
+        # Ohmic resistance from equivalent circuit fit (or minimum of abs(Imag) if fit is poor)
+        ohmic_resistance = results["ohmic_resistance"]
 
-        # Finding Ionic conductivity
-        conductivity = np.empty((1,0))
-        tan_delta = np.empty((1,0))
+        if results["fit"] is not None:
+            logging.info(f"Equivalent circuit fitted with {round(100 * results['fit']['rms_error'], 2)}% rms error (Dataset: " + identifier + ").")
 
-        for i in range(len(z_real)):
-            z_square = z_real[i] ** 2 + z_img[i] ** 2
-            epsilon_real = z_img[i] * self.cell_constant / (2 * np.pi * frequency[i] * self.epsilon_0 * z_square)
-            epsilon_img = z_real[i] * self.cell_constant / (2 * np.pi * frequency[i] * self.epsilon_0 * z_square)
+        logging.info(f"Ohmic Resistance calculated as {ohmic_resistance / self.analyser.ohmic_scale}Ohms (Dataset: " + identifier + ").")
 
-            conductivity = np.append(conductivity, np.array([self.epsilon_0 * epsilon_img * 2 * np.pi * frequency[i]]))
-            tan_delta = np.append(tan_delta, np.array([epsilon_img / epsilon_real]))
-
-        max_index = np.argmax(tan_delta)
-        ionic_conductivity = np.round(conductivity[max_index], 5).item() * 1000 # ms/cm
+        # Ionic conductivity at maximum tan delta
+        ionic_conductivity = results["ionic_conductivity"]
 
         logging.info(f"Ionic Conductivity calculated as {ionic_conductivity}mS/cm (Dataset: " + identifier + ").")
 
+        self.last_analysis = results
+
         if plot is True:
             self.plot_EIS(identifier)
 
-        return ohmic_resistance, ionic_conductivity
\ No newline at end of file
+        return ohmic_resistance, ionic_conductivity
@@ -0,0 +1,211 @@
+import gzip
+import json
+import logging
+import re
+from datetime import datetime
+
+import numpy as np
+
+logging.basicConfig(level = logging.INFO)
+
+class timing_model:
+    def __init__(self) -> None:
+        # Operation durations fitted from mixing_station.log files of real runs. Anything without enough samples
+        # is left as None, in which case the station simulator uses the simulated controllers' own estimates.
+        self.line_format = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) (\w+): (.*)$")
+        self.time_format = "%Y-%m-%d %H:%M:%S"
+
+        # Pumps outside of cleaning (cleaning is timed as a whole)
+        self.pump_kinds = {"of electrolyte to test cell": "add",
+                           "from test cell to waste": "empty",
+            }
+
+        # Fitted parameters
+        self.prepare_fit: list[float] | None = None # [s per s of estimated gantry travel, s per dose, s per recipe]
+        self.pump_fits: dict[str, list[float]] = {} # kind -> [s per uL, s per command]
+        self.heating_rate: float | None = None # C/min
+        self.cooling_rate: float | None = None # C/min
+        self.hold_time: float | None = None # s, time within error before steady state
+        self.clean_time: float | None = None # s, cleaning and rinsing pumps (excluding heating)
+        self.measure_time: float | None = None # s, Squidstat experiment
+        self.mass_time: float | None = None # s, stable mass balance reading
+
+        self.samples: dict[str, list] = {}
+
+    def read_log(self, path: str) -> list[tuple[datetime, str]]:
+        # (time, message) for each JSON or formatted text line, others (e.g. tracebacks) are skipped.
+        # Rotated logs (e.g. mixing_station.log.1.gz) are read compressed.
+        records = []
+
+        opener = gzip.open if path.endswith(".gz") else open
+
+        with opener(path, 'rt', errors="replace") as file:
+            for line in file:
+                if line.startswith("{"):
+                    try:
+                        entry = json.loads(line)
+                        records.append((datetime.fromisoformat(entry["time"]), entry["message"]))
+                    except (ValueError, KeyError):
+                        pass
+
+                    continue
+
+                match = self.line_format.match(line.rstrip())
+
+                if match is not None:
+                    records.append((datetime.strptime(match.group(1), self.time_format), match.group(3)))
+
+        return records
+
+    def extract_samples(self, records: list[tuple[datetime, str]]) -> dict[str, list]:
+        samples: dict[str, list] = {"prepare": [], "pump": [], "temperature": [], "measure": [], "clean": [], "mass": []}
+
+        plan = None
+        pump = None
+        start_temp = None
+        measuring = None
+        cleaning = None
+
+        for time, message in records:
+            if (match := re.match(r"Dose plan compiled: (\d+) operations, (\d+) pipettes, estimated gantry time of ([\d.]+)s", message)) is not None:
+                operations, pipettes = int(match.group(1)), int(match.group(2))
+                # Each pipette is picked and returned, one mix, then a collect and deliver per dose
+                plan = (time, float(match.group(3)), (operations - 2 * pipettes - 1) / 2)
+
+            elif message.startswith("Mixture prepared in mixing chamber") and plan is not None:
+                samples["prepare"].append((plan[1], plan[2], (time - plan[0]).total_seconds()))
+                plan = None
+
+            elif message.startswith("Beginning cell cleaning procedure"):
+                cleaning = time
+
+            elif (message.startswith("Raising temperature to") or message.startswith("Cell cleaning complete")) and cleaning is not None:
+                samples["clean"].append((time - cleaning).total_seconds())
+                cleaning = None
+
+            elif (match := re.match(r"Pumping ([\d.]+)uL (.*)\.\.", message)) is not None and match.group(2) in self.pump_kinds and cleaning is None:
+                pump = (self.pump_kinds[match.group(2)], float(match.group(1)))
+
+            elif (match := re.match(r"Response from fluid handling kit: Pump complete in ([\d.]+)s", message)) is not None and pump is not None:
+                samples["pump"].append((pump[0], pump[1], float(match.group(1))))
+                pump = None
+
+            elif message.startswith("Peltier target temperature set to"):
+                start_temp = None
+
+            elif (match := re.match(r"Temperature progress is ([-\d.]+)/([-\d.]+)C", message)) is not None and start_temp is None:
+                start_temp = float(match.group(1))
+
+            elif (match := re.match(r"Temperature controller successfully reached ([-\d.]+)C in ([\d.]+)s", message)) is not None:
+                reached = float(match.group(1))
+
+                # Already within error if no progress was reported
+                if start_temp is None:
+                    start_temp = reached
+
+                samples["temperature"].append((start_temp, reached, float(match.group(2))))
+                start_temp = None
+
+            elif message.startswith("Attempting to begin Squidstat experiment"):
+                measuring = time
+
+            elif message.startswith("Experiment completed on channel") and measuring is not None:
+                samples["measure"].append((time - measuring).total_seconds())
+                measuring = None
+
+            elif (match := re.match(r"Stable mass balance reading after ([\d.]+)s", message)) is not None:
+                samples["mass"].append(float(match.group(1)))
+
+        return samples
+
+    def fit(self, paths: list[str]) -> "timing_model":
+        # Samples from all logs are pooled before fitting
+        samples: dict[str, list] = {}
+
+        for path in paths:
+            for name, values in self.extract_samples(self.read_log(path)).items():
+                samples.setdefault(name, []).extend(values)
+
+        self.samples = samples
+
+        # Preparation: linear in planner's gantry travel estimate and number of doses (aspiration and pressure checks)
+        if len(samples["prepare"]) >= 3:
+            data = np.array(samples["prepare"])
+            features = np.column_stack([data[:, 0], data[:, 1], np.ones(len(data))])
+            self.prepare_fit = [float(value) for value in np.linalg.lstsq(features, data[:, 2], rcond=None)[0]]
+
+        # Pumps: fixed overhead plus time per volume, for each command
+        for kind in self.pump_kinds.values():
+            data = np.array([(volume, duration) for name, volume, duration in samples["pump"] if name == kind])
+
+            if len(data) >= 2 and np.ptp(data[:, 0]) > 0:
+                slope, intercept = np.polyfit(data[:, 0], data[:, 1], 1)
+                self.pump_fits[kind] = [float(slope), float(intercept)]
+            elif len(data) > 0:
+                self.pump_fits[kind] = [float(np.mean(data[:, 1] / data[:, 0])), 0.0]
+
+        # Temperature: hold time plus ramp time for each degree heated or cooled
+        if len(samples["temperature"]) >= 3:
+            data = np.array(samples["temperature"])
+            change = data[:, 1] - data[:, 0]
+
+            features = np.column_stack([np.ones(len(data)), np.maximum(change, 0), np.maximum(-change, 0)])
+            hold, per_heating, per_cooling = np.linalg.lstsq(features, data[:, 2], rcond=None)[0]
+
+            self.hold_time = float(max(hold, 0))
+
+            # Rates only where there were ramps in that direction
+            if per_heating > 0 and np.any(change > 0):
+                self.heating_rate = float(60 / per_heating)
+            if per_cooling > 0 and np.any(change < 0):
+                self.cooling_rate = float(60 / per_cooling)
+
+        if len(samples["clean"]) > 0:
+            self.clean_time = float(np.median(samples["clean"]))
+
+        if len(samples["measure"]) > 0:
+            self.measure_time = float(np.median(samples["measure"]))
+
+        if len(samples["mass"]) > 0:
+            self.mass_time = float(np.median(samples["mass"]))
+
+        logging.info(f"Timing model fitted from {len(paths)} logs: " + ", ".join(f"{len(values)} {name}" for name, values in samples.items()) + " samples.")
+        return self
+
+    def prepare_time(self, travel_time: float, doses: int) -> float | None:
+        if self.prepare_fit is None:
+            return None
+
+        return max(self.prepare_fit[0] * travel_time + self.prepare_fit[1] * doses + self.prepare_fit[2], 0.0)
+
+    def pump_time(self, kind: str, volume: float) -> float | None:
+        # volume as logged (uL)
+        if kind not in self.pump_fits:
+            return None
+
+        slope, intercept = self.pump_fits[kind]
+        return max(slope * volume + intercept, 0.0)
+
+    def parameters(self) -> dict:
+        return {"prepare_fit": self.prepare_fit,
+                "pump_fits": self.pump_fits,
+                "heating_rate": self.heating_rate,
+                "cooling_rate": self.cooling_rate,
+                "hold_time": self.hold_time,
+                "clean_time": self.clean_time,
+                "measure_time": self.measure_time,
+                "mass_time": self.mass_time,
+            }
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as file:
+            json.dump(self.parameters(), file, indent=4)
+
+    def load(self, path: str) -> "timing_model":
+        with open(path) as file:
+            parameters = json.load(file)
+
+        for name, value in parameters.items():
+            setattr(self, name, value)
+
+        return self
@@ -3,10 +3,9 @@ import json
 import logging
 import random
 import sys
+import time
 
-from sdlabs_wrapper.wrapper import initialize_optimization
-
-from robot_controller import admiral, hardware_scheduler, pipette_controller
+from robot_controller import admiral, benchmark, clock, device_emulators, hardware_scheduler, impedance_analysis, pipette_controller, station_simulator, timing_model, tracing
 
 config_file = "data/config/conductivity_optimiser.json"
 #config_file = "data/config/integration_test.json"
@@ -23,15 +22,29 @@ def run_campaign() -> None:
     parser.add_argument("--sleep", default=30, help="Sleep time (in seconds) between attempts to get new suggestions from Atinary. Defaults to 30s.", type=int)
     parser.add_argument("--temp", default=25, help="Temperature set point for electrolyte analysis. Defaults to 25C.", type=float)
     parser.add_argument("--clear", default=False, help="Set true to clear mixing chamber at start. Defaults to false.", type=bool, action=argparse.BooleanOptionalAction)
+    parser.add_argument("--pipeline", default=False, help="Set true to prepare the next mixture in a batch whilst the previous one is analysed and the cell is cleaned (needs batch_size above 1 to overlap analysis). Defaults to false.",
+                        type=bool, action=argparse.BooleanOptionalAction)
+    parser.add_argument("--sequence", default="auto", help="Order in which to run each batch of suggestions: arrival, nearest, sweep or auto (quickest Peltier ramping). Defaults to auto.", type=str, choices=["arrival", "nearest", "sweep", "auto"])
+    parser.add_argument("--trace", default=None, help="Save a trace of every hardware operation here (Chrome trace JSON, with a csv breakdown of each experiment alongside).", type=str)
 
     args=parser.parse_args()
 
+    if args.trace is not None:
+        tracing.enable()
+
     device = hardware_scheduler.scheduler(device_name=args.device, resume=args.resume, home=args.home, clear=args.clear)
     
     # load config as dict
     with open(config_file, "rb") as f:
         config_dict = json.load(f)
 
+    # Only the next mixture in a batch is prepared during analysis
+    if args.pipeline is True and config_dict.get("batch_size", 1) == 1:
+        logging.warning("Pipelined mode with a batch size of 1 only overlaps mixing with cleaning, not analysis. Increase batch_size in the campaign config to overlap both.")
+
+    # Atinary client only needed for campaigns, so other tools run without it
+    from sdlabs_wrapper.wrapper import initialize_optimization
+
     wrapper = initialize_optimization(
         api_key=API_KEY,
         spec_file_content=config_dict,
@@ -50,59 +63,293 @@ def run_campaign() -> None:
             logging.error(f"No suggestions received on iteration {iteration+1}.")
             sys.exit()
 
-        for suggestion in suggestions:
+        # Get required temperatures either from parser or optimiser
+        temperatures = [station_simulator.extract_temperature(suggestion.param_values) for suggestion in suggestions]
+        temperatures = [args.temp if temp is None else temp for temp in temperatures]
+
+        # Reorder batch to reduce Peltier ramping between set points (cell is heated to 40C during cleaning)
+        order = device.test_cell.sequencer.order(temperatures, start=device.test_cell.peltier.get_t1_value(), method=args.sequence, cleaning_temp=40)
+        suggestions = [suggestions[i] for i in order]
+        temperatures = [temperatures[i] for i in order]
+
+        for k, suggestion in enumerate(suggestions):
             logging.info(f"New suggestion received for iteration {iteration+1}: {suggestion.param_values}.")
+            span = tracing.start_span("iteration", "campaign", index=iteration+1, experiment=k+1)
+
+            try:
+                target_temp = temperatures[k]
+
+                # Set point of next experiment in batch, applied as soon as cleaning finishes
+                if k+1 < len(suggestions):
+                    next_temp = temperatures[k+1]
+                else:
+                    next_temp = None
+
+                if args.pipeline is False:
+                    # Continues at the exact step reached if this suggestion was interrupted
+                    device.start_experiment(suggestion.param_values)
+
+                    # Update csv from suggestions
+                    device.update_dose_volumes(suggestion.param_values)
+                
+                    # Calculate cost of new mixture
+                    cost = device.calculate_cost()
+
+                    # Set temperature early on to reduce effective time to reach
+                    device.test_cell.peltier.set_temperature(target_temp)
+
+                    # Synthesise and analyse at target_temp
+                    device.synthesise()
+                    impedance_results = device.analyse(target_temp)
+
+                else:
+                    # Mixture may already have been prepared whilst the previous suggestion was analysed
+                    if device.preparation is None:
+                        device.start_preparation(suggestion.param_values)
+
+                    # Set temperature as soon as the previous clean (at cleaning temperature) finishes
+                    device.wait_for_clean()
+                    device.test_cell.peltier.set_temperature(target_temp)
+
+                    # Waits for previous cleaning to finish before pumping to test cell
+                    mixture = device.complete_synthesis()
+                    cost = mixture["cost"]
+
+                    # Begin preparing next mixture in batch whilst this one is analysed
+                    if k+1 < len(suggestions):
+                        device.start_preparation(suggestions[k+1].param_values)
+
+                    impedance_results = device.analyse(target_temp, fluid_vol=mixture["electrolyte_volume"])
+
+                # Build table of measurements to send e.g. [conductivity, cost]
+                results = [impedance_results[1], cost]
+
+                for i, obj in enumerate(wrapper.config.objectives):
+                    # e.g. {'conductivity': 0.06925926902246848, 'cost': 0.9500057653400364}
+                    suggestion.measurements[obj.name] = results[i] # Send data here
+
+                wrapper.send_measurements(suggestions)
+                logging.info(f"Iteration {iteration+1} measurements sent.")
+
+                if args.pipeline is False:
+                    device.finish_experiment()
+
+                # Clean test cell whilst optimiser calculates next suggestions
+                if args.pipeline is False:
+                    device.clean(next_temp=next_temp)
+                else:
+                    device.start_clean(next_temp=next_temp)
+            finally:
+                tracing.end_span(span)
 
-            # Get required temperature either from parser or optimiser
-            target_temp = extract_temperature(suggestion.param_values)
-            
+    device.close_all_ports()
+
+    if args.trace is not None:
+        tracing.current.save(args.trace)
+
+    sys.exit()
+
+def simulate_campaign() -> None:
+    parser=argparse.ArgumentParser(description="Run a campaign on a simulated device using a virtual clock, with random suggestions in place of Atinary.")
+    parser.add_argument("--device", default="simulation", help="Used to locate the device data by matching with Device ID, all connections should be inactive. Defaults to simulation.", type=str)
+    parser.add_argument("--config", default=config_file, help=f"Campaign config giving parameter ranges and budget. Defaults to {config_file}.", type=str)
+    parser.add_argument("--iterations", default=None, help="Number of experiments to run. Defaults to campaign budget.", type=int)
+    parser.add_argument("--temp", default=25, help="Temperature set point for electrolyte analysis, if not a campaign parameter. Defaults to 25C.", type=float)
+    parser.add_argument("--seed", default=0, help="Random seed for suggestions. Defaults to 0.", type=int)
+    parser.add_argument("--trace", default=None, help="Save a trace of every hardware operation in station time here (Chrome trace JSON, with a csv breakdown of each iteration alongside).", type=str)
+
+    args=parser.parse_args()
+
+    if args.trace is not None:
+        tracing.enable()
+
+    # Sleeps and simulated device durations advance the virtual clock instantly
+    virtual = clock.virtual_clock()
+    clock.set_clock(virtual)
+    random.seed(args.seed)
+
+    start = time.perf_counter()
+    device = hardware_scheduler.scheduler(device_name=args.device)
+
+    with open(args.config, "rb") as f:
+        config_dict = json.load(f)
+
+    iterations = config_dict["budget"] if args.iterations is None else args.iterations
+
+    for iteration in range(iterations):
+        values = station_simulator.random_suggestion(config_dict)
+        logging.info(f"Simulated suggestion for iteration {iteration+1}: {values}.")
+        span = tracing.start_span("iteration", "campaign", index=iteration+1)
+
+        try:
+            target_temp = station_simulator.extract_temperature(values)
             if target_temp is None:
                 target_temp = args.temp
 
-            # Update csv from suggestions
-            device.update_dose_volumes(suggestion.param_values)
-            
-            # Calculate cost of new mixture
-            cost = device.calculate_cost()
-
-            # Set temperature early on to reduce effective time to reach
+            device.update_dose_volumes(values)
             device.test_cell.peltier.set_temperature(target_temp)
 
-            # Synthesise and analyse at target_temp
             device.synthesise()
-            impedance_results = device.analyse(target_temp)
+            device.analyse(target_temp)
+            device.clean()
+        finally:
+            tracing.end_span(span)
 
-            # Build table of measurements to send e.g. [conductivity, cost]
-            results = [impedance_results[1], cost]
+        logging.info(f"Iteration {iteration+1} complete after {round(virtual.elapsed / 60, 1)}min of station time.")
 
-            for i, obj in enumerate(wrapper.config.objectives):
-                # e.g. {'conductivity': 0.06925926902246848, 'cost': 0.9500057653400364}
-                suggestion.measurements[obj.name] = results[i] # Send data here
+    device.close_all_ports()
 
-            wrapper.send_measurements(suggestions)
-            logging.info(f"Iteration {iteration+1} measurements sent.")
+    if args.trace is not None:
+        tracing.current.save(args.trace)
 
-            # Clean test cell whilst optimiser calculates next suggestions
-            device.clean()
+    logging.info(f"Simulated {iterations} iterations in {round(time.perf_counter() - start, 1)}s, the station would take {round(virtual.elapsed / 3600, 2)}h ({round(virtual.elapsed / 60 / max(iterations, 1), 1)}min per iteration).")
+    sys.exit()
+
+def emulate_devices() -> None:
+    parser=argparse.ArgumentParser(description="Emulate the station's serial devices (gantry kit, fluid handling kit, pipette, mass balance and temperature controller) on pseudo-terminals.")
+    parser.add_argument("--folder", default="/tmp/robot_controller", help="Folder for links to each emulated port, matching the emulated device in hardcoded_values.json. Defaults to /tmp/robot_controller.", type=str)
+    parser.add_argument("--time-scale", default=1.0, help="Speed up device time (motion, pumping, delays) by this factor. Defaults to 1 (real time).", type=float)
+
+    args=parser.parse_args()
+
+    emulators = device_emulators.emulate_station(args.folder, args.time_scale)
+    logging.info("Device emulators running, connect with --device emulated. Press Ctrl+C to stop.")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+    for emulator in emulators.values():
+        emulator.stop()
+        logging.info(f"Emulated {emulator.name}: {emulator.commands} commands, {emulator.bytes_received} bytes received ({emulator.bytes_dropped} dropped), {emulator.bytes_sent} bytes sent.")
+
+    sys.exit()
+
+def benchmark_station() -> None:
+    parser=argparse.ArgumentParser(description="Benchmark one campaign iteration (update_dose_volumes, synthesise, analyse, clean) for representative recipes against emulated devices.")
+    parser.add_argument("--recipes", default="data/benchmarks/recipes.json", help="Representative recipes to run. Defaults to data/benchmarks/recipes.json.", type=str)
+    parser.add_argument("--only", default=None, nargs="*", help="Names of recipes to run. Defaults to all.", type=str)
+    parser.add_argument("--iterations", default=1, help="Iterations of each recipe. Defaults to 1.", type=int)
+    parser.add_argument("--time-scale", default=10.0, help="Speed up device time (motion, pumping, temperature ramps) by this factor. Defaults to 10.", type=float)
+    parser.add_argument("--results", default="data/benchmarks/results.jsonl", help="Results are appended here and earlier runs used as baseline. Defaults to data/benchmarks/results.jsonl.", type=str)
+    parser.add_argument("--tolerance", default=0.1, help="Fractional increase over baseline reported as a regression. Defaults to 0.1.", type=float)
+    parser.add_argument("--window", default=5, help="Number of earlier runs in baseline. Defaults to 5.", type=int)
+
+    args=parser.parse_args()
+
+    station = benchmark.station_benchmark(args.recipes, args.results, args.time_scale)
+
+    records = station.run(args.iterations, args.only)
+    station.report(records)
+
+    # Earlier runs only, this one is already saved
+    regressions = station.compare(records, args.tolerance, args.window)
+
+    for regression in regressions:
+        logging.error("Regression: " + regression)
+
+    if len(regressions) > 0:
+        sys.exit(1)
+
+    logging.info(f"No regressions against {args.results}.")
+    sys.exit()
+
+def predict_throughput() -> None:
+    parser=argparse.ArgumentParser(description="Predict experiments per day for a campaign using a discrete-event simulation of the station.")
+    parser.add_argument("--config", default=config_file, help=f"Campaign config giving parameter ranges, batch size and budget. Defaults to {config_file}.", type=str)
+    parser.add_argument("--logs", default=[], nargs="*", help="Log files of real runs (e.g. mixing_station.log and rotated mixing_station.log.1.gz) to fit operation durations from. Unfitted operations use the simulated controllers.", type=str)
+    parser.add_argument("--model", default=None, help="Load a previously fitted timing model (JSON) instead of fitting from logs.", type=str)
+    parser.add_argument("--save-model", default=None, help="Save fitted timing model (JSON) for later use.", type=str)
+    parser.add_argument("--experiments", default=None, help="Number of experiments to simulate. Defaults to campaign budget.", type=int)
+    parser.add_argument("--batch", default=None, help="Suggestions per batch. Defaults to campaign batch size.", type=int)
+    parser.add_argument("--strategy", default="both", help="Scheduler strategy: sequential, pipelined or both. Defaults to both.", type=str, choices=["sequential", "pipelined", "both"])
+    parser.add_argument("--sequence", default="auto", help="Order in which to run each batch of suggestions: arrival, nearest, sweep or auto. Defaults to auto.", type=str, choices=["arrival", "nearest", "sweep", "auto"])
+    parser.add_argument("--temp", default=25, help="Temperature set point for electrolyte analysis, if not a campaign parameter. Defaults to 25C.", type=float)
+    parser.add_argument("--seed", default=0, help="Random seed for suggestions. Defaults to 0.", type=int)
+
+    args=parser.parse_args()
+
+    model = timing_model.timing_model()
+
+    if args.model is not None:
+        model.load(args.model)
+    elif len(args.logs) > 0:
+        model.fit(args.logs)
+
+    if args.save_model is not None:
+        model.save(args.save_model)
+
+    with open(args.config, "rb") as f:
+        config_dict = json.load(f)
+
+    random.seed(args.seed)
+    count = config_dict["budget"] if args.experiments is None else args.experiments
+    batch_size = config_dict.get("batch_size", 1) if args.batch is None else args.batch
+
+    strategies = ["sequential", "pipelined"] if args.strategy == "both" else [args.strategy]
+
+    # Suggestions and simulated controllers report every operation
+    logging.disable(logging.INFO)
+    suggestions = station_simulator.campaign_suggestions(config_dict, count, args.temp)
+    simulator = station_simulator.station_simulator(model)
+    results = [simulator.run(suggestions, strategy, args.sequence, batch_size) for strategy in strategies]
+    logging.disable(logging.NOTSET)
+
+    simulator.close()
+
+    for result in results:
+        rate = f"{result['experiments']} experiments in {round(result['total_time'] / 3600, 2)}h, {round(result['experiments_per_day'], 1)} experiments per day"
+        logging.info(f"{result['strategy'].capitalize()}: {rate} (mixer {round(100 * result['mixer_utilisation'])}% and test cell {round(100 * result['cell_utilisation'])}% busy).")
+        logging.info("Mean phase durations: " + ", ".join(f"{phase} {round(duration)}s" for phase, duration in result["phases"].items()) + ".")
 
-    device.close_all_ports()
     sys.exit()
 
-def extract_temperature(values: dict) -> float | None:
-    for name in values:
-        # Loop through all and check if Temperature
-        if name == "Temperature":
-            new_value = values[name]
-            logging.info(f"New temperature found in received suggestions: {new_value}C.")
-            return new_value
+def reprocess_results() -> None:
+    parser=argparse.ArgumentParser(description="Recalculate impedance properties for every AC dataset in the results folder.")
+    parser.add_argument("--device", default=None, help="Used to locate the cell constant in the device data by matching with Device ID.", type=str)
+    parser.add_argument("--cell-constant", default=None, help="Cell constant to use instead of the device data value.", type=float)
+    parser.add_argument("--path", default="data/results/", help="Results folder containing the spectrum store and any older ID_*_AC.csv datasets. Defaults to data/results/.", type=str)
+    parser.add_argument("--output", default="data/results/reprocessed_results.csv", help="Consolidated results table. Defaults to data/results/reprocessed_results.csv.", type=str)
+    parser.add_argument("--workers", default=None, help="Number of worker processes. Defaults to number of CPUs.", type=int)
+    parser.add_argument("--fit", default=True, help="Set false to skip equivalent circuit fitting. Defaults to true.", type=bool, action=argparse.BooleanOptionalAction)
+
+    args=parser.parse_args()
+
+    cell_constant = args.cell_constant
+
+    if cell_constant is None:
+        if args.device is None:
+            logging.error("Please provide either a device ID or a cell constant.")
+            sys.exit()
+
+        with open("data/devices/hardcoded_values.json") as json_data:
+            device_data = json.load(json_data)
+
+        for device in device_data["Mixing Stations"]:
+            if device["ID"] == args.device:
+                cell_constant = device["Cell_Constant"]
 
-    return None
+        if cell_constant is None:
+            logging.error("Device data for " + args.device + " could not be located.")
+            sys.exit()
+
+    start = time.perf_counter()
+    table = impedance_analysis.reprocess_archive(args.path, cell_constant, fit=args.fit, workers=args.workers)
+
+    table.to_csv(args.output, index=False)
+    logging.info(f"Reprocessed {len(table)} datasets in {round(time.perf_counter() - start, 2)}s, results saved to {args.output}.")
+
+    sys.exit()
 
 def test_atinary() -> None:
     # load config as dict
     with open(config_file, "rb") as f:
         config_dict = json.load(f)
     
+    from sdlabs_wrapper.wrapper import initialize_optimization
+
     wrapper = initialize_optimization(
         api_key=API_KEY,
         spec_file_content=config_dict,
@@ -0,0 +1,218 @@
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+from csv import DictWriter
+from typing import Callable, ParamSpec, TypeVar
+
+from robot_controller import clock
+
+logging.basicConfig(level = logging.INFO)
+
+class tracer:
+    def __init__(self) -> None:
+        # Timed spans of hardware operations and scheduler phases, nested per thread. Times come from the
+        # station clock, so a simulated campaign is traced in station time.
+        self.enabled = False
+        self.spans = [] # finished spans
+        self.lock = threading.Lock()
+        self.local = threading.local() # stack of open spans for each thread
+
+    def stack(self) -> list[dict]:
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+
+        return self.local.stack
+
+    def start_span(self, name: str, category: str = "station", **attributes: object) -> dict | None:
+        if self.enabled is False:
+            return None
+
+        stack = self.stack()
+        thread = threading.current_thread()
+
+        span = {"name": name,
+                "category": category,
+                "start": clock.monotonic(), # s
+                "duration": None, # s
+                "thread": thread.ident,
+                "thread_name": thread.name,
+                "depth": len(stack),
+                "parent": stack[-1]["name"] if len(stack) > 0 else None,
+                "attributes": attributes,
+            }
+
+        stack.append(span)
+        return span
+
+    def end_span(self, span: dict | None, **attributes: object) -> None:
+        if span is None:
+            return
+
+        span["duration"] = clock.monotonic() - span["start"]
+        span["attributes"].update(attributes)
+
+        stack = self.stack()
+        for i in reversed(range(len(stack))):
+            if stack[i] is span:
+                del stack[i]
+                break
+
+        with self.lock:
+            self.spans.append(span)
+
+    def annotate(self, **attributes: object) -> None:
+        # Add attributes to innermost open span on this thread, e.g. firmware reported duration
+        if self.enabled is True and len(self.stack()) > 0:
+            self.stack()[-1]["attributes"].update(attributes)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.spans = []
+
+    def export_chrome(self, path: str) -> None:
+        # Chrome trace event format, opened with chrome://tracing or https://ui.perfetto.dev
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+
+        origin = spans[0]["start"] if len(spans) > 0 else 0.0
+        pid = os.getpid()
+
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": thread, "args": {"name": name}}
+                  for thread, name in {span["thread"]: span["thread_name"] for span in spans}.items()]
+
+        for span in spans:
+            events.append({"name": span["name"],
+                           "cat": span["category"],
+                           "ph": "X",
+                           "ts": round(1e6 * (span["start"] - origin), 1), # us
+                           "dur": round(1e6 * span["duration"], 1), # us
+                           "pid": pid,
+                           "tid": span["thread"],
+                           "args": {name: value if isinstance(value, (int, float, str, bool)) or value is None else str(value) for name, value in span["attributes"].items()},
+                })
+
+        folder = os.path.dirname(path)
+        if folder != "" and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with open(path, 'w') as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+        logging.info(f"Saved trace of {len(spans)} spans to {path}.")
+
+    def breakdown(self, iteration: str = "iteration") -> list[dict]:
+        # Total time of each operation within each iteration span (from any thread, by start time).
+        # Nested operations are included in their parents' totals, so percentages add up per depth.
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+
+        rows = []
+
+        for index, outer in enumerate([span for span in spans if span["name"] == iteration]):
+            end = outer["start"] + outer["duration"]
+            operations = {}
+
+            for span in spans:
+                if span is outer or span["name"] == iteration or not (outer["start"] <= span["start"] < end):
+                    continue
+
+                depth = span["depth"] - outer["depth"] if span["thread"] == outer["thread"] else span["depth"] + 1
+                row = operations.setdefault((span["category"], span["name"]), {"depth": depth, "count": 0, "total": 0.0})
+
+                row["depth"] = min(row["depth"], depth)
+                row["count"] += 1
+                row["total"] += span["duration"]
+
+            # Time not covered by any top level operation
+            covered = sum(span["duration"] for span in spans if span is not outer and span["name"] != iteration and span["thread"] == outer["thread"] and span["depth"] == outer["depth"] + 1 and outer["start"] <= span["start"] < end)
+
+            for (category, name), row in operations.items():
+                rows.append({"iteration": outer["attributes"].get("index", index + 1),
+                             "category": category,
+                             "operation": name,
+                             "depth": row["depth"],
+                             "count": row["count"],
+                             "total": round(row["total"], 3), # s
+                             "percent": round(100 * row["total"] / outer["duration"], 1) if outer["duration"] > 0 else 0.0,
+                    })
+
+            rows.append({"iteration": outer["attributes"].get("index", index + 1),
+                         "category": "station",
+                         "operation": "untraced",
+                         "depth": 1,
+                         "count": 1,
+                         "total": round(max(outer["duration"] - covered, 0), 3),
+                         "percent": round(100 * max(outer["duration"] - covered, 0) / outer["duration"], 1) if outer["duration"] > 0 else 0.0,
+                })
+
+        return rows
+
+    def export_breakdown(self, path: str) -> None:
+        rows = self.breakdown()
+
+        with open(path, 'w', newline='') as file:
+            writer = DictWriter(file, fieldnames=["iteration", "category", "operation", "depth", "count", "total", "percent"])
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def log_breakdown(self) -> None:
+        rows = self.breakdown()
+
+        for iteration in dict.fromkeys(row["iteration"] for row in rows):
+            logging.info(f"Iteration {iteration} breakdown: operation, count, total (s), % of iteration")
+
+            for row in [row for row in rows if row["iteration"] == iteration]:
+                indent = "  " * row["depth"]
+                logging.info(f"    {indent + row['category'] + '.' + row['operation']:<48} {row['count']:>5} {row['total']:>10.1f} {row['percent']:>6.1f}")
+
+    def save(self, path: str) -> None:
+        # Chrome trace at path, with the per iteration breakdown alongside as csv
+        self.export_chrome(path)
+        self.export_breakdown(os.path.splitext(path)[0] + ".csv")
+        self.log_breakdown()
+
+# Tracer used by all controllers, enabled with enable()
+current = tracer()
+
+def enable() -> tracer:
+    current.enabled = True
+    return current
+
+def start_span(name: str, category: str = "station", **attributes: object) -> dict | None:
+    return current.start_span(name, category, **attributes)
+
+def end_span(span: dict | None, **attributes: object) -> None:
+    current.end_span(span, **attributes)
+
+def annotate(**attributes: object) -> None:
+    current.annotate(**attributes)
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+def traced(category: str) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    # Decorator for controller methods, e.g. @tracing.traced("gantry"). Scalar arguments become span attributes.
+    def decorator(function: Callable[P, R]) -> Callable[P, R]:
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            if current.enabled is False:
+                return function(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            attributes = {name: value for name, value in bound.arguments.items() if name != "self" and (isinstance(value, (int, float, str, bool)) or value is None)}
+
+            span = current.start_span(function.__name__, category, **attributes)
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                current.end_span(span)
+
+        return wrapper
+
+    return decorator